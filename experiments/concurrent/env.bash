@@ -111,7 +111,7 @@ fi
 #
 # note: we always run vmstat regardless of the instrument flag.
 mm cc exec bash -c "'echo ethtool -S $ifname > /ethtool.bash'"
-mm cc background bash -c '"vmstat 5 > /que/vmstat.log"'
+mm cc background bash -c '"TZ=UTC vmstat -t 5 > /que/vmstat.log"'
 mm cc background bash -c '"dmesg -t -w > /que/dmesg"'
 
 if [[ "$INSTRUMENT" == "true" ]] ; then
@@ -52,9 +52,18 @@ ssh $head "echo INTERFACE=$interface >> params-physical.bash"
 ssh $head ip link set $interface up
 
 # copy analysis scripts
+scp ../../tools/utils.py $head:
+scp ../../tools/series.py $head:
+scp ../../tools/bootstrap.py $head:
 scp ../../tools/summarize_test_results.py $head:
 scp ../../tools/combine.py $head:
-scp ../../tools/utils.py $head:
+scp ../../tools/batch.py $head:
+scp ../../tools/query.py $head:
+scp ../../tools/pivot.py $head:
+scp ../../tools/effects.py $head:
+scp ../../tools/variance.py $head:
+scp ../../tools/rollup.py $head:
+scp ../../tools/correlate.py $head:
 
 # wait for rond to start
 sleep 10
@@ -9,6 +9,8 @@
 #   bash prep.bash ccc 10 12 foo
 #
 #   bash prep.bash en 10 12 bar
+#
+# Set SKIP_COPY=1 if the files were already copied with tools/distribute.py.
 
 if [ $# -ne 4 ]; then
     echo "USAGE: $0 PREFIX START END CONTEXT"
@@ -28,27 +30,42 @@ function prep {
 
     echo "== prep'n $host =="
 
-    scp ~/que_vendor/* $host:
+    if [ -z "$SKIP_COPY" ]; then
+        scp ~/que_vendor/* $host:
+    fi
 
     # extract and update container filesystems
     ssh $host tar -xf quefs.tar.gz
 
-    scp launch.bash $host:
+    if [ -z "$SKIP_COPY" ]; then
+        scp launch.bash $host:
+    fi
     ssh $host bash launch.bash $CONTEXT
 
     # wait for minimega to start
     sleep 5
 
-    # push environment scripts
-    scp env.bash $host:
-    scp run.bash $host:
-    scp sweep.bash $host:
-    scp params-*.bash $host:
-
-    # push post-processing scripts
-    scp ../../tools/summarize_test_results.py $host:
-    scp ../../tools/combine.py $host:
-    scp ../../tools/utils.py $host:
+    if [ -z "$SKIP_COPY" ]; then
+        # push environment scripts
+        scp env.bash $host:
+        scp run.bash $host:
+        scp sweep.bash $host:
+        scp params-*.bash $host:
+
+        # push post-processing scripts
+        scp ../../tools/utils.py $host:
+        scp ../../tools/series.py $host:
+        scp ../../tools/bootstrap.py $host:
+        scp ../../tools/summarize_test_results.py $host:
+        scp ../../tools/combine.py $host:
+        scp ../../tools/batch.py $host:
+        scp ../../tools/query.py $host:
+        scp ../../tools/pivot.py $host:
+        scp ../../tools/effects.py $host:
+        scp ../../tools/variance.py $host:
+        scp ../../tools/rollup.py $host:
+        scp ../../tools/correlate.py $host:
+    fi
 
     ssh $host cp /root/protonuke $TMPDIR/
 
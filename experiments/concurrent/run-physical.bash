@@ -61,7 +61,7 @@ rond exec mkdir /que
 #
 # note: we always run vmstat regardless of the instrument flag.
 rond exec bash -c "'echo ethtool -S $INTERFACE > /ethtool.bash'"
-rond bg bash -c '"vmstat 5 > /que/vmstat.log"'
+rond bg bash -c '"TZ=UTC vmstat -t 5 > /que/vmstat.log"'
 
 # record system info
 rond exec bash -c '"lscpu > /que/lscpu"'
@@ -117,7 +117,7 @@ if [[ "$INSTRUMENT" == "true" ]] ; then
     rond bg bash -c "'powstream -t -L 10 -i 0.01 -c 100 -d /que/owamp/client -p 10.0.0.1 > /que/powstream-c2s.out 2> /que/powstream-c2s.err'"
 fi
 
-rond bg bash -c "'ab -s 60 -c $NWORKERS -l -n $NREQUESTS $URL > /que/ab.out 2> /que/ab.err'"
+rond bg bash -c "'ab -s 60 -c $NWORKERS -l -n $NREQUESTS -g /que/ab.tsv $URL > /que/ab.out 2> /que/ab.err'"
 
 # let traffic start
 sleep 10
@@ -107,7 +107,8 @@ start_experiment () {
     #  -t: duration of test (not used, we run for a fixed number of requests instead)
     #  -n: number of requests (-t => -n 50000 but we want it to run for longer)
     #  -s: seconds to max. wait for each response (default is 30)
-    mm namespace $namespace cc background bash -c "'ab -s 60 -c $NWORKERS -l -n $NREQUESTS $URL > /que/ab.out 2> /que/ab.err'"
+    #  -g: write the time of each request, for the latency histograms
+    mm namespace $namespace cc background bash -c "'ab -s 60 -c $NWORKERS -l -n $NREQUESTS -g /que/ab.tsv $URL > /que/ab.out 2> /que/ab.err'"
 
     # how we did it with protonuke
     #for j in $(seq $nworkers); do
@@ -459,7 +460,7 @@ mkdir -p $dir
         mm .preprocess false mesh send all shell bash -c '"lscpu > '$TMPDIR'/lscpu.$(hostname)"'
         mm .preprocess false mesh send all shell bash -c '"kvm -version > '$TMPDIR'/kvm.$(hostname)"'
         mm .preprocess false mesh send all shell bash -c '"cp /proc/interrupts '$TMPDIR'/interrupts.before.$(hostname)"'
-        mm .preprocess false mesh send all background bash -c '"vmstat 5 > '$TMPDIR'/vmstat.$(hostname)"'
+        mm .preprocess false mesh send all background bash -c '"TZ=UTC vmstat -t 5 > '$TMPDIR'/vmstat.$(hostname)"'
         if [[ "$VMTYPE" == "kvm" ]]; then
             # TODO: only include when INSTRUMENT=true?
             mm .preprocess false mesh send all background bash -c '"perf kvm --host stat record -a -o '$TMPDIR/'kvm.trace.$(hostname)"'
@@ -470,7 +471,7 @@ mkdir -p $dir
         lscpu > $dir/lscpu.$(hostname)
         kvm --version > $dir/kvm.$(hostname)
         cp /proc/interrupts $dir/interrupts.before.$(hostname)
-        vmstat 5 > $dir/vmstat.$(hostname) &
+        TZ=UTC vmstat -t 5 > $dir/vmstat.$(hostname) &
     fi
 
     # enable or disable offloading on the physical hosts
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Runs many jobs of the other tools, such as combine.py or
+summarize_test_results.py, from one process instead of starting python for
+each of them. A job is a command line, like the ones that would be passed to
+parallel, and jobs come from the arguments, a file (-f), or stdin. With
+--command, each line is substituted for {} in the command instead, like
+parallel does.
+
+Jobs run in a pool of worker processes that each compile a tool once and then
+run it as __main__ for every job they are given so that the interpreter
+startup and the imports (numpy, mostly) are only paid once per worker.
+
+Usage: find . -maxdepth 1 -mindepth 1 -type d | python batch.py -j4 --command 'combine.py -f {} {}.sqlite3'
+'''
+
+import gc
+import logging
+import multiprocessing
+import os
+import pipes
+import shlex
+import sys
+import time
+import traceback
+
+# tools are looked up next to this script when they are not found as given
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+
+# code of the tools that this process has already compiled, by path
+compiled = {}
+
+
+def parse_job(line, command=None):
+    """
+    parse_job returns the argv for a job, the path to the tool followed by its
+    arguments. If command is given, each {} in it is replaced with the quoted
+    line. A leading python is dropped.
+    """
+    if command is not None:
+        line = command.replace("{}", pipes.quote(line))
+
+    argv = shlex.split(line)
+    if len(argv) > 0 and os.path.basename(argv[0]).startswith("python"):
+        argv = argv[1:]
+
+    if len(argv) == 0:
+        raise ValueError("no tool to run: {}".format(line))
+
+    script = argv[0]
+    if not os.path.exists(script):
+        script = os.path.join(TOOLS, os.path.basename(script))
+
+    return [script] + argv[1:]
+
+
+def run_job(argv):
+    """
+    run_job runs the tool in argv[0] as __main__ with argv as sys.argv and
+    returns the argv, exit status, and how long it took.
+    """
+    start = time.time()
+
+    script = argv[0]
+
+    saved = sys.argv
+    sys.argv = list(argv)
+
+    try:
+        code = compiled.get(script)
+        if code is None:
+            with open(script) as f:
+                code = compile(f.read(), script, "exec")
+
+            compiled[script] = code
+
+            # for the tool's own imports, like running it directly would
+            path = os.path.dirname(os.path.abspath(script))
+            if path not in sys.path:
+                sys.path.insert(0, path)
+
+        exec(code, {"__name__": "__main__", "__file__": script})
+        status = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            status = e.code or 0
+        else:
+            logging.error("{}: {}".format(" ".join(argv), e.code))
+            status = 1
+    except Exception:
+        logging.error("{} failed:\n{}".format(" ".join(argv), traceback.format_exc()))
+        status = 1
+    finally:
+        sys.argv = saved
+
+        # the tool's globals are a cycle (its functions refer to them) so
+        # files it left open are only closed by the collector, and workers
+        # exit without running it
+        gc.collect()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    return argv, status, time.time() - start
+
+
+def read_jobs(fh, command=None):
+    """
+    read_jobs yields the argv for each non-empty line in fh
+    """
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield parse_job(line, command)
+
+
+def run(jobs, processes=1):
+    """
+    run runs the jobs, each an argv, with a pool of processes and returns the
+    number that failed. With one process, the jobs run in this process.
+    """
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(run_job, jobs)
+    else:
+        pool = None
+        results = (run_job(argv) for argv in jobs)
+
+    count = 0
+    failed = 0
+
+    for argv, status, elapsed in results:
+        count += 1
+        if status != 0:
+            failed += 1
+            logging.error("exit status {} after {:.2f}s: {}".format(status, elapsed, " ".join(argv)))
+        else:
+            logging.debug("finished in {:.2f}s: {}".format(elapsed, " ".join(argv)))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    logging.info("ran {} jobs, {} failed".format(count, failed))
+
+    return failed
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='run many jobs of the tools in one process')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-j', '--jobs', dest='processes', type=int, default=multiprocessing.cpu_count(), help='worker processes to run jobs with (default: number of CPUs)')
+    parser.add_argument('-f', '--file', metavar='FILE', type=str, help='file with a job per line, - for stdin (default, if there are no JOB arguments)')
+    parser.add_argument('--command', metavar='COMMAND', type=str, help='command to run for each line with the line in place of {}')
+    parser.add_argument('jobs', metavar='JOB', type=str, nargs='*', help='jobs to run, e.g. "combine.py -f DIR DIR.sqlite3"')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    if args.processes < 1:
+        parser.error("invalid number of jobs: {}".format(args.processes))
+
+    jobs = [parse_job(v, args.command) for v in args.jobs]
+
+    if args.file or len(args.jobs) == 0:
+        if args.file is None or args.file == '-':
+            jobs.extend(read_jobs(sys.stdin, args.command))
+        else:
+            with open(args.file) as fh:
+                jobs.extend(read_jobs(fh, args.command))
+
+    if run(jobs, args.processes) > 0:
+        sys.exit(1)
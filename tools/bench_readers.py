@@ -0,0 +1,239 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Benchmark the file readers from summarize_test_results.py on large generated
+files against the line by line parsing that they used to do.
+'''
+
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+import summarize_test_results as summarize
+
+
+def grouped(rows):
+    """
+    Groups (side, field, value) rows by (side, field), keeping the order of
+    the values within each group. Readers return series (e.g. vmstat) field
+    by field rather than line by line so only the groups can be compared.
+    """
+    res = {}
+    for side, field, value in rows:
+        res.setdefault((side, field), []).append(float(value))
+
+    return res
+
+
+def line_vmstat(f, direction):
+    """ Reads vmstat output line by line """
+    for line in f:
+        try:
+            fields = line.strip().split()
+            for i, value in enumerate(fields):
+                field_name = summarize.VmStatsReader.fields_names[i]
+
+                yield direction, "vm_{}".format(field_name), int(value)
+        except:
+            pass
+
+
+def line_interrupts(f, direction):
+    """ Reads /proc/interrupts line by line """
+    cpu_count = len(f.readline().split())
+
+    for line in f:
+        fields = line.strip().split()
+        if len(fields) < 3:
+            continue
+
+        irq = fields[0].strip(':')
+        if irq.isdigit():
+            irq = fields[-1].lower()
+
+        irq = re.sub("[^a-z0-9_]", "_", irq.lower())
+
+        yield direction, "int_{}".format(irq), sum(int(v) for v in fields[1:cpu_count+1])
+
+
+def line_sysdig(f, direction):
+    """ Reads sysdig topscalls output line by line """
+    f.readline()
+    f.readline()
+
+    for line in f:
+        parts = line.split()
+        if len(parts) != 2:
+            break
+        yield direction, "sc_all_{}".format(parts[1]), int(parts[0])
+
+
+def line_owamp(f):
+    """ Reads owping output line by line """
+    packet_summary = re.compile('^(?P<packets>\d+) sent, (?P<lost>\d+) lost.*, (?P<dups>\d+) duplicates')
+    jitter_summary = re.compile('^one-way jitter = (?P<jitter>\d+\.?\d*) ms')
+
+    direction = "client"
+    for line in f:
+        line = line.strip()
+
+        m = packet_summary.match(line)
+        if m:
+            yield direction, "owamp_packets", int(m.group('packets'))
+            yield direction, "owamp_lost", int(m.group('lost'))
+            yield direction, "owamp_dups", int(m.group('dups'))
+
+        m = jitter_summary.match(line)
+        if m:
+            yield direction, "owamp_jitter", float(m.group('jitter'))
+            direction = "server"
+
+
+def line_ab(f):
+    """ Reads Apache Bench output line by line """
+    patterns = [
+        (re.compile('^Time taken for tests:\s+(\d+\.?\d*) seconds'), "ab_time_taken", float),
+        (re.compile('^Requests per second:\s+(\d+\.?\d*)'), "ab_requests_per_second", float),
+        (re.compile('^Transfer rate:\s+(\d+\.?\d*)'), "ab_transfer_rate", float),
+        (re.compile('^Complete requests:\s+(\d+\.?\d*)'), "ab_completed_requests", int),
+        (re.compile('^Failed requests:\s+(\d+\.?\d*)'), "ab_failed_requests", int),
+    ]
+
+    for line in f:
+        line = line.strip()
+        logging.debug("Reading: {line}".format(line=line))
+
+        for regex, field, kind in patterns:
+            m = regex.match(line)
+            if m:
+                yield "client", field, kind(m.group(1))
+
+
+def write_vmstat(fname, lines):
+    with open(fname, 'w') as f:
+        f.write("procs -----------memory---------- ---swap-- -----io---- -system-- ------cpu-----\n")
+        f.write(" r  b   swpd   free   buff  cache   si   so    bi    bo   in   cs us sy id wa st\n")
+        for i in range(lines):
+            f.write(" ".join(str(random.randint(0, 100000)) for _ in range(17)) + "\n")
+
+
+def write_interrupts(fname, lines, cpus):
+    with open(fname, 'w') as f:
+        f.write(" ".join("CPU{}".format(i) for i in range(cpus)) + "\n")
+        for i in range(lines):
+            counts = " ".join("{:10d}".format(random.randint(0, 10**8)) for _ in range(cpus))
+            f.write("{:4d}: {}  IR-PCI-MSI {}-edge  eth0-TxRx-{}\n".format(i, counts, i, i))
+        f.write(" ERR:          0\n")
+
+
+def write_sysdig(fname, lines):
+    # sysdig only reports on the syscalls that were made, a few hundred at
+    # most, but the file is as large as the others so that it can be timed
+    with open(fname, 'w') as f:
+        f.write("# Calls             Syscall\n")
+        f.write("-"*80 + "\n")
+        for i in range(lines):
+            f.write("{:<20d}syscall{}\n".format(random.randint(0, 10**6), i))
+
+
+def write_owamp(fname, lines):
+    with open(fname, 'w') as f:
+        # verbose owping output has a line per packet before the summary of
+        # each direction
+        for direction in range(2):
+            f.write("--- owping statistics from [client]:8852 to [server]:8834 ---\n")
+            for i in range(lines // 2):
+                f.write("seq_no={} delay={:.2e} ms (unsync)\n".format(i, random.uniform(900, 1000)))
+            f.write("{} sent, {} lost (0.000%), {} duplicates\n".format(lines // 2, random.randint(0, 10), random.randint(0, 10)))
+            f.write("one-way delay min/median/max = 971/971/988 ms, (unsync)\n")
+            f.write("one-way jitter = {:.1f} ms (P95-P50)\n".format(random.uniform(0, 2)))
+            f.write("no reordering\n")
+
+
+def write_ab(fname, lines):
+    with open(fname, 'w') as f:
+        # verbose ab output has a line per request before the summary
+        for i in range(lines):
+            f.write("LOG: Response code = 200\n")
+        f.write("Time taken for tests:   32.885 seconds\n")
+        f.write("Complete requests:      500000\n")
+        f.write("Failed requests:        0\n")
+        f.write("Requests per second:    15204.37 [#/sec] (mean)\n")
+        f.write("Transfer rate:          6988.57 [Kbytes/sec] received\n")
+
+
+def timed(fn, repeat):
+    """ Returns the best time and the result of calling fn """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        res = fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, res
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='benchmark the file readers on generated files')
+    parser.add_argument('-n', '--lines', type=int, default=200000, help='lines per generated file')
+    parser.add_argument('-c', '--cpus', type=int, default=64, help='CPUs in generated interrupts file')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per reader, best is reported')
+    parser.add_argument('-d', '--dir', type=str, help='directory for generated files (default: temporary)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(levelname)s %(message)s')
+
+    tmp = args.dir or tempfile.mkdtemp()
+    random.seed(0)
+
+    cases = [
+        ("vmstat", "vmstat.log", lambda fname: write_vmstat(fname, args.lines),
+            summarize.VmStatsReader("client"), lambda f: line_vmstat(f, "client")),
+        ("interrupts", "interrupts", lambda fname: write_interrupts(fname, args.lines // 10, args.cpus),
+            summarize.InterruptsReader("client"), lambda f: line_interrupts(f, "client")),
+        ("sysdig", "topscalls-all.out", lambda fname: write_sysdig(fname, args.lines),
+            summarize.SysdigFreqReader("client"), lambda f: line_sysdig(f, "client")),
+        ("owamp", "owping.out", lambda fname: write_owamp(fname, args.lines),
+            summarize.OwampReader(), line_owamp),
+        ("ab", "ab.out", lambda fname: write_ab(fname, args.lines),
+            summarize.aBenchReader(), line_ab),
+    ]
+
+    print("{:<12} {:>8} {:>10} {:>10} {:>8}".format("reader", "MB", "lines (s)", "mmap (s)", "speedup"))
+
+    try:
+        for name, fname, write, reader, baseline in cases:
+            fname = os.path.join(tmp, fname)
+            write(fname)
+            size = os.path.getsize(fname) / 1024. / 1024.
+
+            def run_baseline():
+                with open(fname) as f:
+                    return list(baseline(f))
+
+            def run_reader():
+                with open(fname) as f:
+                    return reader.readbatch(f)
+
+            before, expected = timed(run_baseline, args.repeat)
+            after, actual = timed(run_reader, args.repeat)
+
+            if grouped(expected) != grouped(actual):
+                logging.error("{} reader does not match line by line parsing".format(name))
+
+            print("{:<12} {:>8.1f} {:>10.3f} {:>10.3f} {:>7.1f}x".format(name, size, before, after, before/after))
+    finally:
+        if args.dir is None:
+            shutil.rmtree(tmp)
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Bootstrap confidence intervals for the median, p95, and mean of each
+(experiment, side, field) in the summary table, stored in the summary_ci
+table. Groups with the same number of values share one matrix of resample
+indices so that all of them are resampled with a few NumPy operations.
+'''
+
+import collections
+import logging
+import multiprocessing
+
+import numpy
+
+import utils
+
+exemplar = collections.OrderedDict([
+    ("experiment", 0),
+    ("field", "example"),
+    ("side", "client"),
+    ("resamples", 0),
+    ("confidence", 0.0),
+    ("median_lo", 0.0),
+    ("median_hi", 0.0),
+    ("p95_lo", 0.0),
+    ("p95_hi", 0.0),
+    ("mean_lo", 0.0),
+    ("mean_hi", 0.0),
+])
+
+# most estimates to compute at once, bounds the memory used per chunk
+CHUNK = 1 << 22
+
+
+def resample(args):
+    """
+    resample returns the (lo, hi) intervals of the median, p95, and mean for
+    each row of values, which must be sorted and all have the same length.
+    The resample indices only depend on the seed and the length so the
+    results are the same no matter how the groups are split up between
+    processes.
+
+    Since the rows are sorted, sorting the indices of each resample once
+    gives the sorted resample of every row. The order statistics can then be
+    read from fixed columns instead of sorting each resample, and the means
+    are a product with the number of times each value was picked.
+    """
+    values, resamples, confidence, seed = args
+
+    count, n = values.shape
+    rng = numpy.random.RandomState([seed, n])
+    index = numpy.sort(rng.randint(0, n, size=(resamples, n)), axis=1)
+
+    picks = numpy.bincount((index + n * numpy.arange(resamples)[:, None]).ravel(), minlength=resamples*n)
+    picks = picks.reshape(resamples, n).T / float(n)
+
+    # same linear interpolation as numpy.percentile
+    columns = []
+    for q in [50, 95]:
+        pos = (n - 1) * q / 100.
+        below = int(numpy.floor(pos))
+        above = min(below + 1, n - 1)
+        columns.append((index[:, below], index[:, above], pos - below))
+
+    alpha = (1 - confidence) / 2 * 100
+    res = numpy.empty((count, 6))
+
+    step = max(1, CHUNK // resamples)
+    for i in range(0, count, step):
+        rows = values[i:i+step]
+
+        estimates = [rows[:, below] * (1 - frac) + rows[:, above] * frac for below, above, frac in columns]
+        estimates.append(rows.dot(picks))
+
+        for j, v in enumerate(estimates):
+            res[i:i+step, 2*j:2*j+2] = numpy.percentile(v, [alpha, 100 - alpha], axis=1).T
+
+    return res
+
+
+class Bootstrap(object):
+    """
+    Computes and stores confidence intervals with the given number of
+    resamples. If processes is more than one, groups of different sizes are
+    resampled in parallel.
+    """
+
+    def __init__(self, resamples=1000, confidence=0.95, seed=0, processes=1):
+        self.resamples = resamples
+        self.confidence = confidence
+        self.seed = seed
+        self.processes = processes
+
+    def intervals(self, groups):
+        """
+        intervals returns a map from each key in groups, a map from key to
+        values, to the intervals from resample. Groups with fewer than two
+        values are skipped.
+        """
+        sizes = {}
+        for k, vals in groups.items():
+            if len(vals) > 1:
+                sizes.setdefault(len(vals), []).append(k)
+
+        # split each size into chunks so that large sizes can be spread
+        # over the processes too
+        step = max(1, CHUNK // self.resamples)
+
+        keys = []
+        work = []
+        for n in sorted(sizes):
+            ordered = sorted(sizes[n])
+            for i in range(0, len(ordered), step):
+                chunk = ordered[i:i+step]
+                values = numpy.array([sorted(groups[k]) for k in chunk], dtype=numpy.float64)
+
+                keys.append(chunk)
+                work.append((values, self.resamples, self.confidence, self.seed))
+
+        if self.processes > 1 and len(work) > 1:
+            pool = multiprocessing.Pool(min(self.processes, len(work)))
+            try:
+                results = pool.map(resample, work)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [resample(v) for v in work]
+
+        res = {}
+        for chunk, intervals in zip(keys, results):
+            for k, v in zip(chunk, intervals.tolist()):
+                res[k] = v
+
+        return res
+
+    def write(self, conn, groups, skip=set()):
+        """
+        write inserts rows into the summary_ci table for groups, a map from
+        (experiment, side, field) to values, skipping experiments in skip.
+        """
+        cur = conn.cursor()
+        insert = create_table(cur)
+
+        groups = dict((k, v) for k, v in groups.items() if k[0] not in skip)
+        logging.info("bootstrapping {} groups with {} resamples".format(len(groups), self.resamples))
+
+        rows = []
+        for (experiment, side, field), intervals in sorted(self.intervals(groups).items()):
+            rows.append([experiment, field, side, self.resamples, self.confidence] + intervals)
+
+        cur.executemany(insert, rows)
+        cur.close()
+
+
+def create_table(cur):
+    """
+    create_table creates the summary_ci table if it doesn't exist and
+    returns the statement to insert into it.
+    """
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+    if "summary_ci" not in tables:
+        cur.execute(utils.create_table_stmt("summary_ci", exemplar))
+
+    return utils.insert_stmt("summary_ci", exemplar)
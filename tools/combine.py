@@ -9,6 +9,7 @@ Combine multiple databases into a single database.
 '''
 
 import collections
+import hashlib
 import json
 import logging
 import os
@@ -16,11 +17,33 @@ import sqlite3
 
 import utils
 
+# the ledger table in the destination records the sources that were merged
+# into it and the fingerprint they had
+ledger_exemplar = collections.OrderedDict([
+    ('source', '/path/to/src.sqlite3'),
+    ('size', 0),
+    ('mtime', 0.0),
+    ('rows', '{}'),
+    ('experiments', 'sha1'),
+])
+
+# the ledger_rows table tags each row copied from a source (including the
+# experiments it added) with the rowid of its ledger entry so that a source
+# that changes can be merged again without duplicating rows
+ledger_rows_exemplar = collections.OrderedDict([
+    ('entry', 0),
+    ('tbl', 'data'),
+    ('row', 0),
+])
+
 def copy_table(name, cur, cur2, mapper):
     '''
     copy_table copies
     '''
     r = cur2.execute('SELECT * FROM {} LIMIT 1'.format(name)).fetchone()
+    if r is None:
+        # nothing to copy
+        return
 
     insert = utils.insert_stmt(name, collections.OrderedDict(r))
 
@@ -42,7 +65,77 @@ def copy_table(name, cur, cur2, mapper):
         cur.executemany(insert, values)
 
 
+def experiment_tables(cur, tables):
+    '''
+    experiment_tables returns the sorted names of the tables, other than
+    experiments, that have rows for each experiment
+    '''
+    res = []
+    for name in sorted(tables):
+        if name == 'experiments':
+            continue
+
+        cols = [r['name'] for r in cur.execute('PRAGMA table_info({})'.format(name))]
+        if 'experiment' in cols:
+            res.append(name)
+
+    return res
+
+
+def fingerprint(cur, tables):
+    '''
+    fingerprint returns the number of rows in each of the tables and a hash
+    of the experiments table
+    '''
+    rows = collections.OrderedDict()
+    for name in tables:
+        rows[name] = cur.execute('SELECT COUNT(*) FROM {}'.format(name)).fetchone()[0]
+
+    h = hashlib.sha1()
+    for r in cur.execute('SELECT rowid,* FROM experiments ORDER BY rowid'):
+        h.update(json.dumps(list(r)))
+
+    return json.dumps(rows), h.hexdigest()
+
+
+def track(cur, name):
+    '''
+    track creates a trigger that drops the ledger_rows tag of any row deleted
+    from the table, so that a tag never refers to a later row that reuses the
+    rowid of a deleted one
+    '''
+    cur.execute('CREATE TRIGGER IF NOT EXISTS ledger_rows_{0} AFTER DELETE ON {0} '
+            'BEGIN DELETE FROM ledger_rows WHERE tbl="{0}" AND row=old.rowid; END'.format(name))
+
+
+def unmerge(cur, entry):
+    '''
+    unmerge deletes the rows tagged with the ledger entry by a previous merge,
+    then the experiments it added that no other rows refer to
+    '''
+    names = [r[0] for r in cur.execute('SELECT DISTINCT tbl FROM ledger_rows WHERE entry=? AND tbl!="experiments"', (entry,))]
+    for name in names:
+        cur.execute('DELETE FROM {} WHERE rowid IN (SELECT row FROM ledger_rows WHERE entry=? AND tbl=?)'.format(name), (entry, name))
+
+    tables = experiment_tables(cur, [r[0] for r in cur.execute('SELECT name FROM SQLITE_MASTER WHERE type="table"')])
+    used = ' UNION '.join('SELECT experiment FROM {}'.format(name) for name in tables)
+    if used:
+        used = ' AND rowid NOT IN ({})'.format(used)
+
+    cur.execute('DELETE FROM experiments WHERE rowid IN (SELECT row FROM ledger_rows WHERE entry=? AND tbl="experiments"){}'.format(used), (entry,))
+
+    # tags of experiments that are still used by other sources
+    cur.execute('DELETE FROM ledger_rows WHERE entry=?', (entry,))
+
+
 def merge(db, db2):
+    src = os.path.realpath(db2)
+    if src == os.path.realpath(db):
+        logging.warn('not merging {} into itself'.format(db))
+        return
+
+    st = os.stat(db2)
+
     conn = sqlite3.connect(db)
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
@@ -53,10 +146,29 @@ def merge(db, db2):
     dst_tables = {}
     src_tables = {}
 
-    # check that tables are identical, create tables in db if they don't exist
     for r in cur.execute('SELECT name,sql from SQLITE_MASTER WHERE type="table"'):
         dst_tables[r['name']] = r['sql']
+
+    if 'ledger' not in dst_tables:
+        cur.execute(utils.create_table_stmt('ledger', ledger_exemplar))
+
+    if 'ledger_rows' not in dst_tables:
+        cur.execute(utils.create_table_stmt('ledger_rows', ledger_rows_exemplar))
+        cur.execute('CREATE INDEX ledger_rows_entry ON ledger_rows (entry, tbl)')
+        cur.execute('CREATE INDEX ledger_rows_row ON ledger_rows (tbl, row)')
+
+    # skip the source if it hasn't changed since it was last merged
+    entry = cur.execute('SELECT rowid,* FROM ledger WHERE source=?', (src,)).fetchone()
+    if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+        logging.info('already merged {}'.format(db2))
+        return
+
+    # check that tables are identical, create tables in db if they don't exist
     for r in cur2.execute('SELECT name,sql from SQLITE_MASTER WHERE type="table"'):
+        if r['name'] in ['ledger', 'ledger_rows']:
+            # the source's own sources are not merged
+            continue
+
         src_tables[r['name']] = r['sql']
         if r['name'] in dst_tables:
             if r['sql'] != dst_tables[r['name']]:
@@ -70,6 +182,33 @@ def merge(db, db2):
         logging.warn('db does not have experiments table: {}'.format(db2))
         return
 
+    tables = experiment_tables(cur2, src_tables)
+    rows, digest = fingerprint(cur2, tables)
+
+    # sqlite3 commits before a CREATE, so the triggers are created before
+    # anything is written
+    for name in ['experiments'] + tables:
+        track(cur, name)
+
+    if entry is not None:
+        if entry['rows'] == rows and entry['experiments'] == digest:
+            # only the size or mtime changed, e.g. it was vacuumed or copied
+            logging.info('already merged {}'.format(db2))
+            cur.execute('UPDATE ledger SET size=?, mtime=? WHERE source=?', (st.st_size, st.st_mtime, src))
+            conn.commit()
+            return
+
+        logging.info('merging {} again since it changed'.format(db2))
+        unmerge(cur, entry['rowid'])
+        cur.execute('DELETE FROM ledger WHERE rowid=?', (entry['rowid'],))
+
+    # the ledger entry is committed along with the rows so that an interrupted
+    # merge leaves nothing behind
+    cur.execute(utils.insert_stmt('ledger', ledger_exemplar), (src, st.st_size, st.st_mtime, rows, digest))
+    ledger = cur.lastrowid
+
+    tag = utils.insert_stmt('ledger_rows', ledger_rows_exemplar)
+
     # map from params to updated ID
     params = {}
 
@@ -109,16 +248,20 @@ def merge(db, db2):
         mapper[r['rowid']] = cur.lastrowid
         params[p] = cur.lastrowid
 
-    conn.commit()
+        cur.execute(tag, (ledger, 'experiments', cur.lastrowid))
 
-    # copy rows from data
-    copy_table('data', cur, cur2, mapper)
-    conn.commit()
+    # copy rows from data, summary, series, and any other tables that have
+    # rows for each experiment. Nothing else can write to the destination
+    # during the transaction, so the copied rows are those above the largest
+    # rowid before the copy.
+    for name in tables:
+        lo = cur.execute('SELECT IFNULL(MAX(rowid), 0) FROM {}'.format(name)).fetchone()[0]
 
-    # copy rows from summary, if it exists
-    if 'summary' in src_tables:
-        copy_table('summary', cur, cur2, mapper)
-        conn.commit()
+        copy_table(name, cur, cur2, mapper)
+
+        cur.execute('INSERT INTO ledger_rows (entry,tbl,row) SELECT ?,?,rowid FROM {} WHERE rowid>?'.format(name), (ledger, name, lo))
+
+    conn.commit()
 
 
 if __name__ == '__main__':
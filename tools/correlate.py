@@ -0,0 +1,343 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Correlates two fields that were sampled over time during the same runs, such
+as vm_cpu_stolen from vmstat and owamp_jitter from powstream. Samples come
+from the series table (for series with a known start time) and the points
+table. For every run (experiment, iteration, and instance) that has both
+fields, the fields are aligned onto a grid of times over the period they
+overlap with an as-of join: the value at each time is the last sample at or
+before it, if it is recent enough. The Pearson correlation is computed at lag
+0 and for each lag up to --max-lag, with all the runs at once, and written
+to the correlations table.
+
+Usage: python correlate.py -x client:vm_cpu_stolen -y client:owamp_jitter results.db
+'''
+
+import collections
+import csv
+import logging
+import sqlite3
+import sys
+
+import numpy
+
+import series
+import utils
+
+exemplar = collections.OrderedDict([
+    ("x_side", "client"),
+    ("x_field", "vm_cpu_stolen"),
+    ("y_side", "client"),
+    ("y_field", "owamp_jitter"),
+    ("experiment", 0),
+    ("iteration", 1),
+    ("instance", "queXYZ"),
+    ("samples", 0),
+    ("r", 0.0),
+    ("lag", 0.0),
+    ("lag_r", 0.0),
+])
+
+# times are compared as integer milliseconds offset by the run so that one
+# searchsorted finds the samples for every run
+SPAN = 1 << 40
+
+# fewest aligned samples to compute a correlation from
+MIN_SAMPLES = 3
+
+
+def parse_field(v):
+    """
+    parse_field splits [side:]field, side is None if not given
+    """
+    if ":" in v:
+        side, field = v.split(":", 1)
+        return side, field
+
+    return None, v
+
+
+class Samples(object):
+    """
+    The samples of one field for every run, sorted by run and then by time.
+    run[i] is the index into keys, (experiment, iteration, instance, side),
+    of sample i and first/last are the times of the first and last sample of
+    each run. Samples that are NaN, such as the seconds of ab_latency_mean
+    without any requests, are kept so that asof returns NaN for them and
+    pearson skips them rather than using the sample before.
+    """
+
+    def __init__(self, conn, field, side=None):
+        clauses = ['{0}.field=?', 'experiments.broken != "true"']
+        args = [field]
+        if side is not None:
+            clauses.append('{0}.side=?')
+            args.append(side)
+
+        query = 'SELECT {0}.experiment, {0}.iteration, {0}.instance, {0}.side, {1} FROM {0} INNER JOIN experiments ON {0}.experiment=experiments.rowid WHERE ' + ' AND '.join(clauses)
+
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+
+        tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+
+        self.keys = []
+        index = {}
+
+        runs = []
+        times = []
+        values = []
+
+        def add(key, t, v):
+            if key not in index:
+                index[key] = len(self.keys)
+                self.keys.append(key)
+
+            runs.append(numpy.full(len(t), index[key], dtype=numpy.int64))
+            times.append(numpy.asarray(t, dtype=numpy.float64))
+            values.append(numpy.asarray(v, dtype=numpy.float64))
+
+        if "series" in tables:
+            for r in cur.execute(query.format("series", "series.start, series.step, series.count, series.samples"), args):
+                t = series.times(r)
+                if t is None:
+                    continue
+
+                add(tuple(r)[:4], t, series.unpack(r["samples"]))
+
+        if "points" in tables:
+            points = collections.OrderedDict()
+            for r in cur.execute(query.format("points", "points.time, points.value"), args):
+                if r["time"] is None or r["value"] is None:
+                    continue
+
+                t, v = points.setdefault(tuple(r)[:4], ([], []))
+                t.append(r["time"])
+                v.append(r["value"])
+
+            for key, (t, v) in points.items():
+                add(key, t, v)
+
+        cur.close()
+
+        if len(runs) == 0:
+            self.run = numpy.array([], dtype=numpy.int64)
+            self.time = numpy.array([])
+            self.value = numpy.array([])
+            self.first = self.last = numpy.array([])
+            return
+
+        run = numpy.concatenate(runs)
+        time = numpy.concatenate(times)
+        value = numpy.concatenate(values)
+
+        order = numpy.lexsort((time, run))
+        self.run, self.time, self.value = run[order], time[order], value[order]
+
+        starts = numpy.flatnonzero(numpy.r_[True, self.run[1:] != self.run[:-1]])
+        ends = numpy.r_[starts[1:], len(self.run)] - 1
+        self.first = self.time[starts]
+        self.last = self.time[ends]
+
+    def asof(self, runs, times, tolerance, base):
+        """
+        asof returns the value of the last sample of each run in runs at or
+        before the time at the same index in times, NaN if there is none
+        within tolerance seconds.
+        """
+        keys = self.run * SPAN + numpy.round((self.time - base) * 1000).astype(numpy.int64)
+        targets = runs * SPAN + numpy.round((times - base) * 1000).astype(numpy.int64)
+
+        i = numpy.searchsorted(keys, targets, side="right") - 1
+        found = i >= 0
+        i = numpy.maximum(i, 0)
+        found &= (self.run[i] == runs) & (times - self.time[i] <= tolerance)
+
+        return numpy.where(found, self.value[i], numpy.nan)
+
+
+def pearson(pairs, x, y, count):
+    """
+    pearson returns the number of samples and the correlation of x and y for
+    each of count pairs, given the pair that each sample belongs to. Samples
+    where either is NaN are skipped.
+    """
+    ok = ~(numpy.isnan(x) | numpy.isnan(y))
+    p, x, y = pairs[ok], x[ok], y[ok]
+
+    n = numpy.bincount(p, minlength=count).astype(numpy.float64)
+    sx = numpy.bincount(p, weights=x, minlength=count)
+    sy = numpy.bincount(p, weights=y, minlength=count)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        mx = sx / n
+        my = sy / n
+
+        dx = x - mx[p]
+        dy = y - my[p]
+
+        sxy = numpy.bincount(p, weights=dx*dy, minlength=count)
+        sxx = numpy.bincount(p, weights=dx*dx, minlength=count)
+        syy = numpy.bincount(p, weights=dy*dy, minlength=count)
+
+        r = sxy / numpy.sqrt(sxx * syy)
+
+    r[n < MIN_SAMPLES] = numpy.nan
+
+    return n.astype(numpy.int64), r
+
+
+def correlate(conn, x, y, step=5, tolerance=None, max_lag=0, warmup=0, cooldown=0):
+    """
+    correlate returns a row for each run that has both x and y, each a
+    (side, field) tuple (side None for any), with the number of aligned
+    samples and the correlation at lag 0 and at the lag, in seconds, with
+    the strongest correlation. A positive lag means that y follows x.
+    """
+    if tolerance is None:
+        tolerance = step
+
+    xs = Samples(conn, x[1], x[0])
+    ys = Samples(conn, y[1], y[0])
+
+    # pair up the runs of x and y, every side of one with every side of the
+    # other when they are not given
+    by_run = {}
+    for j, k in enumerate(ys.keys):
+        by_run.setdefault(k[:3], []).append(j)
+
+    px = []
+    py = []
+    for i, k in enumerate(xs.keys):
+        for j in by_run.get(k[:3], []):
+            if (x[1], k[3]) != (y[1], ys.keys[j][3]):
+                px.append(i)
+                py.append(j)
+
+    if len(px) == 0:
+        return []
+
+    px = numpy.array(px, dtype=numpy.int64)
+    py = numpy.array(py, dtype=numpy.int64)
+
+    # grid over the times that both cover
+    lo = numpy.maximum(xs.first[px], ys.first[py]) + warmup
+    hi = numpy.minimum(xs.last[px], ys.last[py]) - cooldown
+    counts = numpy.where(hi >= lo, numpy.floor((hi - lo) / step).astype(numpy.int64) + 1, 0)
+
+    pairs = numpy.repeat(numpy.arange(len(px)), counts)
+    offsets = numpy.cumsum(counts) - counts
+    grid = lo[pairs] + step * (numpy.arange(counts.sum()) - offsets[pairs])
+
+    base = min(xs.time.min(), ys.time.min()) - (max_lag + 1) * step
+
+    xv = xs.asof(px[pairs], grid, tolerance, base)
+
+    n = None
+    r = None
+    best_lag = numpy.zeros(len(px))
+    best_r = numpy.full(len(px), numpy.nan)
+
+    for lag in range(-max_lag, max_lag+1):
+        yv = ys.asof(py[pairs], grid + lag * step, tolerance, base)
+        count, corr = pearson(pairs, xv, yv, len(px))
+
+        if lag == 0:
+            n, r = count, corr
+
+        with numpy.errstate(invalid="ignore"):
+            better = ~numpy.isnan(corr) & (numpy.isnan(best_r) | (numpy.abs(corr) > numpy.abs(best_r)))
+        best_r[better] = corr[better]
+        best_lag[better] = lag * step
+
+    res = []
+    for i in range(len(px)):
+        experiment, iteration, instance, x_side = xs.keys[px[i]]
+        res.append(collections.OrderedDict([
+            ("x_side", x_side),
+            ("x_field", x[1]),
+            ("y_side", ys.keys[py[i]][3]),
+            ("y_field", y[1]),
+            ("experiment", experiment),
+            ("iteration", iteration),
+            ("instance", instance),
+            ("samples", int(n[i])),
+            ("r", None if numpy.isnan(r[i]) else float(r[i])),
+            ("lag", None if numpy.isnan(best_r[i]) else float(best_lag[i])),
+            ("lag_r", None if numpy.isnan(best_r[i]) else float(best_r[i])),
+        ]))
+
+    return res
+
+
+def write_table(conn, x, y, rows):
+    """
+    write_table replaces the rows for the x and y fields in the correlations
+    table
+    """
+    cur = conn.cursor()
+
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+    if "correlations" not in tables:
+        cur.execute(utils.create_table_stmt("correlations", exemplar))
+
+    cur.execute('DELETE FROM correlations WHERE x_field=? AND y_field=?', (x[1], y[1]))
+    cur.executemany(utils.insert_stmt("correlations", exemplar), [list(r.values()) for r in rows])
+
+    conn.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='correlate two fields sampled over time in each run')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-x', metavar='[SIDE:]FIELD', type=str, required=True, help='first field, e.g. client:vm_cpu_stolen')
+    parser.add_argument('-y', metavar='[SIDE:]FIELD', type=str, required=True, help='second field, e.g. client:owamp_jitter')
+    parser.add_argument('--step', type=float, default=5, help='seconds between the times that the fields are aligned to')
+    parser.add_argument('--tolerance', type=float, help='oldest sample, in seconds, to use for a time (default: step)')
+    parser.add_argument('--max-lag', type=int, default=0, help='most steps to shift y by when looking for the strongest correlation')
+    parser.add_argument('--warmup', type=float, default=0, help='seconds to skip at the start of each run')
+    parser.add_argument('--cooldown', type=float, default=0, help='seconds to skip at the end of each run')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, help='also write the correlations to a CSV file')
+    parser.add_argument('db', metavar='DB', type=str, help='database to read and write the correlations table to')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    x = parse_field(args.x)
+    y = parse_field(args.y)
+
+    conn = sqlite3.connect(args.db)
+
+    rows = correlate(conn, x, y, args.step, args.tolerance, args.max_lag, args.warmup, args.cooldown)
+    logging.info("{} runs with both {} and {}".format(len(rows), x[1], y[1]))
+
+    write_table(conn, x, y, rows)
+
+    if args.output:
+        if args.output == '-':
+            out_fh = sys.stdout
+        else:
+            out_fh = open(args.output, 'w')
+
+        writer = csv.DictWriter(out_fh, fieldnames=list(exemplar.keys()))
+        writer.writeheader()
+        for r in rows:
+            writer.writerow(r)
+
+        if out_fh is not sys.stdout:
+            out_fh.close()
+
+    conn.close()
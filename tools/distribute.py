@@ -0,0 +1,280 @@
+#! /usr/bin/env python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Distributes files from the staging node to every host in the reservations
+matching a regular expression (see igor.py). Rather than copying every file
+from the staging node to every host, the staging node only sends the files to
+the first host of each reservation and the hosts then relay them to the rest
+of their reservation in a tree, each to up to --fanout others. Files that a
+host already has with the same SHA1 are not sent again, and at most -j copies
+run at once.
+
+Usage: python distribute.py que[0-9]+ ~/que_vendor/* ../../tools/*.py
+'''
+
+import argparse
+import collections
+import hashlib
+import logging
+import os
+import pipes
+import Queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import igor
+
+# bytes to read at a time when hashing
+CHUNK = 1 << 20
+
+
+def file_hash(path):
+    """
+    Returns the SHA1 of a file as a hex string
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+class SshTransport(object):
+    """
+    Copies files to and between hosts with scp and hashes them with sha1sum
+    over ssh. Files go to dest on each host, the home directory by default.
+    """
+
+    def __init__(self, dest="", options=[]):
+        self.dest = dest or "."
+        self.options = options
+
+    def hashes(self, host, names):
+        """
+        Returns a map from name to SHA1 for the files in names that host has
+        """
+        cmd = "cd {} && sha1sum -- {}".format(pipes.quote(self.dest), " ".join(pipes.quote(v) for v in names))
+
+        # sha1sum fails if any are missing but still hashes the rest
+        p = subprocess.Popen(["ssh"] + self.options + [host, cmd], stdout=subprocess.PIPE)
+        out, _ = p.communicate()
+        if p.returncode == 255:
+            raise EnvironmentError("ssh to {} failed".format(host))
+
+        res = {}
+        for line in out.splitlines():
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                res[parts[1].lstrip("*")] = parts[0]
+
+        return res
+
+    def copy(self, src, host, paths):
+        """
+        Copies the files to host, from the staging node (these paths) if src
+        is None and otherwise from the files with the same names on src.
+        """
+        target = "{}:{}/".format(host, self.dest)
+
+        if src is None:
+            subprocess.check_call(["scp", "-q"] + self.options + list(paths) + [target])
+            return
+
+        names = " ".join(pipes.quote(os.path.basename(v)) for v in paths)
+        cmd = "cd {} && scp -q -o BatchMode=yes {} {}".format(pipes.quote(self.dest), names, pipes.quote(target))
+        subprocess.check_call(["ssh"] + self.options + [src, cmd])
+
+
+class LocalTransport(object):
+    """
+    Stands in for SshTransport with a directory under root for each host, for
+    trying out distribute without the hosts.
+    """
+
+    def __init__(self, root, dest=""):
+        self.root = root
+        self.dest = dest
+
+    def path(self, host, name):
+        return os.path.join(self.root, host, self.dest, name)
+
+    def hashes(self, host, names):
+        res = {}
+        for name in names:
+            if os.path.exists(self.path(host, name)):
+                res[name] = file_hash(self.path(host, name))
+
+        return res
+
+    def copy(self, src, host, paths):
+        target = os.path.dirname(self.path(host, "x"))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+
+        for path in paths:
+            name = os.path.basename(path)
+            if src is not None:
+                path = self.path(src, name)
+
+            # copy then rename so a host never has a partial file
+            tmp = "{}.{}".format(self.path(host, name), threading.current_thread().ident)
+            shutil.copy2(path, tmp)
+            os.rename(tmp, self.path(host, name))
+
+
+def tree(reservations, fanout=2):
+    """
+    Returns a map from each host in the reservations to the host that it gets
+    the files from, None for the first host of each reservation which gets
+    them from the staging node. The rest of each reservation is a tree with
+    up to fanout children per host.
+    """
+    parents = collections.OrderedDict()
+
+    for r in reservations:
+        hosts = [h for h in r["Hosts"] if h not in parents]
+        for i, h in enumerate(hosts):
+            parents[h] = None if i == 0 else hosts[(i-1) // fanout]
+
+    return parents
+
+
+def distribute(transport, files, parents, jobs=16, retries=2, backoff=5):
+    """
+    Copies the files to every host in parents (see tree), from the staging
+    node or from its parent once the parent has them, with up to jobs copies
+    at once. Only the files whose SHA1 differs on the host are sent. If a host
+    fails after retries, its children get the files from its parent instead.
+    Returns a map from host to the host it got the files from, the status,
+    the number of files sent and skipped, and the total seconds.
+    """
+    want = collections.OrderedDict((os.path.basename(f), file_hash(f)) for f in files)
+    paths = dict((os.path.basename(f), f) for f in files)
+
+    children = collections.OrderedDict()
+    for h, p in parents.items():
+        children.setdefault(p, []).append(h)
+
+    results = {}
+    lock = threading.Lock()
+    pending = Queue.Queue()
+
+    def send(src, host):
+        start = time.time()
+
+        for attempt in range(retries+1):
+            if attempt > 0:
+                time.sleep(backoff * 2**(attempt-1))
+
+            try:
+                have = transport.hashes(host, list(want.keys()))
+                need = [n for n, h in want.items() if have.get(n) != h]
+                if len(need) > 0:
+                    transport.copy(src, host, [paths[n] for n in need])
+
+                return src, "ok", len(need), len(want) - len(need), time.time() - start
+            except (EnvironmentError, subprocess.CalledProcessError) as e:
+                logging.warning("copying to {} from {} failed: {}".format(host, src or "staging", e))
+
+        return src, "failed", 0, 0, time.time() - start
+
+    def worker():
+        while True:
+            item = pending.get()
+            if item is None:
+                pending.task_done()
+                return
+
+            src, host = item
+            res = send(src, host)
+            with lock:
+                results[host] = res
+
+            # relay from this host, or from where it should have got them
+            via = host if res[1] == "ok" else src
+            for child in children.get(host, []):
+                pending.put((via, child))
+
+            pending.task_done()
+
+    for host in children.get(None, []):
+        pending.put((None, host))
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(jobs, len(parents))))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    pending.join()
+
+    for t in threads:
+        pending.put(None)
+    for t in threads:
+        t.join()
+
+    return collections.OrderedDict((h, results[h]) for h in parents if h in results)
+
+
+def print_results(results):
+    """
+    Prints a tab-separated table of results from distribute and returns True
+    if they were all successful.
+    """
+    print("\t".join(["host", "from", "status", "sent", "skipped", "seconds"]))
+    for host, (src, status, sent, skipped, elapsed) in results.items():
+        print("{}\t{}\t{}\t{}\t{}\t{:.1f}".format(host, src or "staging", status, sent, skipped, elapsed))
+
+    return all(r[1] == "ok" for r in results.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="copy files to every host in the reservations, relaying between hosts")
+    parser.add_argument("pattern", type=igor.regex_arg, help="regex pattern for reservations")
+    parser.add_argument("files", metavar="FILE", nargs="+", help="files to copy")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False)
+    parser.add_argument("--dest", type=str, default="", help="directory on each host to copy to (default: home directory)")
+    parser.add_argument("--fanout", type=int, default=2, help="number of hosts each host relays the files to")
+    parser.add_argument("-j", "--jobs", type=int, default=16, help="number of copies to run at once")
+    parser.add_argument("--retries", type=int, default=2, help="number of times to retry failed copies")
+    parser.add_argument("--backoff", type=float, default=5, help="seconds to wait before the first retry, doubled for each retry after")
+    parser.add_argument("--ssh-reuse", action="store_true", help="reuse ssh connections with ControlMaster")
+    parser.add_argument("--reservations", type=str, default=igor.RESERVATIONS, help="igor reservations file")
+    parser.add_argument("--local", metavar="DIR", type=str, help="copy to a directory per host under DIR instead of over ssh")
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format = "%(asctime)s: %(levelname)s %(message)s"
+    logging.basicConfig(level=level, format=log_format)
+
+    if args.fanout < 1:
+        parser.error("invalid fanout: {}".format(args.fanout))
+
+    for f in args.files:
+        if not os.path.isfile(f):
+            parser.error("not a file: {}".format(f))
+
+    _, reservations = igor.parse_reservations(args.reservations)
+    parents = tree(igor.matching_reservations(args.pattern, reservations), args.fanout)
+
+    if args.local:
+        transport = LocalTransport(args.local, args.dest)
+    else:
+        transport = SshTransport(args.dest, igor.ssh_options(args.ssh_reuse))
+
+    logging.info("copying {} files to {} hosts".format(len(args.files), len(parents)))
+
+    results = distribute(transport, args.files, parents, args.jobs, args.retries, args.backoff)
+    if not print_results(results):
+        sys.exit(1)
@@ -0,0 +1,358 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Compares experiments that only differ by one parameter (e.g. pinning enabled
+vs disabled with everything else the same). For every field that both
+experiments have, computes the ratio of the medians, Cliff's delta, Cohen's
+d, and the two-sample Kolmogorov-Smirnov statistic of the values in the data
+and series tables and writes them, ranked by the size of the effect, to the
+effects table. The median ratio and Cohen's d are NULL when they are not
+defined, e.g. for fields that are constant or have a median of zero.
+
+Usage: python effects.py -p pinning results.db
+'''
+
+import collections
+import csv
+import logging
+import sqlite3
+import sys
+
+import numpy
+
+import series
+import utils
+
+exemplar = collections.OrderedDict([
+    ("dimension", "pinning"),
+    ("rank", 0),
+    ("experiment_a", 0),
+    ("experiment_b", 0),
+    ("level_a", "disabled"),
+    ("level_b", "enabled"),
+    ("side", "client"),
+    ("field", "example"),
+    ("count_a", 0),
+    ("count_b", 0),
+    ("median_ratio", 0.0),
+    ("cliffs_delta", 0.0),
+    ("cohens_d", 0.0),
+    ("ks", 0.0),
+])
+
+# params that are not held fixed when comparing experiments
+IGNORED_PARAMS = set(["broken"])
+
+
+def pairs(conn, dimension):
+    """
+    pairs returns (a, b, level_a, level_b) for each pair of experiments that
+    have the same params other than dimension, with level_a < level_b.
+    Broken experiments are skipped.
+    """
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+
+    groups = {}
+    for r in cur.execute('SELECT rowid,* FROM experiments'):
+        params = collections.OrderedDict(r)
+        if params.get("broken") == "true":
+            continue
+
+        level = params[dimension]
+        key = tuple((k, v) for k, v in params.items() if k not in IGNORED_PARAMS and k not in ("rowid", dimension))
+        groups.setdefault(key, []).append((level, r["rowid"]))
+
+    res = []
+    for key in sorted(groups):
+        levels = sorted(groups[key])
+        for i, (level_a, a) in enumerate(levels):
+            for level_b, b in levels[i+1:]:
+                res.append((a, b, level_a, level_b))
+
+    return res
+
+
+class Samples(object):
+    """
+    The values from the data and series tables (each sample, other than
+    NaNs, counts as a value) for a set of experiments, sorted by
+    (experiment, side, field) group and then by value in one flat array.
+    Group g has count[g] values starting at start[g]. Each value also has a
+    rank among all the values so that values from different groups can be
+    compared with a single searchsorted.
+    """
+
+    def __init__(self, conn, experiments, fields=[]):
+        query = 'SELECT experiment, side, field, {1} FROM {0} WHERE experiment IN ({2})'
+        args = []
+        if len(fields) > 0:
+            query += ' AND field IN ({})'.format(','.join('?'*len(fields)))
+            args.extend(fields)
+
+        ids = ','.join(str(int(v)) for v in experiments)
+        tables = [r[0] for r in conn.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+
+        self.keys = []
+        index = {}
+
+        def code(side, field):
+            k = (side, field)
+            if k not in index:
+                index[k] = len(self.keys)
+                self.keys.append(k)
+
+            return index[k]
+
+        exps = []
+        codes = []
+        values = []
+        for experiment, side, field, value in conn.execute(query.format("data", "value", ids), args):
+            if value is None:
+                continue
+
+            exps.append(experiment)
+            codes.append(code(side, field))
+            values.append(value)
+
+        exps = [numpy.array(exps, dtype=numpy.int64)]
+        codes = [numpy.array(codes, dtype=numpy.int64)]
+        values = [numpy.array(values, dtype=numpy.float64)]
+
+        if "series" in tables:
+            for experiment, side, field, samples in conn.execute(query.format("series", "samples", ids), args):
+                samples = series.unpack(samples)
+                samples = samples[~numpy.isnan(samples)]
+
+                exps.append(numpy.repeat(numpy.int64(experiment), len(samples)))
+                codes.append(numpy.repeat(numpy.int64(code(side, field)), len(samples)))
+                values.append(samples)
+
+        exps = numpy.concatenate(exps)
+        codes = numpy.concatenate(codes)
+        values = numpy.concatenate(values)
+
+        order = numpy.lexsort((values, codes, exps))
+        exps, codes, self.values = exps[order], codes[order], values[order]
+
+        # split into groups wherever the experiment or field changes
+        n = len(self.values)
+        starts = numpy.flatnonzero(numpy.r_[True, (exps[1:] != exps[:-1]) | (codes[1:] != codes[:-1])]) if n > 0 else numpy.array([], dtype=numpy.int64)
+        self.start = starts
+        self.count = numpy.diff(numpy.r_[starts, n])
+
+        self.groups = dict(((e, self.keys[c]), g) for g, (e, c) in enumerate(zip(exps[starts].tolist(), codes[starts].tolist())))
+
+        # dense rank of each value and a key that sorts by group then value
+        _, ranks = numpy.unique(self.values, return_inverse=True)
+        group = numpy.repeat(numpy.arange(len(starts)), self.count)
+        self.scale = ranks.max() + 2 if n > 0 else 1
+        self.sortkey = group * self.scale + ranks
+        self.ranks = ranks
+
+        # per group stats
+        self.mean = numpy.add.reduceat(self.values, starts) / self.count if n > 0 else numpy.array([])
+        dev = self.values - numpy.repeat(self.mean, self.count)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            self.var = numpy.add.reduceat(dev*dev, starts) / (self.count - 1) if n > 0 else numpy.array([])
+        self.median = (self.values[starts + (self.count-1)//2] + self.values[starts + self.count//2]) / 2 if n > 0 else numpy.array([])
+
+    def expand(self, groups):
+        """
+        expand returns, for each value in the given groups, the index of the
+        group in the groups argument and the position of the value in the
+        flat arrays.
+        """
+        counts = self.count[groups]
+        which = numpy.repeat(numpy.arange(len(groups)), counts)
+        offsets = numpy.cumsum(counts) - counts
+        pos = numpy.arange(counts.sum()) - numpy.repeat(offsets, counts) + numpy.repeat(self.start[groups], counts)
+
+        return which, pos, offsets
+
+    def counts_below(self, groups, which, pos):
+        """
+        counts_below returns the number of values in groups[which] that are
+        less than and less than or equal to the value at each pos.
+        """
+        target = groups[which] * self.scale + self.ranks[pos]
+        base = self.start[groups[which]]
+
+        lt = numpy.searchsorted(self.sortkey, target, side="left") - base
+        le = numpy.searchsorted(self.sortkey, target, side="right") - base
+
+        return lt, le
+
+
+def effects(samples, ga, gb):
+    """
+    effects returns the median ratio, Cliff's delta, Cohen's d, and KS
+    statistic comparing each group in ga to the group at the same index in
+    gb, all computed at once. The ratio and Cohen's d are NaN where they are
+    not defined (zero medians or no variance).
+    """
+    na = samples.count[ga].astype(numpy.float64)
+    nb = samples.count[gb].astype(numpy.float64)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        ratio = samples.median[ga] / samples.median[gb]
+
+        pooled = numpy.sqrt(((na-1)*samples.var[ga] + (nb-1)*samples.var[gb]) / (na+nb-2))
+        d = (samples.mean[ga] - samples.mean[gb]) / pooled
+
+    ratio[~numpy.isfinite(ratio)] = numpy.nan
+    d[~numpy.isfinite(d)] = numpy.nan
+
+    # Cliff's delta from how many values of b are below/above each value of a
+    which, pos, offsets = samples.expand(ga)
+    lt, le = samples.counts_below(gb, which, pos)
+    gt = nb[which] - le
+    delta = numpy.bincount(which, weights=lt-gt, minlength=len(ga)) / (na*nb)
+
+    # KS: largest difference between the empirical CDFs, which is at one of
+    # the values from either group
+    _, own = samples.counts_below(ga, which, pos)
+    diff = numpy.abs(own / na[which] - le / nb[which])
+    ks = numpy.maximum.reduceat(diff, offsets)
+
+    which, pos, offsets = samples.expand(gb)
+    _, own = samples.counts_below(gb, which, pos)
+    _, other = samples.counts_below(ga, which, pos)
+    diff = numpy.abs(other / na[which] - own / nb[which])
+    ks = numpy.maximum(ks, numpy.maximum.reduceat(diff, offsets))
+
+    return ratio, delta, d, ks
+
+
+def defined(v):
+    """
+    defined returns v as a float, None if it is NaN so that it is written as
+    NULL to the table and empty to the CSV
+    """
+    if numpy.isnan(v):
+        return None
+
+    return float(v)
+
+
+def compare(conn, dimension, fields=[]):
+    """
+    compare returns a row for each field of each pair of experiments that
+    differ only by dimension, ranked by the absolute value of Cliff's delta
+    and then by the KS statistic. Comparisons without a Cliff's delta or KS
+    statistic (which need values in both groups) are ranked last.
+    """
+    candidates = pairs(conn, dimension)
+    if len(candidates) == 0:
+        return []
+
+    experiments = set()
+    for a, b, _, _ in candidates:
+        experiments.update([a, b])
+
+    samples = Samples(conn, sorted(experiments), fields)
+
+    meta = []
+    ga = []
+    gb = []
+    for a, b, level_a, level_b in candidates:
+        for k in samples.keys:
+            if (a, k) in samples.groups and (b, k) in samples.groups:
+                meta.append((a, b, level_a, level_b, k))
+                ga.append(samples.groups[(a, k)])
+                gb.append(samples.groups[(b, k)])
+
+    if len(meta) == 0:
+        return []
+
+    ga = numpy.array(ga, dtype=numpy.int64)
+    gb = numpy.array(gb, dtype=numpy.int64)
+
+    ratio, delta, d, ks = effects(samples, ga, gb)
+
+    order = numpy.lexsort((-numpy.nan_to_num(ks), -numpy.nan_to_num(numpy.abs(delta)), numpy.isnan(delta) | numpy.isnan(ks)))
+
+    res = []
+    for rank, i in enumerate(order.tolist()):
+        a, b, level_a, level_b, (side, field) = meta[i]
+        res.append(collections.OrderedDict([
+            ("dimension", dimension),
+            ("rank", rank+1),
+            ("experiment_a", a),
+            ("experiment_b", b),
+            ("level_a", level_a),
+            ("level_b", level_b),
+            ("side", side),
+            ("field", field),
+            ("count_a", int(samples.count[ga[i]])),
+            ("count_b", int(samples.count[gb[i]])),
+            ("median_ratio", defined(ratio[i])),
+            ("cliffs_delta", defined(delta[i])),
+            ("cohens_d", defined(d[i])),
+            ("ks", defined(ks[i])),
+        ]))
+
+    return res
+
+
+def write_table(conn, dimension, rows):
+    """
+    write_table replaces the rows for dimension in the effects table
+    """
+    cur = conn.cursor()
+
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+    if "effects" not in tables:
+        cur.execute(utils.create_table_stmt("effects", exemplar))
+
+    cur.execute('DELETE FROM effects WHERE dimension=?', (dimension,))
+    cur.executemany(utils.insert_stmt("effects", exemplar), [list(r.values()) for r in rows])
+
+    conn.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='effect sizes between experiments that differ by one parameter')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-p', '--param', type=str, required=True, help='parameter to compare levels of, e.g. environment, nic, pinning')
+    parser.add_argument('-f', '--field', dest='fields', action='append', default=[], help='field to compare (default: all)')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, help='also write the ranked results to a CSV file')
+    parser.add_argument('db', metavar='DB', type=str, help='database to read and write the effects table to')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    conn = sqlite3.connect(args.db)
+
+    rows = compare(conn, args.param, args.fields)
+    logging.info("{} comparisons for {}".format(len(rows), args.param))
+
+    write_table(conn, args.param, rows)
+
+    if args.output:
+        if args.output == '-':
+            out_fh = sys.stdout
+        else:
+            out_fh = open(args.output, 'w')
+
+        writer = csv.DictWriter(out_fh, fieldnames=list(exemplar.keys()))
+        writer.writeheader()
+        for r in rows:
+            writer.writerow(r)
+
+        if out_fh is not sys.stdout:
+            out_fh.close()
+
+    conn.close()
@@ -14,6 +14,16 @@ import json
 import os
 import re
 import subprocess
+import sys
+import time
+
+from multiprocessing.pool import ThreadPool
+
+RESERVATIONS = "/var/ftpd/igor/reservations.json"
+READY_CACHE = os.path.expanduser("~/.igor-ready.json")
+
+# longest time to sleep between checks in --wait
+MAX_POLL = 60
 
 def regex_arg(s):
     """
@@ -25,12 +35,12 @@ def regex_arg(s):
     return r
 
 
-def parse_reservations():
+def parse_reservations(fname=RESERVATIONS):
     """
     Parse the reservations file
     """
     # TODO: update depending on head node configuration
-    with open("/var/ftpd/igor/reservations.json") as f:
+    with open(fname) as f:
         return "ccc", json.load(f)
 
 
@@ -43,52 +53,249 @@ def matching_reservations(pat, reservations):
             yield r
 
 
+def ssh_options(reuse):
+    """
+    Returns extra options for ssh. If reuse is set, connections are shared
+    between probes of the same host using a ControlMaster.
+    """
+    if not reuse:
+        return []
+
+    return [
+        "-o", "ControlMaster=auto",
+        "-o", "ControlPath=~/.ssh/igor-%r@%h:%p",
+        "-o", "ControlPersist=10m",
+    ]
+
+
+def probe(host, command, timeout=3, options=[]):
+    """
+    Runs command on host over ssh and returns the output, or None if it
+    failed or timed out.
+    """
+    try:
+        return subprocess.check_output(["timeout", "{}s".format(timeout), "ssh"] + options + [host] + command)
+    except subprocess.CalledProcessError:
+        return None
+
+
+def reservation_hosts(reservations):
+    """
+    Returns the hosts in the reservations, without duplicates.
+    """
+    hosts = []
+    for r in reservations:
+        for h in r["Hosts"]:
+            if h not in hosts:
+                hosts.append(h)
+
+    return hosts
+
+
+def probe_all(hosts, command, jobs, timeout=3, options=[]):
+    """
+    Runs command on every host with up to jobs probes at a time. Returns a map
+    from host to the output from probe.
+    """
+    if len(hosts) == 0:
+        return {}
+
+    pool = ThreadPool(min(jobs, len(hosts)))
+    try:
+        outs = pool.map(lambda h: probe(h, command, timeout, options), hosts)
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict(zip(hosts, outs))
+
+
+def load_cache(fname):
+    """
+    Load the readiness cache, a map from host to whether it was ready and when
+    it was checked. Returns an empty cache if the file is missing or corrupt.
+    """
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(fname, cache):
+    """
+    Save the readiness cache, replacing the old file atomically.
+    """
+    tmp = "{}.{}".format(fname, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.rename(tmp, fname)
+
+
+def check_ready(hosts, cache, ttl, jobs, timeout=3, options=[]):
+    """
+    Checks that the hosts are booted into the correct image. Hosts that were
+    ready less than ttl seconds ago according to the cache are not probed
+    again. Updates the cache and returns a map from host to whether it is
+    ready.
+    """
+    now = time.time()
+
+    stale = []
+    for h in hosts:
+        if h in cache and cache[h]["ready"] and now - cache[h]["time"] < ttl:
+            continue
+        stale.append(h)
+
+    outs = probe_all(stale, ["cat", "/etc/motd"], jobs, timeout, options)
+    for h, out in outs.items():
+        cache[h] = {"ready": out is not None and "que_host" in out, "time": now}
+
+    return dict((h, cache[h]["ready"]) for h in hosts)
+
+
+def wait_ready(hosts, cache, ttl, limit, backoff, jobs, timeout=3, options=[]):
+    """
+    Checks the hosts until they are all ready or limit seconds have passed,
+    only probing the hosts that were not ready last time. Waits backoff
+    seconds after the first check, doubling each time up to MAX_POLL.
+    Returns the map from check_ready for the last check.
+    """
+    start = time.time()
+
+    ready = check_ready(hosts, cache, ttl, jobs, timeout, options)
+
+    while not all(ready.values()):
+        pending = [h for h in hosts if not ready[h]]
+        sys.stderr.write("{} of {} hosts ready\n".format(len(hosts) - len(pending), len(hosts)))
+
+        delay = min(backoff, MAX_POLL, start + limit - time.time())
+        if delay <= 0:
+            break
+        time.sleep(delay)
+        backoff *= 2
+
+        ready.update(check_ready(pending, cache, 0, jobs, timeout, options))
+
+    return ready
+
+
+def run_job(name, command, timeout=0, retries=0, backoff=5):
+    """
+    Runs command, retrying up to retries times if it fails and waiting twice
+    as long between each attempt. If timeout is set, each attempt is killed
+    after timeout seconds. Output from the command goes to stderr. Returns
+    the name, status, number of attempts, last exit code and total seconds.
+    """
+    if timeout > 0:
+        command = ["timeout", "{}s".format(timeout)] + command
+
+    start = time.time()
+
+    for attempt in range(retries+1):
+        if attempt > 0:
+            time.sleep(backoff * 2**(attempt-1))
+
+        try:
+            code = subprocess.call(command, stdout=sys.stderr)
+        except OSError:
+            code = 127
+
+        if code == 0:
+            return name, "ok", attempt+1, code, time.time() - start
+
+    status = "timeout" if timeout > 0 and code == 124 else "failed"
+    return name, status, attempt+1, code, time.time() - start
+
+
+def run_jobs(jobs, parallel, timeout=0, retries=0, backoff=5):
+    """
+    Runs the (name, command) jobs with up to parallel jobs at a time. Returns
+    the results from run_job in the same order as jobs.
+    """
+    if len(jobs) == 0:
+        return []
+
+    pool = ThreadPool(min(parallel, len(jobs)))
+    try:
+        return pool.map(lambda j: run_job(j[0], j[1], timeout, retries, backoff), jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_results(results):
+    """
+    Prints a tab-separated table of results from run_jobs and returns True if
+    they were all successful.
+    """
+    print("\t".join(["job", "status", "attempts", "code", "seconds"]))
+    for name, status, attempts, code, elapsed in results:
+        print("{}\t{}\t{}\t{}\t{:.1f}".format(name, status, attempts, code, elapsed))
+
+    return all(r[1] == "ok" for r in results)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="make igor great again")
     parser.add_argument("pattern", type=regex_arg, help="regex pattern for reservations")
     parser.add_argument("--check", action="store_true", help="check that the nodes are all booted into the correct image")
+    parser.add_argument("--wait", type=int, metavar="SECONDS", help="like --check but wait up to SECONDS for all the nodes to be ready")
     parser.add_argument("--cycle", action="store_true", help="power cycle all reservations")
     parser.add_argument("--off", action="store_true", help="power off all reservations")
     parser.add_argument("--prep-script", action="store_true", help="output prep script")
-    parser.add_argument("--colocated", action="store_true", help="regenerate context for each host when generating prep-script")
+    parser.add_argument("--prep", type=str, metavar="PREP", help="run prep script PREP for each host")
+    parser.add_argument("--colocated", action="store_true", help="regenerate context for each host for --prep and --prep-script")
     parser.add_argument("--heads", action="store_true", help="output head node for each reservation")
     parser.add_argument("--nodes", action="store_true", help="output all nodes for each reservation")
     parser.add_argument("--ps", type=str, help="search the ps output of each node for arg")
     parser.add_argument("--extend", type=str, help="extend reservations")
+    parser.add_argument("-j", "--jobs", type=int, default=16, help="number of hosts or jobs to run at once")
+    parser.add_argument("--retries", type=int, default=2, help="number of times to retry failed jobs")
+    parser.add_argument("--backoff", type=float, default=5, help="seconds to wait before the first retry, doubled for each retry after")
+    parser.add_argument("--job-timeout", type=int, default=0, help="seconds before killing a job (default: no limit)")
+    parser.add_argument("--ssh-timeout", type=int, default=3, help="seconds to wait for each ssh command")
+    parser.add_argument("--ssh-reuse", action="store_true", help="reuse ssh connections with ControlMaster")
+    parser.add_argument("--reservations", type=str, default=RESERVATIONS, help="igor reservations file")
+    parser.add_argument("--cache", type=str, default=READY_CACHE, help="file to cache which nodes are ready in")
+    parser.add_argument("--ttl", type=int, default=300, help="seconds before rechecking nodes that were ready")
 
     args = parser.parse_args()
 
-    prefix, reservations = parse_reservations()
+    prefix, reservations = parse_reservations(args.reservations)
 
-    if args.check:
-        for r in matching_reservations(args.pattern, reservations):
-            ready = True
-            for h in r["Hosts"]:
-                try:
-                    out = subprocess.check_output(["timeout", "3s", "ssh", h, "cat", "/etc/motd"])
-                    if "que_host" not in out:
-                        ready = False
-                except subprocess.CalledProcessError:
-                    ready = False
-            print("Reservation {}: {}".format(r["ResName"], "ready" if ready else ""))
+    jobs = []
+
+    if args.check or args.wait is not None:
+        matches = list(matching_reservations(args.pattern, reservations))
+        hosts = reservation_hosts(matches)
+        cache = load_cache(args.cache)
+        if args.wait is not None:
+            ready = wait_ready(hosts, cache, args.ttl, args.wait, args.backoff, args.jobs, args.ssh_timeout, ssh_options(args.ssh_reuse))
+        else:
+            ready = check_ready(hosts, cache, args.ttl, args.jobs, args.ssh_timeout, ssh_options(args.ssh_reuse))
+        save_cache(args.cache, cache)
+        for r in matches:
+            print("Reservation {}: {}".format(r["ResName"], "ready" if all(ready[h] for h in r["Hosts"]) else ""))
+        if args.wait is not None and not all(ready.values()):
+            sys.exit(1)
     elif args.cycle:
         for r in matching_reservations(args.pattern, reservations):
-            try:
-                subprocess.check_call(["igor", "power", "-r", r["ResName"], "cycle"])
-            except subprocess.CalledProcessError:
-                print("unable to power cycle {}".format(r["ResName"]))
+            jobs.append((r["ResName"], ["igor", "power", "-r", r["ResName"], "cycle"]))
     elif args.off:
         for r in matching_reservations(args.pattern, reservations):
-            try:
-                subprocess.check_call(["igor", "power", "-r", r["ResName"], "off"])
-            except subprocess.CalledProcessError:
-                print("unable to power off {}".format(r["ResName"]))
+            jobs.append((r["ResName"], ["igor", "power", "-r", r["ResName"], "off"]))
     elif args.extend:
         for r in matching_reservations(args.pattern, reservations):
-            try:
-                subprocess.check_call(["igor", "extend", "-r", r["ResName"], "-t", args.extend])
-            except subprocess.CalledProcessError:
-                print("unable to extend {}".format(r["ResName"]))
+            jobs.append((r["ResName"], ["igor", "extend", "-r", r["ResName"], "-t", args.extend]))
+    elif args.prep:
+        for r in matching_reservations(args.pattern, reservations):
+            context = binascii.b2a_hex(os.urandom(8))
+            for h in r["Hosts"]:
+                if args.colocated:
+                    context = binascii.b2a_hex(os.urandom(8))
+                num = h[len(prefix):]
+                jobs.append((h, ["bash", args.prep, prefix, num, num, "{}-{}".format(r["ResName"], context)]))
     elif args.prep_script:
         for r in matching_reservations(args.pattern, reservations):
             context = binascii.b2a_hex(os.urandom(8))
@@ -109,18 +316,31 @@ if __name__ == "__main__":
             nodes.extend(r["Hosts"])
         print(",".join(nodes))
     elif args.ps:
-        for r in matching_reservations(args.pattern, reservations):
+        matches = list(matching_reservations(args.pattern, reservations))
+        outs = probe_all(reservation_hosts(matches), ["ps", "aux"], args.jobs, args.ssh_timeout, ssh_options(args.ssh_reuse))
+        for r in matches:
             res = []
             for h in r["Hosts"]:
-                try:
-                    out = subprocess.check_output(["timeout", "3s", "ssh", h, "ps", "aux"])
-                    if args.ps in out:
-                        res.append(h)
-                    else:
-                        res.append("[{}]".format(h))
-                except subprocess.CalledProcessError:
-                    pass
+                if outs[h] is None:
+                    continue
+                elif args.ps in outs[h]:
+                    res.append(h)
+                else:
+                    res.append("[{}]".format(h))
             print("Reservation {}: {}".format(r["ResName"], ", ".join(res)))
     else:
         for r in matching_reservations(args.pattern, reservations):
             print("Reservation: {}, nodes: {}".format(r["ResName"], ','.join(r["Hosts"])))
+
+    if len(jobs) > 0:
+        if args.cycle or args.off:
+            # nodes must be checked again after they reboot
+            cache = load_cache(args.cache)
+            for r in matching_reservations(args.pattern, reservations):
+                for h in r["Hosts"]:
+                    cache.pop(h, None)
+            save_cache(args.cache, cache)
+
+        results = run_jobs(jobs, args.jobs, args.job_timeout, args.retries, args.backoff)
+        if not print_results(results):
+            sys.exit(1)
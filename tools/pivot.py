@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Pivots the summary table into a matrix with one row per experiment and one
+column per side, field, and stat (e.g. client_ab_time_taken_median). The
+matrix is cached next to the database as a .npy file with a JSON catalog of
+the rows and columns and is only rebuilt when the summary table changes.
+
+Usage: python pivot.py -o wide.csv results.db
+'''
+
+import collections
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+import numpy
+
+from summarize_test_results import PARAMS_HEADERS, STATS_HEADERS
+
+SIDES = ["client", "server"]
+
+
+def fingerprint(conn):
+    """
+    fingerprint returns a value that changes whenever the summary or
+    experiments tables change. Watch mode deletes and reinserts the summary
+    rows of an experiment, which can leave the same number of rows and the
+    same largest rowid, so the totals of the stats are included to detect
+    changes to the content without hashing the whole table.
+    """
+    cur = conn.cursor()
+
+    totals = ", ".join("TOTAL({})".format(k) for k in ["experiment"] + STATS_HEADERS)
+
+    res = []
+    res.extend(cur.execute('SELECT COUNT(*), IFNULL(MAX(rowid), 0), {} FROM summary'.format(totals)).fetchone())
+    res.extend(cur.execute('SELECT COUNT(*), IFNULL(MAX(rowid), 0), TOTAL(broken="true") FROM experiments').fetchone())
+    cur.close()
+
+    return list(res)
+
+
+def column_name(side, field, stat):
+    return "{}_{}_{}".format(side, field, stat)
+
+
+def pivot(conn):
+    """
+    pivot returns the experiment IDs, the column names, and the matrix of
+    stats from the summary table. Columns are ordered by side, field, and
+    then stat in the same order as the CSV from main(). Missing stats are NaN.
+    """
+    cur = conn.cursor()
+
+    query = 'SELECT experiment, side, field, {} FROM summary'.format(", ".join(STATS_HEADERS))
+    rows = numpy.array(cur.execute(query).fetchall(), dtype=object).reshape(-1, 3 + len(STATS_HEADERS))
+    cur.close()
+
+    experiments = numpy.unique(rows[:, 0].astype(numpy.int64))
+
+    # one column per stat for each (side, field), client fields first
+    keys = sorted(set(zip(rows[:, 1], rows[:, 2])), key=lambda k: (SIDES.index(k[0]) if k[0] in SIDES else len(SIDES), k))
+    index = dict((k, i) for i, k in enumerate(keys))
+
+    columns = []
+    for side, field in keys:
+        columns.extend(column_name(side, field, stat) for stat in STATS_HEADERS)
+
+    # stats are stored as strings, empty when there were no values
+    values = rows[:, 3:]
+    values[values == ""] = numpy.nan
+    values = values.astype(numpy.float64)
+
+    r = numpy.searchsorted(experiments, rows[:, 0].astype(numpy.int64))
+    c = numpy.array([index[k] for k in zip(rows[:, 1], rows[:, 2])], dtype=numpy.int64) * len(STATS_HEADERS)
+
+    matrix = numpy.full((len(experiments), len(columns)), numpy.nan)
+    for i in range(len(STATS_HEADERS)):
+        matrix[r, c+i] = values[:, i]
+
+    return experiments.tolist(), columns, matrix
+
+
+def cache_paths(db):
+    base = os.path.splitext(db)[0] + ".pivot"
+    return base + ".npy", base + ".json"
+
+
+def load(db, force=False, mmap=False):
+    """
+    load returns the experiment IDs, the column names, and the matrix from
+    pivot for the database, rebuilding the cached copy if the summary table
+    has changed since it was built (or if force is set). With mmap, a cached
+    matrix is mapped read-only rather than read into memory.
+    """
+    npy, catalog = cache_paths(db)
+
+    conn = sqlite3.connect(db)
+    fp = fingerprint(conn)
+
+    if not force and os.path.exists(npy) and os.path.exists(catalog):
+        with open(catalog) as f:
+            cached = json.load(f)
+
+        if cached["fingerprint"] == fp:
+            logging.info("using cached pivot {}".format(npy))
+            conn.close()
+            return cached["experiments"], cached["columns"], numpy.load(npy, mmap_mode="r" if mmap else None)
+
+    logging.info("building pivot for {}".format(db))
+    experiments, columns, matrix = pivot(conn)
+    conn.close()
+
+    numpy.save(npy, matrix)
+    with open(catalog, "w") as f:
+        json.dump({"fingerprint": fp, "experiments": experiments, "columns": columns}, f)
+
+    return experiments, columns, matrix
+
+
+def read_params(db):
+    """
+    read_params returns a map from experiment ID to its params and the
+    list of params columns, in the order main() uses followed by any others.
+    """
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+
+    params = {}
+    headers = list(PARAMS_HEADERS)
+    for r in conn.execute('SELECT rowid,* FROM experiments'):
+        row = collections.OrderedDict(r)
+        del row["rowid"]
+        params[r["rowid"]] = row
+
+        headers.extend(k for k in row.keys() if k not in headers)
+
+    conn.close()
+
+    return params, headers
+
+
+def write_csv(out_fh, db, experiments, columns, matrix):
+    """
+    write_csv writes a row per experiment with its params and pivoted stats
+    """
+    params, headers = read_params(db)
+
+    writer = csv.writer(out_fh)
+    writer.writerow(["experiment"] + headers + columns)
+
+    for i, experiment in enumerate(experiments):
+        row = [experiment] + [params[experiment].get(k, "") for k in headers]
+        row.extend("" if numpy.isnan(v) else repr(v) for v in matrix[i])
+        writer.writerow(row)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='pivot the summary table to a row per experiment')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, help='CSV output file')
+    parser.add_argument('--force', action='store_true', help='rebuild the pivot even if the summary has not changed')
+    parser.add_argument('db', metavar='DB', type=str, help='database to pivot')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    experiments, columns, matrix = load(args.db, args.force)
+    logging.info("{} experiments by {} columns".format(len(experiments), len(columns)))
+
+    if args.output == '-':
+        write_csv(sys.stdout, args.db, experiments, columns, matrix)
+    elif args.output:
+        with open(args.output, 'w') as f:
+            write_csv(f, args.db, experiments, columns, matrix)
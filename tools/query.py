@@ -0,0 +1,722 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Queries the values in a results database by test parameters, fields, sides,
+and iterations. Filters are turned into SQL so only the matching rows are
+read, results are returned as NumPy arrays, and recent results are cached
+until the database changes. For example:
+
+    db = query.Database("results.db")
+    rps = db.values("ab_requests_per_second", nic="virtio", num_vcpus=2)
+    by_nic = db.group("ab_time_taken", "nic", workload="http")
+
+Values stored as time series (vmstat, ab_requests, ...) in the series table
+are returned one per sample, like the values from the data table.
+
+Federation answers the same queries across the per-directory databases
+without combining them first:
+
+    db = query.Federation(glob.glob("out/*.sqlite3"))
+'''
+
+import collections
+import json
+import logging
+import os
+import sqlite3
+
+import numpy
+
+import series
+import utils
+
+from summarize_test_results import STATS_HEADERS
+
+# columns of the arrays returned by Database.select
+dtype = numpy.dtype([
+    ("experiment", numpy.int64),
+    ("iteration", numpy.int64),
+    ("instance", object),
+    ("side", object),
+    ("field", object),
+    ("value", numpy.float64),
+])
+
+# columns of the arrays returned by summary, stats are NaN when empty
+summary_dtype = numpy.dtype([
+    ("experiment", numpy.int64),
+    ("side", object),
+    ("field", object),
+] + [(k, numpy.float64) for k in STATS_HEADERS])
+
+# most databases that SQLite can attach to one connection by default
+ATTACH_LIMIT = 10
+
+
+def as_list(v):
+    """
+    as_list returns v as a list, None stays None
+    """
+    if v is None:
+        return None
+    if isinstance(v, (list, tuple, set, frozenset)):
+        return sorted(v)
+
+    return [v]
+
+
+def in_clause(column, vals):
+    """
+    in_clause returns a SQL condition that column is one of vals and the
+    arguments for it.
+    """
+    if len(vals) == 1:
+        return '{} = ?'.format(column), list(vals)
+
+    return '{} IN ({})'.format(column, ','.join('?'*len(vals))), list(vals)
+
+
+def create_indexes(conn):
+    """
+    create_indexes adds indexes to the data table so that queries by field
+    and experiment do not have to scan the whole table.
+    """
+    conn.execute('CREATE INDEX IF NOT EXISTS data_field_experiment ON data (field, experiment)')
+    conn.commit()
+
+
+def params_key(params):
+    return tuple((k, tuple(as_list(params[k]))) for k in sorted(params))
+
+
+def data_clauses(table, fields, sides, iterations, instances, broken):
+    """
+    data_clauses returns the SQL conditions on table, data or summary, for
+    the fields, sides, iterations, and instances lists (None for all) and
+    whether to include broken experiments.
+    """
+    clauses = []
+    args = []
+
+    if not broken:
+        clauses.append('experiments.broken != "true"')
+
+    for column, vals in [("field", fields), ("side", sides), ("iteration", iterations), ("instance", instances)]:
+        if vals is not None:
+            clause, v = in_clause("{}.{}".format(table, column), vals)
+            clauses.append(clause)
+            args.extend(v)
+
+    return clauses, args
+
+
+def expand_series(rows):
+    """
+    expand_series returns a row like those from the data table for each
+    sample in rows of experiment, iteration, instance, side, field, and
+    samples from the series table. Samples that are NaN, such as the seconds
+    of ab_latency_mean without any requests, are left out.
+    """
+    res = []
+    for r in rows:
+        r = tuple(r)
+        samples = series.unpack(r[5])
+        res.extend(r[:5] + (v,) for v in samples[~numpy.isnan(samples)].tolist())
+
+    return res
+
+
+def sort_values(rows):
+    """
+    sort_values sorts rows from the data table and expand_series by
+    experiment, side, field, iteration, and instance, keeping the samples of
+    each series in order
+    """
+    rows.sort(key=lambda r: (r[0], r[3], r[4], r[1], r[2]))
+
+
+def summary_values(row):
+    """
+    summary_values converts the stats, stored as strings, in a row from the
+    summary table to floats
+    """
+    row = tuple(row)
+
+    res = list(row[:3])
+    for v in row[3:]:
+        res.append(numpy.nan if v is None or v == "" else float(v))
+
+    return tuple(res)
+
+
+def find_databases(root):
+    """
+    find_databases walks root for databases in the same order as combine.py -f
+    """
+    for root, dirs, files in os.walk(root):
+        for fname in files:
+            if fname.endswith('.sqlite3'):
+                yield os.path.join(root, fname)
+
+
+class Reader(object):
+    """
+    Reader is the base for Database and Federation. Results are kept in a
+    least recently used cache of up to cache_size bytes, which is cleared
+    whenever the fingerprint changes.
+    """
+
+    def __init__(self, name, cache_size=256<<20):
+        self.name = name
+
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.cached_bytes = 0
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, key, fn):
+        """
+        cached returns the result of fn from the cache if the databases have
+        not changed, calling fn and caching its result otherwise.
+        """
+        version = self.fingerprint()
+        if version != self.version:
+            if len(self.cache) > 0:
+                logging.debug("{} changed, clearing cache".format(self.name))
+            self.cache.clear()
+            self.cached_bytes = 0
+            self.version = version
+
+        if key in self.cache:
+            self.hits += 1
+            res = self.cache.pop(key)
+            self.cache[key] = res
+            return res[0]
+
+        self.misses += 1
+        res = fn()
+
+        size = 0
+        if isinstance(res, numpy.ndarray):
+            # results are shared so they must not be modified
+            res.setflags(write=False)
+            size = res.nbytes
+        elif isinstance(res, dict):
+            for v in res.values():
+                if isinstance(v, numpy.ndarray):
+                    v.setflags(write=False)
+                    size += v.nbytes
+
+        if size <= self.cache_size:
+            self.cache[key] = (res, size)
+            self.cached_bytes += size
+
+            while self.cached_bytes > self.cache_size:
+                _, (_, evicted) = self.cache.popitem(last=False)
+                self.cached_bytes -= evicted
+
+        return res
+
+    def where(self, params):
+        """
+        where returns the SQL conditions on the experiments table for params,
+        a map from parameter name to a value or a list of values.
+        """
+        names = self.params()
+
+        clauses = []
+        args = []
+        for k in sorted(params):
+            if k not in names:
+                raise ValueError("unknown parameter: {}".format(k))
+
+            clause, vals = in_clause("experiments.{}".format(k), as_list(params[k]))
+            clauses.append(clause)
+            args.extend(vals)
+
+        return clauses, args
+
+    def values(self, field, side=None, iterations=None, **params):
+        """
+        values returns an array of the values of field from experiments that
+        match params
+        """
+        return self.select(fields=field, sides=side, iterations=iterations, **params)["value"]
+
+    def group(self, field, by, side=None, iterations=None, **params):
+        """
+        group returns an OrderedDict from each value of the parameter by to
+        the array of values of field from experiments that match params
+        """
+        key = ("group", field, by, tuple(as_list(side) or []), tuple(as_list(iterations) or []),
+            params_key(params))
+
+        if by not in self.params():
+            raise ValueError("unknown parameter: {}".format(by))
+
+        def run():
+            experiments = self.experiments(**params)
+            res = self.select(fields=field, sides=side, iterations=iterations, **params)
+
+            levels = numpy.array([experiments[e][by] for e in res["experiment"]], dtype=object)
+
+            groups = collections.OrderedDict()
+            for level in sorted(set(levels.tolist())):
+                groups[level] = res["value"][levels == level]
+
+            return groups
+
+        return self.cached(key, run)
+
+
+class Database(Reader):
+    """
+    Database runs queries against a results database. The cache is cleared
+    whenever the database is modified.
+    """
+
+    def __init__(self, db, cache_size=256<<20):
+        Reader.__init__(self, db, cache_size)
+
+        self.db = db
+        self.conn = sqlite3.connect(db)
+        self.conn.row_factory = sqlite3.Row
+        utils.register_aggregates(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+    def fingerprint(self):
+        """
+        fingerprint changes when the database is modified, either through
+        another connection or by replacing the file
+        """
+        st = os.stat(self.db)
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+        return (version, st.st_mtime, st.st_size, st.st_ino)
+
+    def sql(self, query, args=()):
+        """
+        sql runs any query against the database and returns the cursor. The
+        results are not cached. The aggregates from utils.register_aggregates
+        can be used, for example:
+
+            db.sql('SELECT field, quantile(value, 0.95) FROM data GROUP BY field')
+        """
+        return self.conn.execute(query, args)
+
+    def has_table(self, name):
+        """
+        has_table returns whether the database has the table
+        """
+        query = 'SELECT COUNT(*) FROM sqlite_master WHERE type="table" AND name=?'
+        return self.conn.execute(query, (name,)).fetchone()[0] > 0
+
+    def params(self):
+        """
+        params returns the names of the test parameters
+        """
+        return [r["name"] for r in self.conn.execute('PRAGMA table_info(experiments)')]
+
+    def experiments(self, **params):
+        """
+        experiments returns an OrderedDict from experiment ID to params for the
+        experiments that match params.
+        """
+        key = ("experiments", params_key(params))
+
+        def run():
+            clauses, args = self.where(params)
+
+            query = 'SELECT rowid,* FROM experiments'
+            if len(clauses) > 0:
+                query += ' WHERE ' + ' AND '.join(clauses)
+            query += ' ORDER BY rowid'
+
+            res = collections.OrderedDict()
+            for r in self.conn.execute(query, args):
+                row = collections.OrderedDict(r)
+                del row["rowid"]
+                res[r["rowid"]] = row
+
+            return res
+
+        return self.cached(key, run)
+
+    def select(self, fields=None, sides=None, iterations=None, instances=None, broken=False, **params):
+        """
+        select returns a record array (see dtype) of the values from the data
+        and series tables for the given fields, sides, iterations, and
+        instances (each a value or list of values, None for all) from
+        experiments that match params. Broken experiments are skipped unless
+        broken is set. Rows are ordered by experiment, side, field, iteration,
+        and instance, with each series in the order it was sampled.
+        """
+        fields, sides, iterations, instances = [as_list(v) for v in (fields, sides, iterations, instances)]
+
+        key = ("select", tuple(tuple(v) if v is not None else None for v in (fields, sides, iterations, instances)),
+            broken, params_key(params))
+
+        def run():
+            clauses, args = self.where(params)
+            more, v = data_clauses("data", fields, sides, iterations, instances, broken)
+            clauses.extend(more)
+            args.extend(v)
+
+            query = 'SELECT data.experiment, data.iteration, data.instance, data.side, data.field, data.value FROM data INNER JOIN experiments ON data.experiment=experiments.rowid'
+            if len(clauses) > 0:
+                query += ' WHERE ' + ' AND '.join(clauses)
+            query += ' ORDER BY data.experiment, data.side, data.field, data.iteration, data.instance'
+
+            rows = [tuple(r) for r in self.conn.execute(query, args)]
+
+            if self.has_table("series"):
+                clauses, args = self.where(params)
+                more, v = data_clauses("series", fields, sides, iterations, instances, broken)
+                clauses.extend(more)
+                args.extend(v)
+
+                query = 'SELECT series.experiment, series.iteration, series.instance, series.side, series.field, series.samples FROM series INNER JOIN experiments ON series.experiment=experiments.rowid'
+                if len(clauses) > 0:
+                    query += ' WHERE ' + ' AND '.join(clauses)
+                query += ' ORDER BY series.rowid'
+
+                samples = expand_series(self.conn.execute(query, args))
+                if len(samples) > 0:
+                    rows.extend(samples)
+                    sort_values(rows)
+
+            return numpy.array(rows, dtype=dtype)
+
+        return self.cached(key, run)
+
+    def summary(self, fields=None, sides=None, broken=False, **params):
+        """
+        summary returns a record array (see summary_dtype) of the rows of the
+        summary table for the given fields and sides from experiments that
+        match params, ordered by experiment, side, and field.
+        """
+        fields, sides = as_list(fields), as_list(sides)
+
+        key = ("summary", tuple(fields) if fields is not None else None, tuple(sides) if sides is not None else None,
+            broken, params_key(params))
+
+        def run():
+            clauses, args = self.where(params)
+            more, v = data_clauses("summary", fields, sides, None, None, broken)
+            clauses.extend(more)
+            args.extend(v)
+
+            query = 'SELECT summary.experiment, summary.side, summary.field, {} FROM summary INNER JOIN experiments ON summary.experiment=experiments.rowid'.format(
+                ", ".join("summary.{}".format(k) for k in STATS_HEADERS))
+            if len(clauses) > 0:
+                query += ' WHERE ' + ' AND '.join(clauses)
+            query += ' ORDER BY summary.experiment, summary.side, summary.field'
+
+            rows = [summary_values(r) for r in self.conn.execute(query, args)]
+
+            return numpy.array(rows, dtype=summary_dtype)
+
+        return self.cached(key, run)
+
+
+class Federation(Reader):
+    """
+    Federation runs the same queries as Database across many databases, such
+    as the per-directory databases from combine.py -f, without combining them.
+    The sources are attached ATTACH_LIMIT at a time and queried with one
+    UNION ALL per batch.
+
+    Experiments are matched by their params and numbered in the order they
+    are first seen in sources, so the IDs are the same as in a database that
+    combine.py created from the same sources in the same order. Sources whose
+    tables do not match the first source are skipped, as combine.py does.
+    The cache is cleared whenever any source is modified.
+    """
+
+    def __init__(self, sources, cache_size=256<<20):
+        Reader.__init__(self, "{} databases".format(len(sources)), cache_size)
+
+        self.sources = list(sources)
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        utils.register_aggregates(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+    def fingerprint(self):
+        """
+        fingerprint changes when any of the sources are modified or replaced
+        """
+        res = []
+        for src in self.sources:
+            st = os.stat(src)
+            res.append((st.st_mtime, st.st_size, st.st_ino))
+
+        return tuple(res)
+
+    def batches(self):
+        """
+        batches attaches the sources ATTACH_LIMIT at a time and yields the
+        list of (index, schema) for each batch, detaching them afterwards
+        """
+        for i in range(0, len(self.sources), ATTACH_LIMIT):
+            batch = []
+            try:
+                for j, src in enumerate(self.sources[i:i+ATTACH_LIMIT]):
+                    schema = "s{}".format(j)
+                    self.conn.execute('ATTACH DATABASE ? AS {}'.format(schema), (src,))
+                    batch.append((i+j, schema))
+
+                yield batch
+            finally:
+                for _, schema in batch:
+                    self.conn.execute('DETACH DATABASE {}'.format(schema))
+
+    def catalog(self):
+        """
+        catalog returns the names of the params, an OrderedDict from the
+        federated experiment ID to params, and for each source, the set of
+        tables that can be queried and a map from its experiment IDs to the
+        federated ones (None if the source is skipped).
+        """
+        def run():
+            names = []
+            experiments = collections.OrderedDict()
+            ids = {}
+            sources = []
+            schemas = {}
+
+            for batch in self.batches():
+                for i, schema in batch:
+                    tables = {}
+                    for r in self.conn.execute('SELECT name,sql FROM {}.sqlite_master WHERE type="table"'.format(schema)):
+                        tables[r["name"]] = r["sql"]
+
+                    if "experiments" not in tables:
+                        logging.warn("db does not have experiments table: {}".format(self.sources[i]))
+                        sources.append((set(), None))
+                        continue
+
+                    usable = set(k for k in ["data", "series", "summary"] if k in tables)
+                    usable.add("experiments")
+
+                    if any(k in schemas and schemas[k] != tables[k] for k in usable):
+                        logging.error("tables do not match for {}, skipping".format(self.sources[i]))
+                        sources.append((set(), None))
+                        continue
+
+                    for k in usable:
+                        schemas.setdefault(k, tables[k])
+
+                    mapper = {}
+                    for r in self.conn.execute('SELECT rowid,* FROM {}.experiments'.format(schema)):
+                        row = collections.OrderedDict(r)
+                        del row["rowid"]
+
+                        if len(names) == 0:
+                            names = list(row.keys())
+
+                        p = json.dumps(row, sort_keys=True)
+                        if p not in ids:
+                            ids[p] = len(ids) + 1
+                            experiments[ids[p]] = row
+
+                        mapper[r["rowid"]] = ids[p]
+
+                    sources.append((usable, mapper))
+
+            return names, experiments, sources
+
+        return self.cached(("catalog",), run)
+
+    def params(self):
+        """
+        params returns the names of the test parameters
+        """
+        return self.catalog()[0]
+
+    def union(self, table, columns, clauses, args):
+        """
+        union runs a query for columns of table joined with experiments for
+        every source that has table and returns the rows, with the source's
+        experiment ID replaced by the federated one.
+        """
+        sources = self.catalog()[2]
+
+        query = 'SELECT ?, {} FROM {{0}}.{} AS {}'.format(", ".join(columns), table, table)
+        if table != "experiments":
+            query += ' INNER JOIN {{0}}.experiments AS experiments ON {}.experiment=experiments.rowid'.format(table)
+        if len(clauses) > 0:
+            query += ' WHERE ' + ' AND '.join(clauses)
+
+        rows = []
+        for batch in self.batches():
+            queries = []
+            qargs = []
+            for i, schema in batch:
+                if table in sources[i][0]:
+                    queries.append(query.format(schema))
+                    qargs.append(i)
+                    qargs.extend(args)
+
+            if len(queries) == 0:
+                continue
+
+            for r in self.conn.execute(' UNION ALL '.join(queries), qargs):
+                rows.append((sources[r[0]][1][r[1]],) + tuple(r)[2:])
+
+        return rows
+
+    def experiments(self, **params):
+        """
+        experiments returns an OrderedDict from experiment ID to params for the
+        experiments that match params.
+        """
+        key = ("experiments", params_key(params))
+
+        def run():
+            clauses, args = self.where(params)
+            matched = set(r[0] for r in self.union("experiments", ["experiments.rowid"], clauses, args))
+
+            experiments = self.catalog()[1]
+            return collections.OrderedDict((k, experiments[k]) for k in sorted(matched))
+
+        return self.cached(key, run)
+
+    def select(self, fields=None, sides=None, iterations=None, instances=None, broken=False, **params):
+        """
+        select returns the same record array as Database.select would from a
+        combined database
+        """
+        fields, sides, iterations, instances = [as_list(v) for v in (fields, sides, iterations, instances)]
+
+        key = ("select", tuple(tuple(v) if v is not None else None for v in (fields, sides, iterations, instances)),
+            broken, params_key(params))
+
+        def run():
+            clauses, args = self.where(params)
+            more, v = data_clauses("data", fields, sides, iterations, instances, broken)
+            clauses.extend(more)
+            args.extend(v)
+
+            columns = ["data.experiment", "data.iteration", "data.instance", "data.side", "data.field", "data.value"]
+            rows = self.union("data", columns, clauses, args)
+
+            clauses, args = self.where(params)
+            more, v = data_clauses("series", fields, sides, iterations, instances, broken)
+            clauses.extend(more)
+            args.extend(v)
+
+            columns = ["series.experiment", "series.iteration", "series.instance", "series.side", "series.field", "series.samples"]
+            rows.extend(expand_series(self.union("series", columns, clauses, args)))
+            sort_values(rows)
+
+            return numpy.array(rows, dtype=dtype)
+
+        return self.cached(key, run)
+
+    def summary(self, fields=None, sides=None, broken=False, **params):
+        """
+        summary returns the same record array as Database.summary would from a
+        combined database
+        """
+        fields, sides = as_list(fields), as_list(sides)
+
+        key = ("summary", tuple(fields) if fields is not None else None, tuple(sides) if sides is not None else None,
+            broken, params_key(params))
+
+        def run():
+            clauses, args = self.where(params)
+            more, v = data_clauses("summary", fields, sides, None, None, broken)
+            clauses.extend(more)
+            args.extend(v)
+
+            columns = ["summary.experiment", "summary.side", "summary.field"] + ["summary.{}".format(k) for k in STATS_HEADERS]
+            rows = [summary_values(r) for r in self.union("summary", columns, clauses, args)]
+            rows.sort(key=lambda r: r[:3])
+
+            return numpy.array(rows, dtype=summary_dtype)
+
+        return self.cached(key, run)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='query values from one or more databases, e.g. nic=virtio num_vcpus=2')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-f', '--field', dest='fields', action='append', default=[], help='field to query (default: all)')
+    parser.add_argument('-s', '--side', type=str, help='side to query (default: both)')
+    parser.add_argument('--summary', action='store_true', help='query the summary table instead of the data and series tables')
+    parser.add_argument('--find', metavar='DIR', action='append', default=[], help='directory to walk to search for databases, like combine.py -f')
+    parser.add_argument('--index', action='store_true', help='add indexes to the data table for faster queries')
+    parser.add_argument('--sql', metavar='QUERY', type=str, help='run a query against one database instead, with the median, quantile, etc. aggregates')
+    parser.add_argument('args', metavar='DB|PARAM=VALUE', type=str, nargs='*',
+        help='databases to query, several are queried without combining them, and parameters to match, repeat for any of several values')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    dbs = []
+    for d in args.find:
+        dbs.extend(find_databases(d))
+
+    params = {}
+    for v in args.args:
+        if "=" not in v:
+            dbs.append(v)
+            continue
+        k, v = v.split("=", 1)
+        params.setdefault(k, []).append(v)
+
+    if len(dbs) == 0:
+        parser.error("no databases to query")
+
+    if len(dbs) == 1:
+        db = Database(dbs[0])
+        if args.index:
+            create_indexes(db.conn)
+    else:
+        logging.info("querying {} databases".format(len(dbs)))
+        db = Federation(dbs)
+        if args.index:
+            for src in dbs:
+                conn = sqlite3.connect(src)
+                create_indexes(conn)
+                conn.close()
+
+    if args.sql:
+        if not isinstance(db, Database):
+            parser.error("--sql queries one database")
+
+        cur = db.sql(args.sql)
+        if cur.description is not None:
+            print(",".join(v[0] for v in cur.description))
+        for r in cur:
+            print(",".join(str(v) for v in r))
+    else:
+        if args.summary:
+            res = db.summary(fields=args.fields or None, sides=args.side, **params)
+        else:
+            res = db.select(fields=args.fields or None, sides=args.side, **params)
+
+        print(",".join(res.dtype.names))
+        for r in res:
+            print(",".join(str(v) for v in r))
+
+    db.close()
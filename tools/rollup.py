@@ -0,0 +1,581 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Rolls up the data and series tables into aggregates that can be combined:
+the count, sum, sum of squares, min, max, and a quantile sketch of the values
+of each (experiment, side, field) over all iterations and instances are
+stored in the rollup table. Groupings of the test parameters (e.g. nic or
+nic,num_vcpus) are then materialized in the rollup_cube table by merging the
+rollups of the experiments with the same levels so that group-bys do not
+have to scan the data table. Each sample of a series counts as a value, as
+it does in the summary table.
+
+Refreshing only reads the data for experiments whose rows have changed since
+the last refresh.
+
+Usage: python rollup.py -g nic -g stress_cpu,num_vcpus -q nic -f ab_time_taken results.db
+'''
+
+import collections
+import csv
+import json
+import logging
+import math
+import sqlite3
+import sys
+
+import numpy
+
+import series
+import utils
+
+# values in the same bucket are within ALPHA of each other, relative to their
+# size, so quantiles from the sketch are too
+ALPHA = 0.01
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+
+# bucket codes are offset by this so that positive and negative values have
+# codes with different signs and zero is zero
+OFFSET = 1 << 20
+
+exemplar = collections.OrderedDict([
+    ("experiment", 0),
+    ("side", "client"),
+    ("field", "example"),
+    ("count", 0),
+    ("sum", 0.0),
+    ("sumsq", 0.0),
+    ("min", 0.0),
+    ("max", 0.0),
+    ("sketch", buffer("")),
+])
+
+cube_exemplar = collections.OrderedDict([
+    ("grouping", "nic,num_vcpus"),
+    ("levels", "[]"),
+    ("side", "client"),
+    ("field", "example"),
+    ("experiments", 0),
+    ("count", 0),
+    ("sum", 0.0),
+    ("sumsq", 0.0),
+    ("min", 0.0),
+    ("max", 0.0),
+    ("sketch", buffer("")),
+])
+
+# number of data and series rows and largest rowid of each for each
+# experiment at the last refresh, used to find the experiments that changed
+state_exemplar = collections.OrderedDict([
+    ("experiment", 0),
+    ("rows", 0),
+    ("last", 0),
+    ("series_rows", 0),
+    ("series_last", 0),
+])
+
+QUANTILES = [("p50", 0.5), ("p95", 0.95), ("p99", 0.99)]
+
+
+def bucket(values):
+    """
+    bucket returns the sketch bucket code for each value. Codes sort in the
+    same order as the values.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    mag = numpy.abs(values)
+
+    with numpy.errstate(divide="ignore"):
+        index = numpy.ceil(numpy.log(numpy.where(mag > 0, mag, 1)) / math.log(GAMMA))
+    index = numpy.clip(index, 1 - OFFSET, OFFSET - 1).astype(numpy.int64) + OFFSET
+
+    return numpy.where(mag > 0, numpy.sign(values).astype(numpy.int64) * index, 0)
+
+
+def representative(codes):
+    """
+    representative returns the value for each bucket code, which is within
+    ALPHA of every value in the bucket
+    """
+    codes = numpy.asarray(codes, dtype=numpy.int64)
+    index = numpy.abs(codes) - OFFSET
+
+    return numpy.where(codes != 0, numpy.sign(codes) * 2 * GAMMA ** index / (GAMMA + 1), 0.)
+
+
+class Sketch(object):
+    """
+    Sketch is a histogram of the bucket codes of a set of values, stored as
+    rows of (code, number of values) sorted by code.
+    """
+
+    def __init__(self, pairs=None):
+        if pairs is None:
+            pairs = numpy.zeros((0, 2), dtype=numpy.int64)
+        self.pairs = pairs
+
+    @property
+    def codes(self):
+        return self.pairs[:, 0]
+
+    @property
+    def counts(self):
+        return self.pairs[:, 1]
+
+    @classmethod
+    def loads(cls, blob):
+        return cls(numpy.frombuffer(bytes(blob), dtype=numpy.int64).reshape(-1, 2))
+
+    def dumps(self):
+        return buffer(numpy.ascontiguousarray(self.pairs).tobytes())
+
+    def quantile(self, q):
+        """
+        quantile returns the value at quantile q (0 to 1) of the values in the
+        sketch, NaN if it is empty
+        """
+        n = self.counts.sum()
+        if n == 0:
+            return float("nan")
+
+        # rank of the value at or below the one numpy.percentile interpolates
+        rank = int(math.floor(q * (n - 1)))
+        i = numpy.searchsorted(numpy.cumsum(self.counts), rank, side="right")
+
+        return float(representative(self.codes[i]))
+
+
+def sketches(groups, codes, counts, n):
+    """
+    sketches returns a Sketch for each of n groups given the group, bucket
+    code, and number of values of each entry. All the groups are merged with
+    one sort.
+    """
+    pairs, inverse = numpy.unique(groups * (4 * OFFSET) + codes + 2 * OFFSET, return_inverse=True)
+
+    res = numpy.empty((len(pairs), 2), dtype=numpy.int64)
+    owner = pairs // (4 * OFFSET)
+    res[:, 0] = pairs - owner * (4 * OFFSET) - 2 * OFFSET
+    res[:, 1] = numpy.bincount(inverse, weights=counts, minlength=len(pairs))
+
+    bounds = numpy.searchsorted(owner, numpy.arange(n + 1))
+
+    return [Sketch(res[bounds[i]:bounds[i+1]]) for i in range(n)]
+
+
+def create_tables(cur):
+    """
+    create_tables creates the rollup tables that do not exist yet
+    """
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+
+    if "rollup_state" in tables:
+        columns = [r[1] for r in cur.execute('PRAGMA table_info(rollup_state)')]
+        if columns != list(state_exemplar.keys()):
+            # from before series were rolled up, refresh every experiment
+            cur.execute('DROP TABLE rollup_state')
+            tables.remove("rollup_state")
+
+    for name, ex in [("rollup", exemplar), ("rollup_cube", cube_exemplar), ("rollup_state", state_exemplar)]:
+        if name not in tables:
+            cur.execute(utils.create_table_stmt(name, ex))
+
+
+def has_series(cur):
+    """
+    has_series returns whether the database has the series table
+    """
+    return cur.execute('SELECT COUNT(*) FROM sqlite_master WHERE type="table" AND name="series"').fetchone()[0] > 0
+
+
+def changed_experiments(cur):
+    """
+    changed_experiments returns the experiments whose rows in the data or
+    series tables changed since the last refresh, the experiments that no
+    longer have any, and the new state of every experiment.
+    """
+    old = {}
+    for r in cur.execute('SELECT {} FROM rollup_state'.format(",".join(state_exemplar.keys()))):
+        old[r[0]] = tuple(r[1:])
+
+    new = {}
+    for experiment, rows, last in cur.execute('SELECT experiment, COUNT(*), MAX(rowid) FROM data GROUP BY experiment'):
+        new[experiment] = (rows, last, 0, 0)
+
+    if has_series(cur):
+        for experiment, rows, last in cur.execute('SELECT experiment, COUNT(*), MAX(rowid) FROM series GROUP BY experiment'):
+            new[experiment] = new.get(experiment, (0, 0))[:2] + (rows, last)
+
+    changed = sorted(k for k, v in new.items() if old.get(k) != v)
+    removed = sorted(k for k in old if k not in new)
+
+    return changed, removed, new
+
+
+def aggregate(cur, experiments):
+    """
+    aggregate returns the rollup rows for the experiments from the data and
+    series tables
+    """
+    if len(experiments) == 0:
+        return []
+
+    ids = ','.join(str(int(v)) for v in experiments)
+
+    keys = []
+    index = {}
+
+    def key_index(k):
+        if k not in index:
+            index[k] = len(keys)
+            keys.append(k)
+
+        return index[k]
+
+    groups = []
+    values = []
+    for experiment, side, field, value in cur.execute('SELECT experiment, side, field, value FROM data WHERE value IS NOT NULL AND experiment IN ({})'.format(ids)):
+        groups.append(key_index((experiment, side, field)))
+        values.append(value)
+
+    groups = [numpy.array(groups, dtype=numpy.int64)]
+    values = [numpy.array(values, dtype=numpy.float64)]
+
+    if has_series(cur):
+        for experiment, side, field, samples in cur.execute('SELECT experiment, side, field, samples FROM series WHERE experiment IN ({})'.format(ids)):
+            samples = series.unpack(samples)
+            samples = samples[~numpy.isnan(samples)]
+
+            groups.append(numpy.repeat(numpy.int64(key_index((experiment, side, field))), len(samples)))
+            values.append(samples)
+
+    if len(keys) == 0:
+        return []
+
+    groups = numpy.concatenate(groups)
+    values = numpy.concatenate(values)
+
+    if len(values) == 0:
+        return []
+
+    order = numpy.argsort(groups, kind="mergesort")
+    groups, values = groups[order], values[order]
+
+    starts = numpy.flatnonzero(numpy.r_[True, groups[1:] != groups[:-1]])
+    count = numpy.diff(numpy.r_[starts, len(groups)])
+    total = numpy.add.reduceat(values, starts)
+    sumsq = numpy.add.reduceat(values * values, starts)
+    lo = numpy.minimum.reduceat(values, starts)
+    hi = numpy.maximum.reduceat(values, starts)
+
+    sketch = sketches(groups, bucket(values), numpy.ones(len(values)), len(keys))
+
+    rows = []
+    for i, g in enumerate(groups[starts].tolist()):
+        experiment, side, field = keys[g]
+        rows.append([experiment, side, field, int(count[i]), float(total[i]), float(sumsq[i]),
+            float(lo[i]), float(hi[i]), sketch[g].dumps()])
+
+    return rows
+
+
+def parse_grouping(grouping):
+    """
+    parse_grouping returns the sorted list of params in a comma-separated
+    grouping, which is the order of the levels in the cube
+    """
+    return sorted(set(v for v in grouping.split(",") if v != ""))
+
+
+def read_params(cur):
+    """
+    read_params returns a map from experiment ID to params and the names of
+    the params
+    """
+    cur = cur.connection.cursor()
+    cur.row_factory = sqlite3.Row
+
+    params = {}
+    names = [r["name"] for r in cur.execute('PRAGMA table_info(experiments)')]
+    for r in cur.execute('SELECT rowid,* FROM experiments'):
+        params[r["rowid"]] = dict(r)
+
+    cur.close()
+
+    return params, names
+
+
+def read_rollups(cur, params, experiments=None, field=None, side=None):
+    """
+    read_rollups returns the rollup rows, with the sketches loaded, for
+    experiments (None for all), field, and side, skipping broken experiments
+    """
+    clauses = []
+    args = []
+    if experiments is not None:
+        clauses.append('experiment IN ({})'.format(','.join(str(int(v)) for v in experiments)))
+    if field is not None:
+        clauses.append('field=?')
+        args.append(field)
+    if side is not None:
+        clauses.append('side=?')
+        args.append(side)
+
+    query = 'SELECT * FROM rollup'
+    if len(clauses) > 0:
+        query += ' WHERE ' + ' AND '.join(clauses)
+
+    rows = []
+    for r in cur.execute(query, args):
+        if r[0] not in params or params[r[0]].get("broken") == "true":
+            continue
+
+        r = list(r)
+        r[-1] = Sketch.loads(r[-1])
+        rows.append(r)
+
+    return rows
+
+
+def levels_of(params, by):
+    return tuple(params[k] for k in by)
+
+
+def combine(rollups, params, by):
+    """
+    combine merges the rollups of experiments with the same levels of the
+    params in by and returns an OrderedDict from (levels, side, field) to
+    [experiments, count, sum, sumsq, min, max, sketch].
+    """
+    keys = []
+    index = {}
+
+    cells = []
+    for r in rollups:
+        k = (levels_of(params[r[0]], by), r[1], r[2])
+        if k not in index:
+            index[k] = len(keys)
+            keys.append(k)
+
+        cells.append(index[k])
+
+    if len(keys) == 0:
+        return collections.OrderedDict()
+
+    n = len(keys)
+    cells = numpy.array(cells, dtype=numpy.int64)
+    columns = numpy.array([r[3:8] for r in rollups], dtype=numpy.float64)
+
+    experiments = numpy.bincount(cells, minlength=n)
+    count = numpy.bincount(cells, weights=columns[:, 0], minlength=n)
+    total = numpy.bincount(cells, weights=columns[:, 1], minlength=n)
+    sumsq = numpy.bincount(cells, weights=columns[:, 2], minlength=n)
+
+    lo = numpy.full(n, numpy.inf)
+    numpy.minimum.at(lo, cells, columns[:, 3])
+    hi = numpy.full(n, -numpy.inf)
+    numpy.maximum.at(hi, cells, columns[:, 4])
+
+    lengths = [len(r[8].pairs) for r in rollups]
+    pairs = numpy.concatenate([r[8].pairs for r in rollups])
+    merged = sketches(numpy.repeat(cells, lengths), pairs[:, 0], pairs[:, 1], n)
+
+    res = collections.OrderedDict()
+    for i in sorted(range(n), key=keys.__getitem__):
+        res[keys[i]] = [int(experiments[i]), int(count[i]), float(total[i]), float(sumsq[i]),
+            float(lo[i]), float(hi[i]), merged[i]]
+
+    return res
+
+
+def stats(count, total, sumsq, lo, hi, sketch):
+    """
+    stats returns the stats for an aggregate. The stdev is the population
+    stdev, like in the summary table.
+    """
+    res = collections.OrderedDict()
+    res["count"] = count
+    res["mean"] = total / count if count > 0 else float("nan")
+
+    res["stdev"] = float("nan")
+    if count > 0:
+        res["stdev"] = math.sqrt(max(0., (sumsq - total * total / count) / count))
+
+    res["min"] = lo
+    for name, q in QUANTILES:
+        res[name] = sketch.quantile(q)
+    res["max"] = hi
+
+    return res
+
+
+def refresh(conn, groupings=[]):
+    """
+    refresh updates the rollups of the experiments that changed and the cells
+    of the cube that they are in, for the groupings already in the cube and
+    any new groupings. Returns the number of experiments that were read from
+    the data and series tables.
+    """
+    cur = conn.cursor()
+    create_tables(cur)
+
+    changed, removed, state = changed_experiments(cur)
+
+    groupings = [",".join(parse_grouping(g)) for g in groupings]
+    existing = [r[0] for r in cur.execute('SELECT DISTINCT grouping FROM rollup_cube')]
+
+    if len(changed) == 0 and len(removed) == 0 and all(g in existing for g in groupings):
+        logging.info("rollups are up to date")
+        cur.close()
+        return 0
+
+    stale = changed + removed
+    for i in range(0, len(stale), 500):
+        chunk = ','.join(str(int(v)) for v in stale[i:i+500])
+        cur.execute('DELETE FROM rollup WHERE experiment IN ({})'.format(chunk))
+        cur.execute('DELETE FROM rollup_state WHERE experiment IN ({})'.format(chunk))
+
+    logging.info("rolling up {} experiments".format(len(changed)))
+    cur.executemany(utils.insert_stmt("rollup", exemplar), aggregate(cur, changed))
+    cur.executemany(utils.insert_stmt("rollup_state", state_exemplar),
+        [(k,) + state[k] for k in changed])
+
+    params, names = read_params(cur)
+
+    insert = utils.insert_stmt("rollup_cube", cube_exemplar)
+    for grouping in sorted(set(existing + groupings)):
+        by = parse_grouping(grouping)
+        unknown = [k for k in by if k not in names]
+        if len(unknown) > 0:
+            logging.error("unknown params in grouping {}: {}".format(grouping, ", ".join(unknown)))
+            continue
+
+        if grouping in existing and all(k in params for k in stale):
+            # only rebuild the cells with the levels of the stale experiments
+            levels = set(levels_of(params[k], by) for k in stale)
+            if len(levels) == 0:
+                continue
+
+            experiments = [k for k, v in params.items() if levels_of(v, by) in levels]
+            cur.executemany('DELETE FROM rollup_cube WHERE grouping=? AND levels=?',
+                [(grouping, json.dumps(v)) for v in levels])
+        else:
+            experiments = None
+            cur.execute('DELETE FROM rollup_cube WHERE grouping=?', (grouping,))
+
+        rows = []
+        for (levels, side, field), c in combine(read_rollups(cur, params, experiments), params, by).items():
+            rows.append([grouping, json.dumps(levels), side, field] + c[:6] + [c[6].dumps()])
+
+        logging.info("{} cells for grouping {}".format(len(rows), grouping or "(all)"))
+        cur.executemany(insert, rows)
+
+    conn.commit()
+    cur.close()
+
+    return len(changed)
+
+
+def group(conn, field, by, side=None, **params):
+    """
+    group returns an OrderedDict from (levels, side) to the stats of field
+    for the experiments with each level of the params in by, over all the
+    other params, iterations, and instances. Broken experiments are skipped.
+    Materialized groupings are read from the cube and others are combined
+    from the rollups, in which case only experiments that match params (a
+    map from param to a value or list of values) are included.
+    """
+    by = list(by)
+    grouping = ",".join(parse_grouping(",".join(by)))
+    order = [parse_grouping(grouping).index(k) for k in by]
+
+    cur = conn.cursor()
+
+    cells = {}
+
+    found = False
+    if len(params) == 0:
+        found = cur.execute('SELECT 1 FROM rollup_cube WHERE grouping=? LIMIT 1', (grouping,)).fetchone() is not None
+
+    if found:
+        query = 'SELECT levels, side, experiments, count, sum, sumsq, min, max, sketch FROM rollup_cube WHERE grouping=? AND field=?'
+        args = [grouping, field]
+        if side is not None:
+            query += ' AND side=?'
+            args.append(side)
+
+        for r in cur.execute(query, args):
+            levels = json.loads(r[0])
+            cells[(tuple(levels[i] for i in order), r[1])] = list(r[2:8]) + [Sketch.loads(r[8])]
+    else:
+        experiments, names = read_params(cur)
+        for k in by + list(params):
+            if k not in names:
+                raise ValueError("unknown parameter: {}".format(k))
+
+        def match(p):
+            for k, v in params.items():
+                vals = v if isinstance(v, (list, tuple, set)) else [v]
+                if str(p[k]) not in [str(x) for x in vals]:
+                    return False
+            return True
+
+        experiments = dict((k, v) for k, v in experiments.items() if match(v))
+        rollups = read_rollups(cur, experiments, field=field, side=side)
+
+        for (levels, s, _), c in combine(rollups, experiments, by).items():
+            cells[(levels, s)] = c
+
+    cur.close()
+
+    res = collections.OrderedDict()
+    for k in sorted(cells):
+        c = cells[k]
+        res[k] = stats(c[1], c[2], c[3], c[4], c[5], c[6])
+        res[k]["experiments"] = c[0]
+
+    return res
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='roll up the data and series tables by test parameters')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-g', '--grouping', dest='groupings', action='append', default=[],
+        help='comma-separated params to materialize in the cube, repeat for more than one (empty for all experiments together)')
+    parser.add_argument('-q', '--query', metavar='PARAMS', type=str, help='comma-separated params to group by and print as CSV')
+    parser.add_argument('-f', '--field', type=str, help='field to print with --query')
+    parser.add_argument('-s', '--side', type=str, help='side to print with --query (default: both)')
+    parser.add_argument('db', metavar='DB', type=str, help='database to roll up')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    if args.query is not None and args.field is None:
+        parser.error("--query requires --field")
+
+    conn = sqlite3.connect(args.db)
+
+    refresh(conn, args.groupings)
+
+    if args.query is not None:
+        by = [v for v in args.query.split(",") if v != ""]
+        res = group(conn, args.field, by, args.side)
+
+        writer = csv.writer(sys.stdout)
+        writer.writerow(by + ["side", "field", "experiments"] + ["count", "mean", "stdev", "min"] + [k for k, _ in QUANTILES] + ["max"])
+        for (levels, side), s in res.items():
+            writer.writerow(list(levels) + [side, args.field, s["experiments"]] +
+                [repr(v) if isinstance(v, float) else v for k, v in s.items() if k != "experiments"])
+
+    conn.close()
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Time series stored in the series table. Each row holds the samples for one
+field from one file as a packed array of doubles along with the time of the
+first sample (if known) and the time between samples. Values that are not
+sampled at regular intervals, such as one per powstream session, are stored
+with their times in the points table instead.
+'''
+
+import collections
+import csv
+import logging
+import sqlite3
+import sys
+
+import numpy
+
+import utils
+
+exemplar = collections.OrderedDict([
+    ("experiment", 0),
+    ("iteration", 1),
+    ("instance", "queXYZ"),
+    ("field", "example"),
+    ("side", "client"),
+    ("start", 0.0),
+    ("step", 0.0),
+    ("count", 0),
+    ("samples", sqlite3.Binary(b'')),
+])
+
+# row for the points table, without the experiment, iteration, and instance
+# columns that are added by the DatabaseWriter
+points_exemplar = collections.OrderedDict([
+    ("side", "client"),
+    ("field", "example"),
+    ("time", 0.0),
+    ("value", 0.0),
+])
+
+
+def pack(samples):
+    """
+    pack returns the samples as a blob of doubles
+    """
+    return sqlite3.Binary(numpy.asarray(samples, dtype=numpy.float64).tostring())
+
+
+def unpack(blob):
+    """
+    unpack returns the samples from a blob created by pack
+    """
+    return numpy.frombuffer(blob, dtype=numpy.float64)
+
+
+def times(row):
+    """
+    times returns the time of each sample in a row from the series table,
+    None if the start time is not known
+    """
+    if row["start"] is None:
+        return None
+
+    return row["start"] + row["step"] * numpy.arange(row["count"])
+
+
+def trim(samples, step, warmup=0, cooldown=0):
+    """
+    trim drops the samples in the first warmup and last cooldown seconds.
+    Note that the first vmstat sample is the average since boot so it should
+    usually be dropped with warmup >= step.
+    """
+    start = int(numpy.ceil(warmup / float(step)))
+    end = len(samples) - int(numpy.ceil(cooldown / float(step)))
+
+    return samples[start:max(start, end)]
+
+
+def windows(samples, step, window):
+    """
+    windows reshapes the samples into one row per window of window seconds.
+    The last window is padded with NaNs if it is incomplete.
+    """
+    size = max(1, int(round(window / float(step))))
+    count = -(-len(samples) // size)
+
+    padded = numpy.full(count * size, numpy.nan)
+    padded[:len(samples)] = samples
+
+    return padded.reshape(count, size)
+
+
+def rollup(samples, step, window=60):
+    """
+    rollup returns the count, mean, min, and max for each window of window
+    seconds, ignoring any padding in the last window.
+    """
+    w = windows(samples, step, window)
+
+    return collections.OrderedDict([
+        ("count", numpy.sum(~numpy.isnan(w), axis=1)),
+        ("mean", numpy.nanmean(w, axis=1)),
+        ("min", numpy.nanmin(w, axis=1)),
+        ("max", numpy.nanmax(w, axis=1)),
+    ])
+
+
+def create_table(cur):
+    """
+    create_table creates the series table if it doesn't exist and returns
+    the statement to insert into it.
+    """
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+    if "series" not in tables:
+        cur.execute(utils.create_table_stmt("series", exemplar))
+
+    return utils.insert_stmt("series", exemplar)
+
+
+def read(conn, fields=[], experiments=None):
+    """
+    read yields each row from the series table, ordered by experiment,
+    side, field, iteration, and instance, with the samples unpacked.
+    """
+    query = 'SELECT * FROM series'
+
+    clauses = []
+    args = []
+    if len(fields) > 0:
+        clauses.append('field IN ({})'.format(','.join('?'*len(fields))))
+        args.extend(fields)
+    if experiments is not None:
+        clauses.append('experiment IN ({})'.format(','.join(str(int(v)) for v in experiments)))
+    if len(clauses) > 0:
+        query += ' WHERE ' + ' AND '.join(clauses)
+
+    query += ' ORDER BY experiment, side, field, iteration, instance'
+
+    cur = conn.cursor()
+    for r in cur.execute(query, args):
+        row = collections.OrderedDict(r)
+        row["samples"] = unpack(r["samples"])
+        yield row
+
+    cur.close()
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='windowed rollups of time series from a database')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-f', '--field', dest='fields', action='append', default=[], help='field to roll up (default: all)')
+    parser.add_argument('-w', '--window', type=float, default=60, help='window size in seconds')
+    parser.add_argument('--warmup', type=float, default=0, help='seconds to drop from the start of each series')
+    parser.add_argument('--cooldown', type=float, default=0, help='seconds to drop from the end of each series')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, help='CSV output file', default='-')
+    parser.add_argument('db', metavar='DB', type=str, help='database to read')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    if args.output == '-':
+        out_fh = sys.stdout
+    else:
+        out_fh = open(args.output, 'w')
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+
+    headers = ["experiment", "iteration", "instance", "side", "field", "window", "count", "mean", "min", "max"]
+    writer = csv.DictWriter(out_fh, fieldnames=headers)
+    writer.writeheader()
+
+    for row in read(conn, args.fields):
+        samples = trim(row["samples"], row["step"], args.warmup, args.cooldown)
+        if len(samples) == 0:
+            continue
+
+        res = rollup(samples, row["step"], args.window)
+        for i in range(len(res["count"])):
+            out = dict((k, row[k]) for k in headers[:5])
+            out["window"] = i
+            for k, v in res.items():
+                out[k] = v[i]
+            writer.writerow(out)
+
+    conn.close()
+
+    if out_fh is not sys.stdout:
+        out_fh.close()
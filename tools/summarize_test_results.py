@@ -15,23 +15,177 @@ information about the tests somewhere in the directory naming convention.
 Usage: python summarize_test_results.py -o results.csv 1-concurrent-20171226-physical-10g
 """
 
+import array
+import calendar
 import csv
 import collections
+import contextlib
 import fnmatch
+import heapq
+import itertools
 import json
 import numpy
 import re
 import os
 import sys
 import logging
+import mmap
 import subprocess
 import sqlite3
+import time
+import zlib
 
+import series
 import utils
 
-from distutils.spawn import find_executable
 
-class TcptraceReader(object):
+@contextlib.contextmanager
+def mapped(f):
+    """
+    Maps the file for the readers to search with bytes patterns instead of
+    reading it line by line. Anything that cannot be mapped, such as a pipe
+    or an empty file, is read into memory instead.
+    """
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        yield f.read()
+        return
+
+    try:
+        yield buf
+    finally:
+        buf.close()
+
+
+def drop_nan(samples):
+    """
+    drop_nan returns the samples that are not NaN, such as the seconds of
+    ab_latency_mean without any requests
+    """
+    return samples[~numpy.isnan(samples)]
+
+
+class Batch(object):
+    """
+    A columnar batch of the values read from a file. Instead of a tuple per
+    value, each value has a code that indexes into keys, the list of (side,
+    field) pairs seen in the file. Fields that are sampled over time are kept
+    separately as series so that the order of the samples is not lost.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.index = {}
+        self.codes = array.array('i')
+        self.values = []
+        self.series = []
+        self.rows = []
+
+        # overrides the instance guessed from the path, e.g. for files that
+        # are per host rather than per namespace
+        self.instance = None
+
+    def code(self, side, field):
+        """ Returns the code for (side, field), adding it to keys if needed """
+        key = (side, field)
+        if key not in self.index:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+
+        return self.index[key]
+
+    def append(self, side, field, value):
+        self.codes.append(self.code(side, field))
+        self.values.append(value)
+
+    def extend(self, codes, values):
+        """ Adds values with codes that have already been returned by code """
+        if isinstance(codes, numpy.ndarray):
+            self.codes.fromstring(codes.astype(numpy.intc).tostring())
+        else:
+            self.codes.extend(codes)
+        self.values.extend(values)
+
+    def add_series(self, side, field, samples, step, start=None):
+        """
+        Adds the samples for a field that is sampled every step seconds,
+        starting at start (seconds since the epoch) if known.
+        """
+        self.series.append((side, field, start, step, samples))
+
+    def add_row(self, table, row, exemplar):
+        """
+        Adds a row for a table other than data. The table is created from the
+        exemplar if needed. Neither should include the experiment, iteration,
+        or instance columns.
+        """
+        self.rows.append((table, row, exemplar))
+
+    def columns(self):
+        """
+        Returns the side and field columns as numpy object arrays, one entry
+        per value.
+        """
+        codes = numpy.frombuffer(self.codes, dtype=numpy.intc)
+        sides = numpy.array([k[0] for k in self.keys], dtype=object)
+        fields = numpy.array([k[1] for k in self.keys], dtype=object)
+
+        return sides[codes], fields[codes]
+
+    def groups(self):
+        """
+        Yields ((side, field), values) for each series, without the samples
+        that are NaN, and then for each key, in order of keys.
+        """
+        for side, field, _, _, samples in self.series:
+            yield (side, field), drop_nan(numpy.asarray(samples, dtype=numpy.float64)).tolist()
+
+        if len(self) == 0:
+            return
+
+        codes = numpy.frombuffer(self.codes, dtype=numpy.intc)
+        order = numpy.argsort(codes, kind='mergesort')
+        counts = numpy.bincount(codes, minlength=len(self.keys))
+
+        values = numpy.array(self.values, dtype=object)[order]
+        for key, vals in zip(self.keys, numpy.split(values, numpy.cumsum(counts)[:-1])):
+            yield key, vals.tolist()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for c, value in itertools.izip(self.codes, self.values):
+            side, field = self.keys[c]
+            yield side, field, value
+
+        for side, field, _, _, samples in self.series:
+            for value in samples.tolist():
+                yield side, field, value
+
+
+class Reader(object):
+    """
+    Base class for the file readers. Readers implement either readbatch,
+    which returns a Batch with all the values from the file, or readfile,
+    which yields a (side, field, value) tuple per value. Each is implemented
+    in terms of the other so callers can use either.
+    """
+
+    def readbatch(self, f):
+        batch = Batch()
+        for side, field, value in self.readfile(f):
+            batch.append(side, field, value)
+
+        return batch
+
+    def readfile(self, f):
+        for side, field, value in self.readbatch(f):
+            yield side, field, value
+
+
+class TcptraceReader(Reader):
     """ A class to read the output from tcptrace files """
     field_no_units_regex = re.compile('^(?P<client_field>[^:]+):\s+(?P<client_value>\S+)\s+(?P<server_field>[^:]+):\s+(?P<server_value>\S+)$')
     field_regex = re.compile('^(?P<client_field>[^:]+):\s+(?P<client_value>\S+)\s+(?P<client_units>\S+)\s+(?P<server_field>[^:]*):\s+(?P<server_value>\S+)\s+(?P<server_units>\S+)$')
@@ -39,8 +193,9 @@ class TcptraceReader(object):
     skip_fields = [ "req sack", "req 1323 ws/ts", "SYN/FIN pkts sent" ]
     min_packets = 0
 
-    def readfile(self, f):
-       """ Yields tcp parameters for each side of a connection """
+    def readbatch(self, f):
+       """ Returns tcp parameters for each side of a connection """
+       batch = Batch()
        handle_connection = False
 
        for line in f:
@@ -88,31 +243,28 @@ class TcptraceReader(object):
                except:
                    server_value = 0
 
-           yield "client", m.group('client_field'), client_value
-           yield "server", m.group('server_field'), server_value
+           batch.append("client", m.group('client_field'), client_value)
+           batch.append("server", m.group('server_field'), server_value)
+
+       return batch
 
 
-class TcptraceSummaryReader(object):
+class TcptraceSummaryReader(Reader):
     """
     Wraps TcptraceReader and returns the summary of each field
     """
 
-    def readfile(self, f):
-        values = {}
-
-        for direction, field, value in TcptraceReader().readfile(f):
-            key = (direction, field)
-            if key not in values:
-                values[key] = []
-
-            values[key].append(value)
+    def readbatch(self, f):
+        batch = Batch()
 
-        for ((direction, field), vals) in values.items():
+        for ((direction, field), vals) in TcptraceReader().readbatch(f).groups():
             for stat, val in stats(vals):
-                yield direction, field.replace(' ', '_') + '_' + stat, val
+                batch.append(direction, field.replace(' ', '_') + '_' + stat, val)
 
+        return batch
 
-class aBenchReader(object):
+
+class aBenchReader(Reader):
     """
     A class to read Apache Bench output and collect stats we
     want to monitor.
@@ -131,95 +283,205 @@ class aBenchReader(object):
 
     """
 
-    time_taken =  re.compile('^Time taken for tests:\s+(?P<taken>\d+\.?\d*) seconds')
-    requests =  re.compile('^Requests per second:\s+(?P<requests>\d+\.?\d*)')
-    transfer =  re.compile('^Transfer rate:\s+(?P<transfer>\d+\.?\d*)')
-    completed_reqs =  re.compile('^Complete requests:\s+(?P<completed>\d+\.?\d*)')
-    failed_reqs =  re.compile('^Failed requests:\s+(?P<failed>\d+\.?\d*)')
+    summary = re.compile(br'^[ \t]*(?P<name>Time taken for tests|Requests per second|Transfer rate|Complete requests|Failed requests):[ \t]+(?P<value>\d+\.?\d*)', re.M)
 
+    # field name and type for each of the names matched by summary
+    fields = {
+        b"Time taken for tests": ("ab_time_taken", float),
+        b"Requests per second": ("ab_requests_per_second", float),
+        b"Transfer rate": ("ab_transfer_rate", float),
+        b"Complete requests": ("ab_completed_requests", int),
+        b"Failed requests": ("ab_failed_requests", int),
+    }
 
-    def readfile(self, f):
-        total_seen = 0
+    def readbatch(self, f):
+        batch = Batch()
 
         #  ab is only on the client.
         direction = "client"
 
-        for line in f:
-           line = line.strip()
+        with mapped(f) as buf:
+            for m in aBenchReader.summary.finditer(buf):
+                field, kind = aBenchReader.fields[m.group('name')]
+                try:
+                    batch.append(direction, field, kind(m.group('value')))
+                except ValueError as e:
+                    logging.error(e)
 
-           logging.debug("Reading: {line}".format(line=line))
-
-           if line.startswith("Time taken"):
-               m = aBenchReader.time_taken.match(line)
-               if m:
-                   try:
-                       time_taken = float(m.group('taken'))
-
-                       total_seen += 1
-                       yield direction, "ab_time_taken", time_taken
-
-                   except Exception as e:
-                       logging.error(e)
-                       pass
-           elif line.startswith("Requests per"):
-               m = aBenchReader.requests.match(line)
-               if m:
-                   try:
-                       requests = float(m.group('requests'))
-
-                       total_seen += 1
-                       yield direction, "ab_requests_per_second", requests
-
-                   except Exception as e:
-                       logging.error(e)
-                       pass
-           elif line.startswith("Transfer rate"):
-               m = aBenchReader.transfer.match(line)
-               if m:
-                   try:
-                       transfer = float(m.group('transfer'))
-
-                       total_seen += 1
-                       yield direction, "ab_transfer_rate", transfer
-
-                   except Exception as e:
-                       logging.error(e)
-                       pass
-           elif line.startswith("Failed requests"):
-               m = aBenchReader.failed_reqs.match(line)
-               if m:
-                   try:
-                       failed = int(m.group('failed'))
-
-                       total_seen += 1
-                       yield direction, "ab_failed_requests", failed
-
-                   except Exception as e:
-                       logging.error(e)
-                       pass
-           elif line.startswith("Complete requests"):
-               m = aBenchReader.completed_reqs.match(line)
-               if m:
-                   try:
-                       completed = int(m.group('completed'))
-
-                       total_seen += 1
-                       yield direction, "ab_completed_requests", completed
-
-                   except Exception as e:
-                       logging.error(e)
-                       pass
+        logging.debug("Finished parsing {file}".format(file=f.name))
 
+        if len(batch) < 5:
+            logging.error("Parse error for {file}".format(file=f.name))
 
+        return batch
 
-        logging.debug("Finished parsing {file}".format(file=f.name))
 
-        if total_seen < 5:
+# request times in the latency table are counted in LATENCY_BUCKETS log spaced
+# buckets: bucket 0 has the times up to LATENCY_MIN ms and bucket i the times
+# up to LATENCY_MIN * LATENCY_GAMMA**i ms, so the quantiles from a histogram
+# are within 1% of the actual times. Every histogram has the same buckets so
+# they can be added up across iterations and instances.
+LATENCY_MIN = 0.001
+LATENCY_GAMMA = 1.02
+LATENCY_BUCKETS = 1024
+
+# data fields for quantiles of the request times, e.g. ab_latency_p999
+LATENCY_QUANTILES = [
+    ("p50", 50),
+    ("p90", 90),
+    ("p99", 99),
+    ("p999", 99.9),
+]
+
+
+def latency_histogram(times):
+    """
+    latency_histogram returns the number of times (in ms) in each bucket
+    """
+    times = numpy.maximum(numpy.asarray(times, dtype=numpy.float64), LATENCY_MIN)
+    index = numpy.ceil(numpy.log(times / LATENCY_MIN) / numpy.log(LATENCY_GAMMA))
+    index = numpy.clip(index, 0, LATENCY_BUCKETS-1).astype(numpy.int64)
+
+    return numpy.bincount(index, minlength=LATENCY_BUCKETS)
+
+
+def latency_quantile(counts, q):
+    """
+    latency_quantile returns the time (in ms) at quantile q (0 to 100) from a
+    histogram, or the sum of several
+    """
+    n = counts.sum()
+    if n == 0:
+        return None
+
+    # the bucket with the value at or below the one numpy.percentile
+    # interpolates, and the middle of that bucket
+    rank = int(numpy.floor(q / 100. * (n - 1)))
+    i = numpy.searchsorted(numpy.cumsum(counts), rank, side="right")
+    if i == 0:
+        return 0.0
+
+    return 2 * LATENCY_MIN * LATENCY_GAMMA**i / (LATENCY_GAMMA + 1)
+
+
+class aBenchRequestsReader(Reader):
+    """
+    A class to read the time of each request that ab writes with -g, e.g.
+
+        starttime	seconds	ctime	dtime	ttime	wait
+        Mon Oct 19 00:50:12 2026	1603068612	0	1	1	1
+
+    Returns the quantiles of the total time (ttime, in ms) of the requests, a
+    row for the latency table with their histogram instead of a value per
+    request, and series of the number of requests and their mean time for
+    each second. The mean is NaN for seconds without any requests.
+    """
+    # seconds, ctime, dtime, ttime, and wait of each request
+    request = re.compile(br'\t(\d+\t-?\d+\t-?\d+\t-?\d+\t-?\d+)[ \t]*$', re.M)
+
+    exemplar = collections.OrderedDict([
+        ("side", "client"),
+        ("field", "ab_latency"),
+        ("count", 0),
+        ("counts", sqlite3.Binary(b'')),
+    ])
+
+    def readbatch(self, f):
+        batch = Batch()
+
+        with mapped(f) as buf:
+            requests = aBenchRequestsReader.request.findall(buf)
+
+        if len(requests) == 0:
+            logging.error("Parse error for {file}".format(file=f.name))
+            return batch
+
+        values = numpy.fromstring(b' '.join(requests), dtype=numpy.int64, sep=' ')
+        values = values.reshape(len(requests), 5)
+        times = values[:, 3]
+
+        # requests started and their mean time for each second, seconds
+        # without any requests have no mean
+        start = values[:, 0].min()
+        second = values[:, 0] - start
+        counts = numpy.bincount(second)
+        started = counts > 0
+        means = numpy.full(len(counts), numpy.nan)
+        means[started] = numpy.bincount(second, weights=times)[started] / counts[started]
+
+        batch.add_series("client", "ab_requests", counts, 1, float(start))
+        batch.add_series("client", "ab_latency_mean", means, 1, float(start))
+
+        for name, q in LATENCY_QUANTILES:
+            batch.append("client", "ab_latency_{}".format(name), float(numpy.percentile(times, q)))
+
+        row = collections.OrderedDict([
+            ("side", "client"),
+            ("field", "ab_latency"),
+            ("count", len(times)),
+            ("counts", sqlite3.Binary(latency_histogram(times).astype(numpy.int64).tostring())),
+        ])
+        batch.add_row("latency", row, aBenchRequestsReader.exemplar)
+
+        return batch
+
+
+class aBenchPercentilesReader(Reader):
+    """
+    A class to read the percentiles of the request times that ab writes with
+    -e, e.g.
+
+        Percentage served,Time in ms
+        0,0.412
+        1,0.508
+        ...
+        100,61.227
+
+    Only whole percentiles are written so there is no p999. Skipped if there
+    is an ab.tsv file for the same run since it has the time of every request.
+    """
+    percentile = re.compile(br'^(\d+),(\d+\.?\d*)[ \t]*$', re.M)
+
+    def readbatch(self, f):
+        batch = Batch()
+
+        if os.path.exists(os.path.join(os.path.dirname(f.name), "ab.tsv")):
+            return batch
+
+        with mapped(f) as buf:
+            percentiles = dict((int(p), float(t)) for p, t in aBenchPercentilesReader.percentile.findall(buf))
+
+        if len(percentiles) == 0:
             logging.error("Parse error for {file}".format(file=f.name))
 
+        for name, q in LATENCY_QUANTILES:
+            if q in percentiles:
+                batch.append("client", "ab_latency_{}".format(name), percentiles[q])
+
+        return batch
+
 
+# seconds between the NTP epoch (1900) and the Unix epoch
+NTP_EPOCH = 2208988800
 
-class PowstreamReader(object):
+# powstream names each session START_END.owp with 64-bit NTP timestamps
+owp_session = re.compile(r'(\d{20})_\d{20}\.owp$')
+
+def session_start(fname):
+    """
+    session_start returns the time (seconds since the epoch) that the
+    powstream session in fname started, from its name if possible and
+    otherwise from when the file was last modified
+    """
+    m = owp_session.search(fname)
+    if m is None:
+        return os.path.getmtime(fname)
+
+    ts = int(m.group(1))
+    return (ts >> 32) - NTP_EPOCH + (ts & 0xffffffff) / float(1 << 32)
+
+
+class PowstreamReader(Reader):
     """ A class to reader the output from powstream client by converting the
         owp output into what's output by the owping client, and using the
         OwampReader on it
@@ -234,6 +496,8 @@ class PowstreamReader(object):
         self.direction = direction
 
     def readfile(self, f):
+        from distutils.spawn import find_executable
+
         owamp_reader = OwampReader(direction=self.direction)
 
         if not find_executable('owstats'):
@@ -246,7 +510,26 @@ class PowstreamReader(object):
         for side, field, value in owamp_reader.readfile(p.stdout):
             yield side, field, value
 
-class OwampReader(object):
+    def readbatch(self, f):
+        """
+        Also adds a row to the points table for each value with the time the
+        session started
+        """
+        batch = Reader.readbatch(self, f)
+
+        start = session_start(f.name)
+        for side, field, value in batch:
+            row = collections.OrderedDict([
+                ("side", side),
+                ("field", field),
+                ("time", start),
+                ("value", value),
+            ])
+            batch.add_row("points", row, series.points_exemplar)
+
+        return batch
+
+class OwampReader(Reader):
     """ A class to reader the output from owamp client
 
         e.g.
@@ -255,142 +538,338 @@ class OwampReader(object):
         one-way delay min/median/max = 971/971/988 ms, (unsync)
         one-way jitter = 0.8 ms (P95-P50)
     """
-    packet_summary =  re.compile('^(?P<packets>\d+) sent, (?P<lost>\d+) lost.*, (?P<dups>\d+) duplicates')
-    jitter_summary =  re.compile('^one-way jitter = (?P<jitter>\d+\.?\d*) ms')
+    summary = re.compile(br'^[ \t]*(?:(?P<packets>\d+) sent, (?P<lost>\d+) lost.*, (?P<dups>\d+) duplicates|one-way jitter = (?P<jitter>\d+\.?\d*) ms)', re.M)
 
     def __init__(self, direction=None):
         self.direction = direction
 
-    def readfile(self, f):
+    def readbatch(self, f):
+       batch = Batch()
        is_c2s = True
        total_seen = 0
 
-       for line in f:
-           line = line.strip()
-
-           if self.direction:
-               direction = self.direction
-           else:
-               direction = "client" if is_c2s else "server"
-
-           m = OwampReader.packet_summary.match(line)
-           if m:
-               try:
-                   #print >>sys.stderr, "Matched summary"
-                   packet_value = int(m.group('packets'))
-                   lost_value   = int(m.group('lost'))
-                   dups_value   = int(m.group('dups'))
-
-                   total_seen += 1
-
-                   yield direction, "owamp_packets", packet_value
-                   yield direction, "owamp_lost", lost_value
-                   yield direction, "owamp_dups", dups_value
-               except Exception as e:
-                   logging.error(e)
-                   pass
-
-           m = OwampReader.jitter_summary.match(line)
-           if m:
-               try:
-                   #print >>sys.stderr, "Matched jitter"
-                   jitter_value = float(m.group('jitter'))
+       with mapped(f) as buf:
+           for m in OwampReader.summary.finditer(buf):
+               if self.direction:
+                   direction = self.direction
+               else:
+                   direction = "client" if is_c2s else "server"
 
-                   total_seen += 1
+               total_seen += 1
 
+               if m.group('jitter') is None:
+                   batch.append(direction, "owamp_packets", int(m.group('packets')))
+                   batch.append(direction, "owamp_lost", int(m.group('lost')))
+                   batch.append(direction, "owamp_dups", int(m.group('dups')))
+               else:
                    # This is the last value we expect
                    is_c2s = False
 
-                   yield direction, "owamp_jitter", jitter_value
-               except Exception as e:
-                   logging.error(e)
-                   pass
-
+                   batch.append(direction, "owamp_jitter", float(m.group('jitter')))
 
        if self.direction and total_seen < 2:
           logging.error("Parse error for {file}".format(file=f.name))
        elif not self.direction and total_seen < 4:
           logging.error("Parse error for {file}".format(file=f.name))
 
-class VmStatsReader(object):
-    """ A class to read the output from vmstat files """
+       return batch
+
+class VmStatsReader(Reader):
+    """
+    A class to read the output from vmstat files. Each field is returned as
+    a series with a sample per line.
+    """
+    # run.bash runs `vmstat -t 5`
+    interval = 5
+
+    fields_names = [
+                     "running",
+                     "blocked",
+                     "mem_swapped",
+                     "mem_free",
+                     "mem_buffers",
+                     "mem_cache",
+                     "swap_in",
+                     "swap_out",
+                     "blocks_in",
+                     "blocks_out",
+                     "int_rate",
+                     "cs_rate",
+                     "cpu_user",
+                     "cpu_sys",
+                     "cpu_idle",
+                     "cpu_wait",
+                     "cpu_stolen",
+                   ]
+
+    # lines with (at least) a value for each field, skips the headers
+    sample = re.compile(br'^[ \t]*((?:\d+[ \t]+){%d}\d+)(?=\s|$)' % (len(fields_names)-1), re.M)
+
+    # with -t, each sample ends with the time it was taken and the header
+    # ends with the time zone, run.bash sets TZ=UTC
+    stamp = re.compile(br'[ \t](\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)[ \t]*$', re.M)
+    utc = re.compile(br'[ \t]UTC[ \t]*$', re.M)
 
     def __init__(self, direction):
         self.direction = direction
 
-    def readfile(self, f):
-        """ Yields syscall parameters for each side of a connection """
-        fields_names = [
-                         "running",
-                         "blocked",
-                         "mem_swapped",
-                         "mem_free",
-                         "mem_buffers",
-                         "mem_cache",
-                         "swap_in",
-                         "swap_out",
-                         "blocks_in",
-                         "blocks_out",
-                         "int_rate",
-                         "cs_rate",
-                         "cpu_user",
-                         "cpu_sys",
-                         "cpu_idle",
-                         "cpu_wait",
-                         "cpu_stolen",
-                       ]
-
-        for line in f:
-            try:
-                line = line.strip()
-                fields = line.split()
-                for i, value in enumerate(fields):
-                    field_name = fields_names[i]
+    def readbatch(self, f):
+        """ Returns a series for each column """
+        batch = Batch()
 
-                    yield self.direction, "vm_{}".format(field_name), int(value)
-            except:
-                pass
+        start = None
+        with mapped(f) as buf:
+            samples = VmStatsReader.sample.findall(buf)
+
+            m = VmStatsReader.stamp.search(buf)
+            if m is not None:
+                # the stamps are in the host's local time, which we can't
+                # convert without knowing the host's offset
+                if VmStatsReader.utc.search(buf):
+                    start = float(calendar.timegm(time.strptime(m.group(1).decode(), "%Y-%m-%d %H:%M:%S")))
+                else:
+                    logging.warn("vmstat times are not in UTC, not storing times for {}".format(f.name))
+
+        if len(samples) == 0:
+            return batch
+
+        values = numpy.fromstring(b' '.join(samples), dtype=numpy.int64, sep=' ')
+        values = values.reshape(len(samples), len(VmStatsReader.fields_names))
+
+        for i, v in enumerate(VmStatsReader.fields_names):
+            batch.add_series(self.direction, "vm_{}".format(v), values[:, i], VmStatsReader.interval, start)
+
+        return batch
+
+def parse_interrupts(buf):
+    """
+    parse_interrupts parses the contents of /proc/interrupts and returns the
+    normalized name of each interrupt and a matrix with the count for each
+    interrupt (rows) and CPU (columns). Lines without a count for every CPU,
+    such as ERR and MIS, are skipped.
+    """
+    end = buf.find(b'\n')
+    if end == -1:
+        end = len(buf)
+    cpu_count = len(buf[:end].split())
+    if cpu_count == 0:
+        return [], numpy.zeros((0, 0), dtype=numpy.int64)
+
+    line = re.compile(br'^[ \t]*([^\s:]+):((?:[ \t]+\d+){%d})([^\n]*)$' % cpu_count, re.M)
+
+    names = []
+    counts = []
+    for m in line.finditer(buf, end):
+        irq = m.group(1)
+        if irq.isdigit():
+            desc = m.group(3).split()
+            if len(desc) > 0:
+                irq = desc[-1]
+
+        # Normalize the irq name
+        irq = irq.lower()
+        irq = re.sub(b"[^a-z0-9_]", b"_", irq)
+
+        names.append(irq)
+        counts.append(m.group(2))
+
+    if len(counts) == 0:
+        return [], numpy.zeros((0, cpu_count), dtype=numpy.int64)
+
+    matrix = numpy.fromstring(b' '.join(counts), dtype=numpy.int64, sep=' ')
 
-class InterruptsReader(object):
+    return names, matrix.reshape(len(names), cpu_count)
+
+class InterruptsReader(Reader):
     """ A class to read Linux '/proc/interrupts' files """
     def __init__(self, direction):
         self.direction = direction
 
-    def readfile(self, f):
-       """ Yields each interrupt total """
-       header = f.readline()
-       cpus = header.split()
-       cpu_count = len(cpus)
+    def readbatch(self, f):
+       """ Returns each interrupt total """
+       batch = Batch()
 
-       for line in f:
-           line = line.strip()
+       with mapped(f) as buf:
+           names, counts = parse_interrupts(buf)
 
-           fields = line.split()
-           if len(fields) < 3:
-               continue
+       for irq, total_interrupts in zip(names, counts.sum(axis=1).tolist()):
+           batch.append(self.direction, "int_{}".format(irq), total_interrupts)
 
-           irq = fields[0].strip(':')
-           if irq.isdigit():
-               irq = fields[-1].lower()
+       return batch
 
-           # Normalize the irq name
-           irq = irq.lower()
-           irq = re.sub("[^a-z0-9_]", "_", irq)
+def interrupts_delta(names, after, before_names, before):
+    """
+    interrupts_delta returns the counts in after minus the counts for the
+    same interrupts in before. Interrupts are matched by name and by order
+    for names that appear more than once; interrupts that are not in before
+    are assumed to have started at zero.
+    """
+    def keys(names):
+        seen = collections.Counter()
+        for name in names:
+            seen[name] += 1
+            yield (name, seen[name])
+
+    if before.shape[1] != after.shape[1]:
+        logging.warn("number of CPUs changed from {} to {}".format(before.shape[1], after.shape[1]))
+        return after.copy()
+
+    index = dict((k, i) for i, k in enumerate(keys(before_names)))
+    rows = numpy.array([index.get(k, -1) for k in keys(names)], dtype=numpy.intp)
+
+    aligned = numpy.zeros_like(after)
+    if len(before) > 0:
+        aligned = before[rows]
+        aligned[rows == -1] = 0
+
+    return after - aligned
+
+def run_elapsed(path, host):
+    """
+    run_elapsed returns how long the run in the iteration directory path was
+    on host, from the first to the last sample in its vmstat.<host> file
+    (which run.bash starts along with the interrupts.before.<host> copy and
+    stops at the end of the run) or else the longest ab_time_taken of the
+    namespaces. Returns None if neither is there.
+    """
+    try:
+        with open(os.path.join(path, "vmstat.{}".format(host))) as f:
+            with mapped(f) as buf:
+                count = len(VmStatsReader.sample.findall(buf))
+                stamps = VmStatsReader.stamp.findall(buf)
+
+        if len(stamps) >= 2:
+            # the time zone does not matter for the difference
+            first, last = [calendar.timegm(time.strptime(v.decode(), "%Y-%m-%d %H:%M:%S")) for v in (stamps[0], stamps[-1])]
+            return float(last - first)
+        if count >= 2:
+            return float((count - 1) * VmStatsReader.interval)
+    except (IOError, OSError):
+        pass
+
+    elapsed = None
+    for namespace in sorted(os.listdir(path)):
+        try:
+            with open(os.path.join(path, namespace, "ab.out")) as f:
+                with mapped(f) as buf:
+                    for m in aBenchReader.summary.finditer(buf):
+                        v = float(m.group('value'))
+                        if aBenchReader.fields[m.group('name')][0] == "ab_time_taken" and (elapsed is None or v > elapsed):
+                            elapsed = v
+        except (IOError, OSError):
+            continue
+
+    return elapsed
+
+class InterruptsDeltaReader(Reader):
+    """
+    A class to read the interrupts.after.<host> files that run.bash copies
+    from each host along with the matching interrupts.before.<host> file.
+    Returns the total for each interrupt during the run as host_int_<irq>,
+    so they are not mixed up with the since boot totals from the VMs, the
+    rate as host_int_<irq>_rate if run_elapsed can tell how long the run
+    was, and a row for the interrupts table with the per CPU counts.
+    """
+    exemplar = collections.OrderedDict([
+        ("side", "client"),
+        ("names", "[]"),
+        ("cpus", 0),
+        ("elapsed", 0.0),
+        ("counts", sqlite3.Binary(b'')),
+    ])
+
+    def __init__(self, direction, host):
+        self.direction = direction
+        self.host = host
+
+    def readbatch(self, f):
+        batch = Batch()
+        batch.instance = self.host
 
-           total_interrupts = 0
-           for val in fields[1:cpu_count+1]:
-               total_interrupts += int(val)
+        with mapped(f) as buf:
+            names, after = parse_interrupts(buf)
 
-           yield self.direction, "int_{}".format(irq), total_interrupts
+        path = os.path.dirname(f.name)
+        before_name = os.path.join(path, "interrupts.before.{}".format(self.host))
+        elapsed = None
 
-class SysdigFreqReader(object):
+        try:
+            with open(before_name) as f2:
+                with mapped(f2) as buf:
+                    before_names, before = parse_interrupts(buf)
+
+            elapsed = run_elapsed(path, self.host)
+            if not elapsed:
+                logging.warn("no vmstat.{} or ab.out in {}, not computing rates".format(self.host, path))
+                elapsed = None
+        except (IOError, OSError):
+            logging.warn("no {}, using counts since boot".format(before_name))
+            before_names, before = [], numpy.zeros((0, after.shape[1]), dtype=numpy.int64)
+
+        delta = interrupts_delta(names, after, before_names, before)
+
+        for irq, total in zip(names, delta.sum(axis=1).tolist()):
+            batch.append(self.direction, "host_int_{}".format(irq), total)
+            if elapsed is not None:
+                batch.append(self.direction, "host_int_{}_rate".format(irq), total / elapsed)
+
+        row = collections.OrderedDict([
+            ("side", self.direction),
+            ("names", json.dumps(names)),
+            ("cpus", delta.shape[1]),
+            ("elapsed", elapsed),
+            ("counts", sqlite3.Binary(delta.astype(numpy.int64).tostring())),
+        ])
+        batch.add_row("interrupts", row, InterruptsDeltaReader.exemplar)
+
+        return batch
+
+def read_latency(conn):
+    """
+    read_latency yields each row from the latency table with the histogram
+    unpacked. Histograms for the same field can be added together, e.g. to get
+    the p999 of an experiment over all its iterations and instances.
+    """
+    cur = conn.cursor()
+    for r in cur.execute('SELECT * FROM latency'):
+        row = collections.OrderedDict(r)
+        row["counts"] = numpy.frombuffer(r["counts"], dtype=numpy.int64)
+
+        yield row
+
+    cur.close()
+
+def read_interrupts(conn):
+    """
+    read_interrupts yields each row from the interrupts table with the names
+    and counts unpacked and the per CPU rates, if the elapsed time is known.
+    """
+    cur = conn.cursor()
+    for r in cur.execute('SELECT * FROM interrupts'):
+        row = collections.OrderedDict(r)
+        row["names"] = json.loads(r["names"])
+        row["counts"] = numpy.frombuffer(r["counts"], dtype=numpy.int64).reshape(len(row["names"]), r["cpus"])
+        row["rates"] = None
+        if r["elapsed"]:
+            row["rates"] = row["counts"] / float(r["elapsed"])
+
+        yield row
+
+    cur.close()
+
+class SysdigFreqReader(Reader):
     """ A class to read the output from sysdig files """
+    # if the file is truncated, it dumps the table, and error, and then the
+    # table again... only need the first table
+    table = re.compile(br'\A(?:[^\n]*\n){2}((?:[ \t]*\d+[ \t]+\S+[ \t]*(?:\n|\Z))*)')
+    line = re.compile(br'(\d+)[ \t]+(\S+)')
+
     def __init__(self, direction):
         self.direction = direction
 
-    def readfile(self, f):
+    def readbatch(self, f):
         """
-        Yields syscall parameters for each side of a connection from:
+        Returns syscall parameters for each side of a connection from:
 
         # Calls             Syscall
         --------------------------------------------------------------------------------
@@ -403,21 +882,24 @@ class SysdigFreqReader(object):
         # figure out if this is all the system calls or just the workload
         kind = "workload" if "workload" in f.name else "all"
 
-        # throw away header
-        f.readline()
-        f.readline()
+        batch = Batch()
+
+        with mapped(f) as buf:
+            m = SysdigFreqReader.table.match(buf)
+            if not m:
+                return batch
+
+            rows = SysdigFreqReader.line.findall(m.group(1))
 
-        for line in f:
-            parts = line.split()
-            # if the file is truncated, it dumps the table, and error, and then
-            # the table again... only need the first table
-            if len(parts) != 2:
-                break
-            count, syscall = line.split()
-            yield self.direction, "sc_{}_{}".format(kind, parts[1]), int(parts[0])
+        # only a few hundred syscalls so not worth converting in bulk
+        prefix = "sc_{}_".format(kind)
+        for count, syscall in rows:
+            batch.append(self.direction, prefix + syscall, int(count))
 
+        return batch
 
-class SysdigRawReader(object):
+
+class SysdigRawReader(Reader):
     """ A class to read the output from sysdig files """
     syscall_count_regex = re.compile('^(?P<value>\d+)\s+(?P<syscall>\S+)$')
 
@@ -457,6 +939,17 @@ def get_file_reader(fname):
         return TcptraceSummaryReader()
     elif "ab.out" in fname:
         return aBenchReader()
+    elif fname.endswith("ab.tsv"):
+        return aBenchRequestsReader()
+    elif fname.endswith("ab.csv"):
+        return aBenchPercentilesReader()
+    elif "interrupts.after." in fname:
+        direction = "server" if "server" in fname else "client"
+        host = fname.rsplit("interrupts.after.", 1)[1]
+        return InterruptsDeltaReader(direction=direction, host=host)
+    elif "interrupts.before." in fname:
+        # read along with the interrupts.after file
+        return
     elif "interrupts" in fname:
         direction = "server" if "server" in fname else "client"
         return InterruptsReader(direction=direction)
@@ -505,15 +998,13 @@ def find_files(directories, types):
                     yield fname
 
 
-def create_db(db, directories=[], types=[], params_hint=None):
-    conn = sqlite3.connect(db)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur2 = conn.cursor()
-
-    envs = {}
-    insert_experiment = None
-
+class DatabaseWriter(object):
+    """
+    Writes the values read from test files to the data table of a database.
+    The tables are created if they do not exist yet and experiments that are
+    already in the database are reused so that the writer can be pointed at an
+    existing database.
+    """
     exemplar = collections.OrderedDict([
         ("experiment", 0),
         ("iteration", 1),
@@ -522,12 +1013,85 @@ def create_db(db, directories=[], types=[], params_hint=None):
         ("side", "client"),
         ("value", 0.0),
     ])
-    cur.execute(utils.create_table_stmt("data", exemplar))
-    insert_data = utils.insert_stmt("data", exemplar)
 
-    values = []
+    def __init__(self, conn, keep_values=False):
+        self.conn = conn
+        self.cur = conn.cursor()
 
-    for fname in find_files(directories, types):
+        self.envs = {}
+        self.broken = set()
+        self.insert_experiment = None
+        self.experiment_columns = None
+
+        # if keep_values is set, values are also grouped by (experiment,
+        # side, field) so that they can be summarized without reading them
+        # back from the database
+        self.groups = None
+        if keep_values:
+            self.groups = {}
+
+        tables = [r[0] for r in self.cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+
+        if "data" not in tables:
+            self.cur.execute(utils.create_table_stmt("data", DatabaseWriter.exemplar))
+        self.insert_data = utils.insert_stmt("data", DatabaseWriter.exemplar)
+
+        self.insert_series = series.create_table(self.cur)
+
+        # insert statements for the tables for Batch.add_row
+        self.inserts = {}
+        self.tables = set(tables)
+
+        if "experiments" in tables:
+            for r in self.cur.execute('SELECT rowid,* FROM experiments'):
+                params = collections.OrderedDict(r)
+                del params["rowid"]
+
+                self.envs[DatabaseWriter.key(params)] = r["rowid"]
+                if params.get("broken") == "true":
+                    self.broken.add(r["rowid"])
+
+            # from the schema since the table may be empty, e.g. if a
+            # previous run was stopped before it committed any experiments
+            self.experiment_columns = [r[1] for r in self.cur.execute('PRAGMA table_info(experiments)')]
+            self.insert_experiment = utils.insert_stmt("experiments",
+                collections.OrderedDict((k, "") for k in self.experiment_columns))
+
+    @staticmethod
+    def key(params):
+        """
+        key returns the key for params in envs. Values are compared as
+        strings since SQLite gives back numbers for the numeric params (e.g.
+        num_vcpus) that guess_test_parameters returns as strings.
+        """
+        return json.dumps([(k, unicode(v)) for k, v in params.items()])
+
+    def experiment(self, params):
+        """
+        experiment returns the ID for the experiment with the given params,
+        inserting a new experiment if needed.
+        """
+        full_env = DatabaseWriter.key(params)
+
+        if full_env not in self.envs:
+            if self.insert_experiment is None:
+                self.cur.execute(utils.create_table_stmt("experiments", params))
+                self.experiment_columns = list(params.keys())
+                self.insert_experiment = utils.insert_stmt("experiments", params)
+
+            self.cur.execute(self.insert_experiment, [params.get(k) for k in self.experiment_columns])
+            self.envs[full_env] = self.cur.lastrowid
+
+            if params["broken"] == "true":
+                self.broken.add(self.cur.lastrowid)
+
+        return self.envs[full_env]
+
+    def add_file(self, fname, params_hint=None):
+        """
+        add_file reads the values from fname and queues them for insertion.
+        Returns the ID of the experiment the values belong to.
+        """
         if params_hint is not None:
             params, path = utils.guess_test_parameters(params_hint)
         else:
@@ -543,92 +1107,562 @@ def create_db(db, directories=[], types=[], params_hint=None):
 
         file_reader = get_file_reader(fname)
         if not file_reader:
-            loging.warn("Unknown file type: {fname}".format(fname=fname))
+            logging.warn("Unknown file type: {fname}".format(fname=fname))
 
         logging.info("Reading {fname}".format(fname=fname))
-        full_env = json.dumps(params)
+        experiment = self.experiment(params)
 
-        if full_env not in envs:
-            if insert_experiment is None:
-                cur.execute(utils.create_table_stmt("experiments", params))
-                insert_experiment = utils.insert_stmt("experiments", params)
+        with open(fname) as f:
+            batch = file_reader.readbatch(f)
 
-            cur.execute(insert_experiment, params.values())
-            envs[full_env] = cur.lastrowid
+        self.add_batch(experiment, saved["iteration"], saved["instance"], batch)
 
-        with open(fname) as f:
-            for side, field, value in file_reader.readfile(f):
-                row = (envs[full_env], saved["iteration"], saved["instance"], field, side, value)
-                values.append(row)
-                if len(values) > 100000:
-                    cur.executemany(insert_data, values)
-                    conn.commit()
-                    values = []
-
-    if len(values) > 0:
-        cur.executemany(insert_data, values)
-        conn.commit()
+        return experiment
 
-    cur.close()
-    conn.close()
-    return
+    def add_batch(self, experiment, iteration, instance, batch):
+        """
+        add_batch inserts all the values from the batch into the data table
+        and the series into the series table.
+        """
+        if batch.instance is not None:
+            instance = batch.instance
+
+        for table, row, exemplar in batch.rows:
+            if table not in self.inserts:
+                full = collections.OrderedDict(list(DatabaseWriter.exemplar.items())[:3])
+                full.update(exemplar)
+
+                if table not in self.tables:
+                    self.cur.execute(utils.create_table_stmt(table, full))
+                    self.tables.add(table)
+                self.inserts[table] = utils.insert_stmt(table, full)
+
+            self.cur.execute(self.inserts[table], [experiment, iteration, instance] + list(row.values()))
+
+        for side, field, start, step, samples in batch.series:
+            row = (experiment, iteration, instance, field, side, start, step, len(samples), series.pack(samples))
+            self.cur.execute(self.insert_series, row)
+
+        n = len(batch)
+        if n > 0:
+            sides, fields = batch.columns()
+
+            rows = itertools.izip(
+                itertools.repeat(experiment, n),
+                itertools.repeat(iteration, n),
+                itertools.repeat(instance, n),
+                fields,
+                sides,
+                batch.values,
+            )
+            self.cur.executemany(self.insert_data, rows)
+
+        if self.groups is not None:
+            for (side, field), vals in batch.groups():
+                self.groups.setdefault((experiment, side, field), []).extend(float(v) for v in vals)
+
+    def flush(self):
+        """
+        flush commits all the inserted values.
+        """
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.cur.close()
 
 
-def summarize_db(db):
+def create_db(db, directories=[], types=[], params_hint=None):
     conn = sqlite3.connect(db)
     conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur2 = conn.cursor()
 
-    # now that all the data is in the database, build the summary table
+    writer = DatabaseWriter(conn)
+
+    for fname in find_files(directories, types):
+        writer.add_file(fname, params_hint)
+
+    writer.close()
+    conn.close()
+    return
+
+
+def summary_exemplar():
+    """
+    summary_exemplar returns an exemplar row for the summary table.
+    """
     exemplar = collections.OrderedDict([
         ("experiment", 0),
         ("field", "example"),
         ("side", "client"),
     ])
     exemplar.update(stats([0.0]))
-    cur.execute(utils.create_table_stmt("summary", exemplar))
-    insert_summary = utils.insert_stmt("summary", exemplar)
+
+    return exemplar
+
+
+def read_groups(conn, experiments=None):
+    """
+    read_groups yields the values of each (experiment, side, field) from the
+    data and series tables, ordered by key, for the given experiment IDs or
+    all experiments if experiments is None. Broken experiments and samples
+    that are NaN are skipped.
+    """
+    cur = conn.cursor()
+    cur2 = conn.cursor()
+
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
 
     # get all the results for all the non-broken tests
-    query = 'SELECT data.* FROM data INNER JOIN experiments ON data.experiment=experiments.rowid WHERE broken!="true" ORDER BY data.experiment, data.side, data.field'
+    query = 'SELECT {0}.experiment, {0}.side, {0}.field, {0}.{1} FROM {0} INNER JOIN experiments ON {0}.experiment=experiments.rowid WHERE broken!="true"'
+    if experiments is not None:
+        query += ' AND {0}.experiment IN ' + '({})'.format(','.join(str(int(v)) for v in experiments))
+    query += ' ORDER BY {0}.experiment, {0}.side, {0}.field'
 
-    last = None
-    vals = []
-    for r in cur.execute(query):
-        r = collections.OrderedDict(r)
-        for c in ["iteration", "instance"]:
-            del r[c]
+    def key(r):
+        return (r[0], r[1], r[2])
 
-        if last != None and last['field'] != r['field']:
-            # add stats and insert the params
-            last.update(stats(vals))
-            cur2.execute(insert_summary, last.values())
-            vals = []
+    groups = []
 
-        if last == None or last['field'] != r['field']:
-            # first row or new set of params
-            last = collections.OrderedDict()
-            for k in r.keys():
-                last[k] = r[k]
+    rows = cur.execute(query.format("data", "value"))
+    groups.append((k, 0, [float(r[3]) for r in g]) for k, g in itertools.groupby(rows, key))
 
-            del last['value']
+    if "series" in tables:
+        rows = cur2.execute(query.format("series", "samples"))
+        groups.append((k, 1, drop_nan(numpy.concatenate([series.unpack(r[3]) for r in g])).tolist()) for k, g in itertools.groupby(rows, key))
 
-        vals.append(float(r['value']))
+    # both are ordered by key so we can merge them in case a field is in both
+    for k, parts in itertools.groupby(heapq.merge(*groups), lambda v: v[0]):
+        vals = []
+        for _, _, v in parts:
+            vals.extend(v)
 
-    if last != None:
-        # insert the final set of params
-        last.update(stats(vals))
-        cur2.execute(insert_summary, last.values())
+        yield k, vals
 
-    conn.commit()
+    cur.close()
+    cur2.close()
+
+
+def summarize_experiments(conn, experiments=None, ci=None):
+    """
+    summarize_experiments computes the summary rows for the given experiment
+    IDs, or all experiments if experiments is None. The summary table must
+    already exist. The statistics are computed in one grouped query over the
+    data and series tables with the summary aggregate from
+    utils.register_aggregates. If ci is a bootstrap.Bootstrap, the values of each group
+    are read instead so that confidence intervals can also be written to the
+    summary_ci table.
+    """
+    if ci is not None:
+        summarize_groups(conn, collections.OrderedDict(read_groups(conn, experiments)), ci=ci)
+        return
+
+    utils.register_aggregates(conn)
+
+    cur = conn.cursor()
+    cur2 = conn.cursor()
+
+    insert_summary = utils.insert_stmt("summary", summary_exemplar())
+
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+
+    # series rows are passed as blobs which the aggregates unpack
+    values = 'SELECT experiment, side, field, value AS v FROM data'
+    if "series" in tables:
+        values += ' UNION ALL SELECT experiment, side, field, samples AS v FROM series'
+
+    query = 'SELECT vals.experiment, vals.side, vals.field, summary(v) FROM ({}) AS vals INNER JOIN experiments ON vals.experiment=experiments.rowid WHERE broken!="true"'.format(values)
+    if experiments is not None:
+        query += ' AND vals.experiment IN ' + '({})'.format(','.join(str(int(e)) for e in experiments))
+    query += ' GROUP BY vals.experiment, vals.side, vals.field ORDER BY vals.experiment, vals.side, vals.field'
+
+    for experiment, side, field, res in cur.execute(query):
+        row = collections.OrderedDict([
+            ("experiment", experiment),
+            ("field", field),
+            ("side", side),
+        ])
+        row.update(format_stats(*json.loads(res)))
+        cur2.execute(insert_summary, list(row.values()))
 
     cur.close()
     cur2.close()
+
+
+def summarize_groups(conn, groups, skip=set(), ci=None):
+    """
+    summarize_groups inserts summary rows for values that are already grouped
+    by (experiment, side, field), skipping experiments in skip. The summary
+    table must already exist. If ci is a bootstrap.Bootstrap, confidence
+    intervals are also written to the summary_ci table.
+    """
+    cur = conn.cursor()
+
+    insert_summary = utils.insert_stmt("summary", summary_exemplar())
+
+    for key in sorted(groups.keys()):
+        experiment, side, field = key
+        if experiment in skip:
+            continue
+
+        row = collections.OrderedDict([
+            ("experiment", experiment),
+            ("field", field),
+            ("side", side),
+        ])
+        row.update(stats(groups[key]))
+        cur.execute(insert_summary, list(row.values()))
+
+    if ci is not None:
+        ci.write(conn, groups, skip)
+
+    cur.close()
+
+
+def directory_size(path):
+    """
+    directory_size returns the total size of the files under path.
+    """
+    total = 0
+    for dirpath, _, fnames in os.walk(path):
+        for fname in fnames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fname))
+            except OSError:
+                pass
+
+    return total
+
+
+def shard_directories(paths, root, index, count, method="hash"):
+    """
+    shard_directories returns the iteration directories in paths that belong
+    to shard index of count, in the same order. With the hash method, each
+    directory goes to the shard given by the CRC32 of its path relative to
+    root. With the size method, directories are assigned largest first to the
+    shard with the least data so far. Either way, every shard computes the
+    same assignment so each directory is in exactly one shard.
+    """
+    paths = list(paths)
+
+    if method == "hash":
+        keep = set(p for p in paths if (zlib.crc32(os.path.relpath(p, root)) & 0xffffffff) % count == index)
+    elif method == "size":
+        sizes = sorted((-directory_size(p), os.path.relpath(p, root), p) for p in paths)
+
+        keep = set()
+        loads = [(0, i) for i in range(count)]
+        for size, _, p in sizes:
+            load, i = heapq.heappop(loads)
+            if i == index:
+                keep.add(p)
+            heapq.heappush(loads, (load - size, i))
+    else:
+        raise ValueError("unknown shard method: {}".format(method))
+
+    return [p for p in paths if p in keep]
+
+
+# the iteration directories that collect and watch have already read so that
+# they can be run again on the same database without reading them twice
+ingested_exemplar = collections.OrderedDict([
+    ("path", "/path/to/output"),
+    ("time", 0.0),
+])
+
+
+def read_ingested(cur):
+    """
+    read_ingested creates the ingested table if it does not exist and
+    returns the set of iteration directories in it
+    """
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+    if "ingested" not in tables:
+        cur.execute(utils.create_table_stmt("ingested", ingested_exemplar))
+
+    return set(r[0] for r in cur.execute('SELECT path FROM ingested'))
+
+
+def resummarize(conn, experiments, ci=None):
+    """
+    resummarize replaces the summary (and summary_ci, if ci is set) rows for
+    the experiments with ones computed from the data and series tables
+    """
+    cur = conn.cursor()
+
+    ids = ','.join(str(int(v)) for v in experiments)
+    cur.execute('DELETE FROM summary WHERE experiment IN ({})'.format(ids))
+    if ci is not None:
+        import bootstrap
+        bootstrap.create_table(cur)
+        cur.execute('DELETE FROM summary_ci WHERE experiment IN ({})'.format(ids))
+
+    cur.close()
+
+    summarize_experiments(conn, experiments, ci)
+
+
+def collect(db, root, types=[], shard=None, ci=None):
+    """
+    collect walks the output directory from run.bash and writes the data and
+    summary tables to db in a single pass. The result is the same as writing
+    a database per namespace, combining them per parameter set, summarizing
+    those, and combining them again, without the intermediate databases.
+
+    If shard is set to (index, count, method), only that shard of the
+    iteration directories is read (see shard_directories) and the summary
+    table is not written since the shard may not have every iteration of an
+    experiment. The shards can be combined and then summarized.
+
+    If ci is a bootstrap.Bootstrap, confidence intervals are written to the
+    summary_ci table along with the summary.
+
+    Iteration directories that were already read into db, by collect or
+    watch, are skipped so collect can be run again as more results arrive.
+    Experiments that already had data are summarized again from db.
+    """
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    writer = DatabaseWriter(conn, keep_values=shard is None)
+    existing = set(writer.envs.values())
+
+    insert_ingested = utils.insert_stmt("ingested", ingested_exemplar)
+    done = read_ingested(cur)
+
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+    if shard is None and "summary" not in tables:
+        cur.execute(utils.create_table_stmt("summary", summary_exemplar()))
+
+    paths = iteration_directories(root)
+    if shard is not None:
+        paths = shard_directories(paths, root, *shard)
+        logging.info("collecting {} iteration directories for shard {}/{}".format(len(paths), shard[0], shard[1]))
+
+    paths = list(paths)
+    skipped = len([p for p in paths if p in done])
+    if skipped > 0:
+        logging.info("skipping {} iteration directories that were already read".format(skipped))
+        paths = [p for p in paths if p not in done]
+
+    # each top-level directory is a parameter set so we can summarize the
+    # experiments once we're done with all of its iterations
+    dirs = itertools.groupby(paths, key=os.path.dirname)
+    for params_dir, iterations in dirs:
+        logging.info("collecting {}".format(params_dir))
+
+        for path in iterations:
+            # the same files as watch, including the host files in the
+            # iteration directory such as interrupts.after.<host>
+            for fname in find_files([path], types):
+                writer.add_file(fname)
+
+            cur.execute(insert_ingested, (path, time.time()))
+
+        writer.flush()
+
+        if writer.groups is not None:
+            # the values we kept are only the new ones for experiments that
+            # were already in db
+            old = set(k[0] for k in writer.groups if k[0] in existing)
+            for k in [k for k in writer.groups if k[0] in old]:
+                del writer.groups[k]
+
+            if len(old) > 0:
+                resummarize(conn, old, ci)
+            summarize_groups(conn, writer.groups, writer.broken, ci)
+            writer.groups.clear()
+
+        conn.commit()
+
+    writer.close()
+    cur.close()
+    conn.close()
+
+
+def summarize_db(db, ci=None):
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    # now that all the data is in the database, build the summary table
+    cur.execute(utils.create_table_stmt("summary", summary_exemplar()))
+    summarize_experiments(conn, ci=ci)
+
+    conn.commit()
+
+    cur.close()
     conn.close()
     return
 
 
+def iteration_directories(root):
+    """
+    Yields the iteration directories created by run.bash under root, i.e.
+    <root>/<params>/<iteration>.
+    """
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+
+        for iteration in sorted(os.listdir(path)):
+            if iteration.isdigit() and os.path.isdir(os.path.join(path, iteration)):
+                yield os.path.join(path, iteration)
+
+
+def iteration_complete(path, settle):
+    """
+    iteration_complete checks whether run.bash has finished writing to the
+    iteration directory. The interrupts.after.<host> files are copied in as
+    the final step so we wait for one of those to appear and then for the
+    directory to be unchanged for settle seconds.
+    """
+    try:
+        names = os.listdir(path)
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return False
+
+    if not any(v.startswith("interrupts.after.") for v in names):
+        return False
+
+    return time.time() - mtime >= settle
+
+
+def watch(db, root, types=[], interval=30, settle=60, ci=None):
+    """
+    watch polls root for iteration directories as they are completed, adds
+    their files to db, and updates the summary table for the experiments
+    that changed. Uses inotify, if available, to notice new directories
+    without waiting for the next poll. Runs until interrupted.
+    """
+    try:
+        import inotify_simple
+    except ImportError:
+        inotify_simple = None
+
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    writer = DatabaseWriter(conn)
+
+    # keep track of the directories that we've already read so that we can
+    # restart the watch without reading everything again
+    insert_ingested = utils.insert_stmt("ingested", ingested_exemplar)
+    done = read_ingested(cur)
+
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+    if "summary" not in tables:
+        cur.execute(utils.create_table_stmt("summary", summary_exemplar()))
+    conn.commit()
+    logging.info("watching {}, {} directories already read".format(root, len(done)))
+
+    notifier = None
+    watched = {}
+    if inotify_simple is not None:
+        notifier = inotify_simple.INotify()
+        mask = inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO
+    else:
+        logging.info("inotify_simple not available, polling every {} seconds".format(interval))
+
+    def add_watch(path):
+        if notifier is not None and path not in watched:
+            try:
+                watched[path] = notifier.add_watch(path, mask)
+            except OSError:
+                pass
+
+    def rm_watch(path):
+        if path in watched:
+            try:
+                notifier.rm_watch(watched.pop(path))
+            except OSError:
+                pass
+
+    try:
+        while True:
+            changed = set()
+            pending = False
+
+            add_watch(root)
+            for path in iteration_directories(root):
+                if path in done:
+                    continue
+
+                add_watch(os.path.dirname(path))
+
+                if not iteration_complete(path, settle):
+                    add_watch(path)
+                    pending = True
+                    continue
+
+                logging.info("reading completed directory {}".format(path))
+                for fname in find_files([path], types):
+                    changed.add(writer.add_file(fname))
+
+                cur.execute(insert_ingested, (path, time.time()))
+                done.add(path)
+                rm_watch(path)
+
+            if len(changed) > 0:
+                writer.flush()
+                resummarize(conn, changed, ci)
+            conn.commit()
+
+            if len(changed) > 0:
+                logging.info("updated summary for {} experiments".format(len(changed)))
+
+            # check back sooner if there are directories waiting to settle
+            timeout = interval
+            if pending:
+                timeout = min(interval, max(settle, 1))
+
+            if notifier is None:
+                time.sleep(timeout)
+            else:
+                # wake up on the first event and then wait a bit for any
+                # other files that are created at the same time
+                notifier.read(timeout=timeout*1000, read_delay=1000)
+    except KeyboardInterrupt:
+        logging.info("stopped watching {}".format(root))
+
+    writer.close()
+    cur.close()
+    conn.close()
+
+
+# columns for the test parameters and the stats in the CSV output
+PARAMS_HEADERS = [
+    "environment",
+    "nic",
+    "num_vcpus",
+    "rate_limit",
+    "num_workers",
+    "num_simultaneous",
+    "cluster",
+    "instrumentation",
+    "offloading",
+    "pinning",
+    "gre",
+    "broken",
+    "workload",
+]
+
+STATS_HEADERS = [
+    "count",
+    "median",
+    "mean",
+    "stdev",
+    "min",
+    "p25th",
+    "p75th",
+    "p95th",
+    "max",
+]
+
+
 def main(directories=[], types=[], output_fh=sys.stdin, full_results=False, params_hint=None):
     values = {}
 
@@ -655,11 +1689,13 @@ def main(directories=[], types=[], output_fh=sys.stdin, full_results=False, para
         values[full_env]["paths"].add(path)
 
         with open(fname) as f:
-            for side, field, value in file_reader.readfile(f):
-                if not field in values[full_env][side]:
-                    values[full_env][side][field] = []
+            batch = file_reader.readbatch(f)
 
-                values[full_env][side][field].append({ "value": value, "source": fname })
+        for (side, field), vals in batch.groups():
+            if not field in values[full_env][side]:
+                values[full_env][side][field] = []
+
+            values[full_env][side][field].extend({ "value": value, "source": fname } for value in vals)
 
     # Collect a list of the full set of result types that we've seen across
     # all tests that we can normalize the output of each test to include all
@@ -674,20 +1710,7 @@ def main(directories=[], types=[], output_fh=sys.stdin, full_results=False, para
             for field in sorted(env[dirn].keys()):
                full_field_set[dirn].add(field)
 
-    headers = [
-                "environment",
-                "nic",
-                "num_vcpus",
-                "rate_limit",
-                "num_workers",
-                "num_simultaneous",
-                "cluster",
-                "instrumentation",
-                "offloading",
-                "pinning",
-                "gre",
-                "broken",
-                "workload",
+    headers = PARAMS_HEADERS + [
                 "side",
                 "field",
                 "instance",
@@ -701,17 +1724,7 @@ def main(directories=[], types=[], output_fh=sys.stdin, full_results=False, para
                     "value"
                   ])
     else:
-        headers.extend([
-                    "count",
-                    "median",
-                    "mean",
-                    "stdev",
-                    "min",
-                    "p25th",
-                    "p75th",
-                    "p95th",
-                    "max",
-                  ])
+        headers.extend(STATS_HEADERS)
 
     writer = csv.DictWriter(output_fh, fieldnames=headers)
     writer.writeheader()
@@ -739,30 +1752,47 @@ def main(directories=[], types=[], output_fh=sys.stdin, full_results=False, para
                     writer.writerow(results)
 
 
-def stats(vals):
-    outliers = None
-    if len(vals) > 0:
-        # compute number of outliers based on 1.5 * interquartile range
-        q1 = numpy.percentile(vals, 25)
-        q3 = numpy.percentile(vals, 75)
-        iqr = q3 - q1
-        outliers = len([i for i in vals if i < (q1 - 1.5*iqr) or i > (q3 + 1.5*iqr)])
-
-    # in preferred order
+def format_stats(count, vmin, p25, median, p75, p95, vmax, mean, stdev, outliers):
+    """
+    format_stats returns the summary columns in preferred order, formatted as
+    strings, all empty if there are no values
+    """
+    if count == 0:
+        return [("count", 0)] + [(k, "") for k in ("min", "p25th", "median", "p75th", "p95th", "max", "mean", "stdev", "outliers")]
+
+    # min and max are the values themselves, the rest are formatted the way
+    # that NumPy formats them
     return [
-        ("count", len(vals)),
-        ("min", str(min(vals)) if len(vals) > 0 else ""),
-        ("p25th", str(numpy.percentile(vals, 25)) if len(vals) > 0 else ""),
-        ("median", str(numpy.median(vals)) if len(vals) > 0 else ""),
-        ("p75th", str(numpy.percentile(vals, 75)) if len(vals) > 0 else ""),
-        ("p95th", str(numpy.percentile(vals, 95)) if len(vals) > 0 else ""),
-        ("max", str(max(vals)) if len(vals) > 0 else ""),
-        ("mean", str(numpy.mean(vals)) if len(vals) > 0 else ""),
-        ("stdev", str(numpy.std(vals)) if len(vals) > 0 else ""),
-        ("outliers", str(outliers) if len(vals) > 0 else ""),
+        ("count", count),
+        ("min", str(vmin)),
+        ("p25th", str(numpy.float64(p25))),
+        ("median", str(numpy.float64(median))),
+        ("p75th", str(numpy.float64(p75))),
+        ("p95th", str(numpy.float64(p95))),
+        ("max", str(vmax)),
+        ("mean", str(numpy.float64(mean))),
+        ("stdev", str(numpy.float64(stdev))),
+        ("outliers", str(outliers)),
     ]
 
 
+def stats(vals):
+    # sort so that the results don't depend on the order the values were read
+    vals = sorted(vals)
+
+    if len(vals) == 0:
+        return format_stats(0, *[None]*9)
+
+    # compute number of outliers based on 1.5 * interquartile range
+    q1 = numpy.percentile(vals, 25)
+    q3 = numpy.percentile(vals, 75)
+    iqr = q3 - q1
+    outliers = len([i for i in vals if i < (q1 - 1.5*iqr) or i > (q3 + 1.5*iqr)])
+
+    return format_stats(len(vals), min(vals), q1, numpy.median(vals), q3,
+        numpy.percentile(vals, 95), max(vals), numpy.mean(vals), numpy.std(vals), outliers)
+
+
 if __name__ == "__main__":
     sys.excepthook = exception_hook   # catch all unhandled exceptions
 
@@ -776,10 +1806,41 @@ if __name__ == "__main__":
     parser.add_argument("-d", "--db", dest='db', type=str, help='write data to database instead of CSV')
     parser.add_argument("-s", "--summarize", dest='summarize', action='store_true', help='generate summary table in database', default=False)
     parser.add_argument("-p", "--params", dest='params', type=str, help='params hint, passed to guess_test_parameters')
-    parser.add_argument("directories", metavar='TEST_DIRECTORIES', type=str, nargs='+',
+    parser.add_argument("-c", "--collect", metavar='DIR', type=str, help='write data and summary for all the results in output directory to database in one pass')
+    parser.add_argument("--shard", metavar='I/N', type=str, help='only collect shard I of N of the iteration directories (I starts at 0)')
+    parser.add_argument("--shard-by", choices=["hash", "size"], default="hash", help='how to assign iteration directories to shards')
+    parser.add_argument("--bootstrap", metavar='N', type=int, default=0, help='also compute bootstrap confidence intervals with N resamples when summarizing')
+    parser.add_argument("--confidence", type=float, default=0.95, help='confidence level for bootstrap intervals')
+    parser.add_argument("--seed", type=int, default=0, help='seed for bootstrap resampling')
+    parser.add_argument("--processes", type=int, default=1, help='processes to bootstrap with')
+    parser.add_argument("-w", "--watch", metavar='DIR', type=str, help='watch output directory and add iterations to database as they complete')
+    parser.add_argument("--interval", type=int, default=30, help='seconds between scans in watch mode')
+    parser.add_argument("--settle", type=int, default=60, help='seconds an iteration directory must be unchanged before it is read in watch mode')
+    parser.add_argument("directories", metavar='TEST_DIRECTORIES', type=str, nargs='*',
                    help='Test directories to read')
     args = parser.parse_args()
 
+    if not args.watch and not args.collect and len(args.directories) == 0:
+        parser.error("too few arguments")
+
+    shard = None
+    if args.shard:
+        try:
+            index, count = [int(v) for v in args.shard.split("/")]
+        except ValueError:
+            parser.error("invalid shard: {}".format(args.shard))
+        if count < 1 or not 0 <= index < count:
+            parser.error("invalid shard: {}".format(args.shard))
+        if not args.collect:
+            parser.error("--shard requires --collect")
+
+        shard = (index, count, args.shard_by)
+
+    ci = None
+    if args.bootstrap > 0:
+        import bootstrap
+        ci = bootstrap.Bootstrap(args.bootstrap, args.confidence, args.seed, args.processes)
+
     if args.output == "-":
         out_fh = sys.stdout
     else:
@@ -792,15 +1853,30 @@ if __name__ == "__main__":
     log_format="%(asctime)s: %(levelname)s %(message)s"
     logging.basicConfig(level=level, format=log_format)
 
-    if args.db != None:
+    if args.watch:
+        if args.db is None:
+            logging.error('expected database to write to when watching')
+            sys.exit(1)
+
+        watch(args.db, args.watch, args.type, args.interval, args.settle, ci)
+    elif args.collect:
+        if args.db is None:
+            logging.error('expected database to write to when collecting')
+            sys.exit(1)
+
+        collect(args.db, args.collect, args.type, shard, ci)
+    elif args.db != None:
         create_db(args.db, args.directories, args.type, args.params)
         if args.summarize:
-            summarize_db(args.db)
+            summarize_db(args.db, ci)
     elif args.summarize:
         if len(args.directories) != 1:
             logging.error('expected database argument to generate summary table for')
             sys.exit(1)
 
-        summarize_db(args.directories[0])
+        summarize_db(args.directories[0], ci)
     else:
         main(directories=args.directories, types=args.type, output_fh=out_fh, full_results=args.full_results, params_hint=args.params)
+
+    if out_fh is not sys.stdout:
+        out_fh.close()
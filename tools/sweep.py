@@ -0,0 +1,510 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Plans a sweep from a params file like sweep.bash does but skips the runs that
+already exist in the output directory or in result databases and, given a
+list of head nodes, assigns the remaining runs to the heads so that they all
+finish around the same time based on how long the runs took before.
+
+With --target, the number of iterations for each parameter set comes from the
+variance of the target fields in the databases instead of ITERS: enough
+iterations to get the confidence interval of the mean within --width of the
+mean, so that noisy parameter sets get more iterations and stable ones fewer.
+
+Usage: python sweep.py -d results.db --heads en7,en10 -o plan /scratch/test params.bash
+'''
+
+import collections
+import heapq
+import itertools
+import logging
+import math
+import os
+import re
+import sqlite3
+import subprocess
+
+import utils
+
+# variables from the params file in the order that sweep.bash loops over them
+VARIABLES = [
+    "CONCURRENT", "TYPES", "KVM_DRIVERS", "NCPUS", "OFFLOAD", "RATES",
+    "NWORKERS", "QUERIES", "INSTRUMENT", "PINNING", "GRE", "STRESS_CPU",
+    "STRESS_IO", "STRESS_MEM", "DURATION", "ITERS",
+]
+
+# parts of the name that run.bash adds based on where it runs
+RUNTIME_PARTS = set(["colocated", "noht"])
+
+# params that do not come from the sweep
+IGNORED_PARAMS = set(["iteration", "instance", "cluster", "broken", "colocated", "hyperthreading"])
+
+
+def load_params(fname):
+    """
+    Sources the params file with bash and returns a map from each variable in
+    VARIABLES to its words. Unset variables have no words.
+    """
+    script = '. "$1"; for v in {}; do echo "$v=${{!v}}"; done'.format(" ".join(VARIABLES))
+    out = subprocess.check_output(["bash", "-c", script, "sweep", fname])
+
+    params = {}
+    for line in out.splitlines():
+        k, v = line.split("=", 1)
+        params[k] = v.split()
+
+    return params
+
+
+def runs(params, iterations=None):
+    """
+    Yields an OrderedDict with the run.bash arguments for each run in the
+    sweep in the same order as sweep.bash. If set, iterations is called with
+    the first run of each parameter set and returns how many iterations to
+    run instead of ITERS.
+    """
+    duration = params["DURATION"][0] if params["DURATION"] else ""
+    iters = int(params["ITERS"][0]) if params["ITERS"] else 0
+
+    for concurrent, vmtype in itertools.product(params["CONCURRENT"], params["TYPES"]):
+        drivers = params["KVM_DRIVERS"]
+        # containers ignore the driver
+        if vmtype == "container":
+            drivers = drivers[:1]
+
+        space = itertools.product(drivers, params["NCPUS"], params["OFFLOAD"],
+            params["RATES"], params["NWORKERS"], params["QUERIES"],
+            params["INSTRUMENT"], params["PINNING"], params["GRE"],
+            params["STRESS_CPU"], params["STRESS_IO"], params["STRESS_MEM"])
+
+        for driver, ncpus, offload, rate, nworkers, query, instrument, pinning, gre, stress_cpu, stress_io, stress_mem in space:
+            # filter out parameter sets where pinning and gre are both true
+            if gre != "false" and pinning != "false":
+                continue
+
+            nrequests, url = query.split(",", 1)
+
+            n = iters
+            for i in itertools.count(1):
+                run = collections.OrderedDict([
+                    ("iter", i),
+                    ("duration", duration),
+                    ("concurrent", concurrent),
+                    ("vmtype", vmtype),
+                    ("driver", driver),
+                    ("ncpus", ncpus),
+                    ("offload", offload),
+                    ("rate", rate),
+                    ("nworkers", nworkers),
+                    ("url", url),
+                    ("nrequests", nrequests),
+                    ("instrument", instrument),
+                    ("pinning", pinning),
+                    ("gre", gre),
+                    ("stress_cpu", stress_cpu),
+                    ("stress_io", stress_io),
+                    ("stress_mem", stress_mem),
+                ])
+
+                if i == 1 and iterations is not None:
+                    n = iterations(run)
+                if i > n:
+                    break
+
+                yield run
+
+
+def command(out, run):
+    """
+    Returns the run.bash command for the run
+    """
+    return "bash /root/run.bash {} {}".format(out, " ".join(str(v) for v in run.values()))
+
+
+def run_name(run):
+    """
+    Returns the directory name that run.bash uses for the run, without the
+    parts that depend on the node it runs on (see RUNTIME_PARTS).
+    """
+    urlname = re.sub(r"(https?)[^=]+=?", r"\1", run["url"], count=1)
+
+    driver = run["driver"]
+    # containers ignore the driver
+    if run["vmtype"] == "container":
+        driver = "host"
+
+    parts = [run["vmtype"], driver, run["ncpus"], run["offload"], run["rate"],
+        run["nworkers"], run["concurrent"], urlname]
+
+    if run["instrument"] == "true":
+        parts.append("instr")
+    if run["pinning"] == "true":
+        parts.append("pinning")
+    if run["gre"] == "true":
+        parts.append("gre")
+    if int(run["stress_cpu"]) > 0:
+        parts.append("stresscpu{}".format(run["stress_cpu"]))
+    if int(run["stress_io"]) > 0:
+        parts.append("stressio{}".format(run["stress_io"]))
+    if int(run["stress_mem"]) > 0:
+        parts.append("stressmem{}".format(run["stress_mem"]))
+
+    return "-".join(parts)
+
+
+def strip_runtime(name):
+    """
+    Removes the parts that depend on the node from a directory name
+    """
+    return "-".join(p for p in name.split("-") if p not in RUNTIME_PARTS)
+
+
+def params_key(params):
+    """
+    Returns a key for the params from guess_test_parameters or the
+    experiments table that only depends on the swept parameters.
+    """
+    return tuple((k, str(v)) for k, v in params.items() if k not in IGNORED_PARAMS)
+
+
+def run_key(out, run):
+    """
+    Returns the params_key for the run
+    """
+    params, _ = utils.guess_test_parameters(os.path.join(out, run_name(run), str(run["iter"])))
+    return params_key(params)
+
+
+def existing_runs(out):
+    """
+    Returns the set of (name, iteration) for the runs in the output directory,
+    with names from strip_runtime.
+    """
+    res = set()
+    if not os.path.isdir(out):
+        return res
+
+    for name in os.listdir(out):
+        path = os.path.join(out, name)
+        if not os.path.isdir(path):
+            continue
+
+        for iteration in os.listdir(path):
+            if iteration.isdigit():
+                res.add((strip_runtime(name), int(iteration)))
+
+    return res
+
+
+def read_experiments(cur):
+    """
+    Returns a map from experiment ID to params_key for the experiments table
+    """
+    res = {}
+    for r in cur.execute('SELECT rowid,* FROM experiments'):
+        params = collections.OrderedDict(r)
+        del params["rowid"]
+        res[r["rowid"]] = params_key(params)
+
+    return res
+
+
+def database_runs(db):
+    """
+    Returns the set of (params_key, iteration) for the runs in the database
+    """
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    experiments = read_experiments(cur)
+
+    res = set()
+    for r in cur.execute('SELECT DISTINCT experiment, iteration FROM data'):
+        res.add((experiments[r["experiment"]], r["iteration"]))
+
+    conn.close()
+
+    return res
+
+
+def durations(db):
+    """
+    Returns a map from params_key to the mean time taken by the runs in the
+    database. A run takes as long as its slowest instance of ab.
+    """
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    experiments = read_experiments(cur)
+
+    times = {}
+    query = 'SELECT experiment, iteration, MAX(value) AS taken FROM data WHERE field="ab_time_taken" GROUP BY experiment, iteration'
+    for r in cur.execute(query):
+        times.setdefault(experiments[r["experiment"]], []).append(r["taken"])
+
+    conn.close()
+
+    return dict((k, sum(v) / len(v)) for k, v in times.items())
+
+
+def z_score(confidence):
+    """
+    z_score returns z such that a standard normal is within +/- z with the
+    given probability
+    """
+    lo, hi = 0.0, 10.0
+    for i in range(100):
+        mid = (lo + hi) / 2
+        if math.erf(mid / math.sqrt(2)) < confidence:
+            lo = mid
+        else:
+            hi = mid
+
+    return hi
+
+
+def t_within(t, df):
+    """
+    t_within returns the probability that a Student's t with df (a positive
+    integer) degrees of freedom is within +/- t (Abramowitz and Stegun
+    26.7.3 and 26.7.4)
+    """
+    theta = math.atan(t / math.sqrt(df))
+    c2 = math.cos(theta)**2
+
+    total, term = 1.0, 1.0
+    if df % 2 == 1:
+        for k in range(1, (df - 1) // 2):
+            term *= c2 * (2.0*k) / (2*k + 1)
+            total += term
+
+        if df == 1:
+            return 2 * theta / math.pi
+
+        return 2 / math.pi * (theta + math.sin(theta) * math.cos(theta) * total)
+
+    for k in range(1, df // 2):
+        term *= c2 * (2.0*k - 1) / (2*k)
+        total += term
+
+    return math.sin(theta) * total
+
+
+def t_score(confidence, df, cache={}):
+    """
+    t_score returns t such that a Student's t with df degrees of freedom is
+    within +/- t with the given probability
+    """
+    if df > 100:
+        # the series takes longer to sum than the expansion is off by
+        z = z_score(confidence)
+        return z + (z**3 + z) / (4*df) + (5*z**5 + 16*z**3 + 3*z) / (96*df**2)
+
+    if (confidence, df) not in cache:
+        lo, hi = 0.0, 16.0
+        while t_within(hi, df) < confidence:
+            lo, hi = hi, hi * 2
+
+        for i in range(100):
+            mid = (lo + hi) / 2
+            if t_within(mid, df) < confidence:
+                lo = mid
+            else:
+                hi = mid
+
+        cache[(confidence, df)] = hi
+
+    return cache[(confidence, df)]
+
+
+def iterations_needed(ratio, confidence):
+    """
+    iterations_needed returns the smallest n (at least two) for which the
+    confidence interval of the mean of n samples, t with n-1 degrees of
+    freedom times the stdev over sqrt(n), is within the target width given
+    ratio, the variance over the squared target width.
+    """
+    # t is always more than z so there is no need to check fewer
+    n = max(2, int(math.ceil(z_score(confidence)**2 * ratio)))
+    while t_score(confidence, n - 1)**2 * ratio > n:
+        n += 1
+
+    return n
+
+
+def required_iterations(db, fields, width, confidence=0.95):
+    """
+    Returns a map from params_key to the number of iterations needed for the
+    confidence interval of the mean of each field to be within width times
+    the mean (the largest over the fields) and the number of iterations that
+    the estimate is based on. Each iteration counts as one sample, the mean
+    over the instances (or over all the samples, for fields in the series
+    table). Parameter sets with fewer than two iterations have no estimate.
+    """
+    # only needed when planning iterations, sweep.py starts faster without it
+    import numpy
+
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+    utils.register_aggregates(conn)
+    cur = conn.cursor()
+
+    experiments = read_experiments(cur)
+    broken = set(r[0] for r in cur.execute('SELECT rowid FROM experiments WHERE broken="true"'))
+    tables = [r[0] for r in cur.execute('SELECT name FROM sqlite_master WHERE type="table"')]
+
+    clause = 'field IN ({})'.format(','.join('?'*len(fields)))
+    args = list(fields)
+
+    query = 'SELECT experiment, field, iteration, value AS v FROM data WHERE ' + clause
+    if "series" in tables:
+        query += ' UNION ALL SELECT experiment, field, iteration, samples AS v FROM series WHERE ' + clause
+        args += fields
+
+    query = 'SELECT experiment, field, mean(v) FROM ({}) GROUP BY experiment, field, iteration'.format(query)
+    rows = [tuple(r) for r in cur.execute(query, args) if r[0] not in broken and r[2] is not None]
+
+    conn.close()
+
+    if len(rows) == 0:
+        return {}
+
+    exps = numpy.array([r[0] for r in rows], dtype=numpy.int64)
+    codes = numpy.array([fields.index(r[1]) for r in rows], dtype=numpy.int64)
+    values = numpy.array([r[2] for r in rows], dtype=numpy.float64)
+
+    # mean and variance of the iterations for each (experiment, field)
+    order = numpy.lexsort((codes, exps))
+    exps, codes, values = exps[order], codes[order], values[order]
+
+    starts = numpy.flatnonzero(numpy.r_[True, (exps[1:] != exps[:-1]) | (codes[1:] != codes[:-1])])
+    counts = numpy.diff(numpy.r_[starts, len(values)])
+
+    mean = numpy.add.reduceat(values, starts) / counts
+    dev = values - numpy.repeat(mean, counts)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        var = numpy.add.reduceat(dev*dev, starts) / (counts - 1)
+        ratio = var / (width * mean)**2
+
+    res = {}
+    for experiment, n, v, r in zip(exps[starts].tolist(), counts.tolist(), var.tolist(), ratio.tolist()):
+        if n < 2 or numpy.isnan(r) or numpy.isinf(r):
+            continue
+
+        # constant fields only need the iterations they have
+        k = 0
+        if v > 0:
+            k = iterations_needed(r, confidence)
+
+        key = experiments[experiment]
+        prev = res.get(key, (0, n))
+        res[key] = (max(prev[0], int(k)), min(prev[1], n))
+
+    return res
+
+
+def schedule(jobs, heads):
+    """
+    Assigns the (estimate, command) jobs to the heads, longest first, always
+    picking the head that would finish first. Returns a map from head to
+    its list of commands and a map from head to its expected total time.
+    """
+    plan = collections.OrderedDict((h, []) for h in heads)
+    loads = [(0, i, h) for i, h in enumerate(heads)]
+
+    for estimate, cmd in sorted(jobs, key=lambda j: -j[0]):
+        load, i, h = heapq.heappop(loads)
+        plan[h].append(cmd)
+        heapq.heappush(loads, (load + estimate, i, h))
+
+    return plan, dict((h, load) for load, _, h in loads)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='plan a sweep of the parameters from a file')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-d', '--db', dest='dbs', action='append', default=[], help='database with runs to skip and previous times')
+    parser.add_argument('--heads', type=str, help='comma-separated head nodes to schedule runs on')
+    parser.add_argument('--target', dest='targets', action='append', default=[], help='field to plan the number of iterations for from the databases')
+    parser.add_argument('--width', type=float, default=0.05, help='target half-width of the confidence interval relative to the mean')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level for --target')
+    parser.add_argument('--min-iters', type=int, default=3, help='fewest iterations to run for a parameter set with --target')
+    parser.add_argument('--max-iters', type=int, default=50, help='most iterations to run for a parameter set with --target')
+    parser.add_argument('-o', '--output', type=str, default='.', help='directory to write a file of commands per head to')
+    parser.add_argument('out', metavar='DIR', type=str, help='directory to store results')
+    parser.add_argument('params', metavar='PARAMS', type=str, help='file containing parameters to sweep')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    params = load_params(args.params)
+
+    existing = existing_runs(args.out)
+    done = set()
+    history = {}
+    needed = {}
+    for db in args.dbs:
+        done.update(database_runs(db))
+        history.update(durations(db))
+        if len(args.targets) > 0:
+            needed.update(required_iterations(db, args.targets, args.width, args.confidence))
+
+    iterations = None
+    if len(args.targets) > 0:
+        def iterations(run):
+            """ planned iterations, ITERS if there isn't enough data yet """
+            key = run_key(args.out, run)
+            if key not in needed:
+                return int(params["ITERS"][0]) if params["ITERS"] else 0
+
+            need, have = needed[key]
+            n = min(args.max_iters, max(args.min_iters, need))
+            logging.debug("{}: {} iterations, need {}".format(run_name(run), have, n))
+            return n
+
+    # runs we have no history for are assumed to take DURATION seconds
+    default = float(params["DURATION"][0]) if params["DURATION"] else 0
+
+    skipped = 0
+    jobs = []
+    for run in runs(params, iterations):
+        key = run_key(args.out, run)
+        if (run_name(run), run["iter"]) in existing or (key, run["iter"]) in done:
+            logging.debug("skipping {} iteration {}".format(run_name(run), run["iter"]))
+            skipped += 1
+            continue
+
+        cmd = command(args.out, run)
+        if args.heads is None:
+            print(cmd)
+        else:
+            jobs.append((history.get(key, default), cmd))
+
+    logging.info("skipped {} runs that are already done".format(skipped))
+
+    if args.heads is not None:
+        plan, loads = schedule(jobs, args.heads.split(","))
+
+        if not os.path.isdir(args.output):
+            os.makedirs(args.output)
+
+        for h, cmds in plan.items():
+            with open(os.path.join(args.output, h), 'w') as f:
+                for cmd in cmds:
+                    f.write(cmd + "\n")
+
+            logging.info("{}: {} runs, expected to take {:.0f} seconds".format(h, len(cmds), loads[h]))
@@ -6,7 +6,9 @@
 functions shared by mulitple tools
 '''
 
+import array
 import collections
+import json
 import logging
 import os
 import re
@@ -209,6 +211,8 @@ def columns(exemplar, skipCols):
             cols.append((k, 'REAL'))
         elif type(v) is types.NoneType:
             cols.append((k, 'STRING'))
+        elif type(v) is buffer:
+            cols.append((k, 'BLOB'))
         else:
             logging.info("unknown type for {}: {}".format(k, type(v)))
 
@@ -240,3 +244,176 @@ def insert_stmt(name, exemplar, skipCols=[]):
     logging.info(insert)
 
     return insert
+
+
+class Values(object):
+    """
+    Values is the accumulator for the aggregates in register_aggregates: it
+    packs the non-NULL values of a group into an array of doubles. A BLOB is
+    taken to be the packed samples of a row from the series table and adds
+    all of them, so the aggregates can run over data and series together.
+    Samples that are NaN, such as the seconds of ab_latency_mean without any
+    requests, are skipped like NULLs.
+    """
+    def __init__(self):
+        self.values = array.array('d')
+
+    def step(self, value, *args):
+        if value is None:
+            return
+        if isinstance(value, buffer):
+            self.values.fromstring(str(value))
+        else:
+            self.values.append(float(value))
+
+    def sorted(self):
+        """
+        sorted returns the values that are not NaN as a sorted NumPy array
+        """
+        import numpy
+
+        vals = numpy.frombuffer(self.values, dtype=numpy.float64)
+
+        return numpy.sort(vals[~numpy.isnan(vals)])
+
+    def finalize(self):
+        vals = self.sorted()
+        if len(vals) == 0:
+            return None
+
+        return float(self.compute(vals))
+
+
+class Samples(object):
+    """
+    samples(value) counts the values like COUNT except that a series row
+    counts as its samples that are not NaN
+    """
+    def __init__(self):
+        self.count = 0
+
+    def step(self, value):
+        if value is None:
+            return
+        if isinstance(value, buffer):
+            import numpy
+
+            self.count += numpy.count_nonzero(~numpy.isnan(numpy.frombuffer(value, dtype=numpy.float64)))
+        elif value == value:
+            self.count += 1
+
+    def finalize(self):
+        return self.count
+
+
+class Median(Values):
+    """
+    median(value)
+    """
+    def compute(self, vals):
+        import numpy
+
+        return numpy.median(vals)
+
+
+class Quantile(Values):
+    """
+    quantile(value, q) with q between 0 and 1, interpolated like
+    numpy.percentile
+    """
+    def step(self, value, q):
+        self.q = q
+        Values.step(self, value)
+
+    def compute(self, vals):
+        import numpy
+
+        return numpy.percentile(vals, 100. * self.q)
+
+
+class Mean(Values):
+    """
+    mean(value), the same as AVG except that it sums like numpy.mean
+    """
+    def compute(self, vals):
+        import numpy
+
+        return numpy.mean(vals)
+
+
+class Stdev(Values):
+    """
+    stdev(value), the population standard deviation like numpy.std
+    """
+    def compute(self, vals):
+        import numpy
+
+        return numpy.std(vals)
+
+
+class IqrOutliers(Values):
+    """
+    iqr_outliers(value) counts the values more than 1.5 times the
+    interquartile range below the first quartile or above the third
+    """
+    def compute(self, vals):
+        import numpy
+
+        q1, q3 = numpy.percentile(vals, [25, 75])
+        iqr = q3 - q1
+
+        return numpy.count_nonzero((vals < q1 - 1.5*iqr) | (vals > q3 + 1.5*iqr))
+
+    def finalize(self):
+        vals = self.sorted()
+        if len(vals) == 0:
+            return None
+
+        return int(self.compute(vals))
+
+
+class Summary(Values):
+    """
+    summary(value) computes all the statistics in the summary table at once,
+    with only one pass over the rows, and returns them as a JSON list in the
+    order of the columns: count, min, p25th, median, p75th, p95th, max, mean,
+    stdev, and outliers.
+    """
+    def finalize(self):
+        import numpy
+
+        vals = self.sorted()
+        if len(vals) == 0:
+            return None
+
+        q1, q3, p95 = numpy.percentile(vals, [25, 75, 95])
+
+        return json.dumps([
+            len(vals),
+            float(vals[0]),
+            float(q1),
+            float(numpy.median(vals)),
+            float(q3),
+            float(p95),
+            float(vals[-1]),
+            float(numpy.mean(vals)),
+            float(numpy.std(vals)),
+            int(IqrOutliers().compute(vals)),
+        ])
+
+
+def register_aggregates(conn):
+    """
+    register_aggregates adds the samples, median, quantile, mean, stdev,
+    iqr_outliers, and summary aggregates to a connection so that queries can
+    compute the same statistics as the summary table, e.g.:
+
+        SELECT experiment, field, quantile(value, 0.95) FROM data GROUP BY experiment, field
+    """
+    conn.create_aggregate("samples", 1, Samples)
+    conn.create_aggregate("median", 1, Median)
+    conn.create_aggregate("quantile", 2, Quantile)
+    conn.create_aggregate("mean", 1, Mean)
+    conn.create_aggregate("stdev", 1, Stdev)
+    conn.create_aggregate("iqr_outliers", 1, IqrOutliers)
+    conn.create_aggregate("summary", 1, Summary)
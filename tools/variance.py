@@ -0,0 +1,252 @@
+#!/usr/bin/python
+
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+
+'''
+Attributes the variance of every field to the swept parameters (pinning,
+offloading, gre, stress_cpu, ...). For each field and parameter, the values
+from all the experiments are split by the level of the parameter and the
+fraction of the total variance that is between the levels (eta squared of a
+one-way ANOVA on the main effect) is written, ranked for each field, to the
+variance table along with the F statistic.
+
+The sums of squares only need the count, mean, and stdev of each experiment
+so they come from the pivoted summary table (see pivot.py), with all the
+fields at once as matrix products rather than a model per field. Parameters
+that were swept together (e.g. two that always change at the same time) are
+each credited with the same variance.
+
+Usage: python variance.py -o variance.csv results.db
+'''
+
+import collections
+import csv
+import logging
+import sqlite3
+import sys
+
+import numpy
+
+import pivot
+import utils
+
+from summarize_test_results import STATS_HEADERS
+
+exemplar = collections.OrderedDict([
+    ("side", "client"),
+    ("field", "example"),
+    ("param", "pinning"),
+    ("rank", 0),
+    ("levels", 0),
+    ("count", 0),
+    ("eta2", 0.0),
+    ("f", 0.0),
+])
+
+# params that are never attributed variance
+IGNORED_PARAMS = set(["broken"])
+
+# fields to decompose at a time, bounds the memory for wide sweeps
+BLOCK = 1024
+
+
+def design(params, experiments, names):
+    """
+    design returns the names that have more than one level among the
+    experiments, an indicator matrix with a row for each level of each of
+    them and a column for each experiment, and the index of the first row of
+    each name.
+    """
+    swept = []
+    starts = []
+    rows = []
+
+    count = 0
+    for name in names:
+        vals = [params[e].get(name) for e in experiments]
+        levels = sorted(set(vals))
+        if len(levels) < 2:
+            continue
+
+        index = dict((v, i) for i, v in enumerate(levels))
+        codes = numpy.array([index[v] for v in vals], dtype=numpy.int64)
+
+        swept.append(name)
+        starts.append(count)
+        rows.append((codes == numpy.arange(len(levels))[:, None]).astype(numpy.float64))
+        count += len(levels)
+
+    if len(swept) == 0:
+        return [], numpy.zeros(0, dtype=numpy.int64), numpy.zeros((0, len(experiments)))
+
+    return swept, numpy.array(starts, dtype=numpy.int64), numpy.vstack(rows)
+
+
+def decompose(counts, means, stdevs, indicator, starts):
+    """
+    decompose returns the eta squared, F statistic, and number of levels
+    with values for each param (rows) and field (columns), given the count,
+    mean, and population stdev of each experiment (rows) and field (columns).
+    Results are NaN for fields that do not vary or params that only have one
+    level for a field.
+    """
+    missing = numpy.isnan(counts) | (counts == 0)
+    n = numpy.where(missing, 0, counts)
+    m = numpy.where(missing, 0, means)
+    s = numpy.where(missing | numpy.isnan(stdevs), 0, stdevs)
+
+    total = n.sum(axis=0)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        # center on the grand mean of each field so the sums of squares do
+        # not lose precision to large means
+        grand = (n * m).sum(axis=0) / total
+        dev = numpy.where(missing, 0, m - grand)
+
+        # total sum of squares is within each experiment plus between them
+        sst = (n * (s*s + dev*dev)).sum(axis=0)
+
+        # between the levels of each param
+        level_n = indicator.dot(n)
+        level_sum = indicator.dot(n * dev)
+        ssl = numpy.where(level_n > 0, level_sum * level_sum / level_n, 0)
+
+        ssb = numpy.add.reduceat(ssl, starts, axis=0)
+        levels = numpy.add.reduceat((level_n > 0).astype(numpy.int64), starts, axis=0)
+
+        eta2 = numpy.clip(ssb / sst, 0, 1)
+        f = (ssb / (levels - 1)) / ((sst - ssb) / (total - levels))
+
+    bad = (sst <= 0) | (levels < 2)
+    eta2[bad] = numpy.nan
+    f[bad] = numpy.nan
+
+    return eta2, f, levels
+
+
+def attribute(db, names=None, fields=[]):
+    """
+    attribute returns a row for each field and swept param (or the given
+    param names), ranked within each field by the eta squared.
+    """
+    experiments, columns, matrix = pivot.load(db, mmap=True)
+    params, headers = pivot.read_params(db)
+
+    keep = [i for i, e in enumerate(experiments) if params[e].get("broken") != "true"]
+    experiments = [experiments[i] for i in keep]
+
+    if names is None:
+        names = [k for k in headers if k not in IGNORED_PARAMS]
+
+    swept, starts, indicator = design(params, experiments, names)
+    if len(swept) == 0:
+        return []
+
+    logging.info("attributing variance to {}".format(", ".join(swept)))
+
+    # (side, field) of each group of stats columns
+    width = len(STATS_HEADERS)
+    suffix = len(STATS_HEADERS[0]) + 1
+    keys = [tuple(c[:-suffix].split("_", 1)) for c in columns[::width]]
+
+    wanted = numpy.arange(len(keys))
+    if len(fields) > 0:
+        wanted = numpy.array([i for i, k in enumerate(keys) if k[1] in fields], dtype=numpy.int64)
+
+    rows = numpy.array(keep, dtype=numpy.int64)
+
+    count_col = STATS_HEADERS.index("count")
+    mean_col = STATS_HEADERS.index("mean")
+    stdev_col = STATS_HEADERS.index("stdev")
+
+    res = []
+    for i in range(0, len(wanted), BLOCK):
+        block = wanted[i:i+BLOCK]
+
+        counts = matrix[:, block*width + count_col][rows]
+        means = matrix[:, block*width + mean_col][rows]
+        stdevs = matrix[:, block*width + stdev_col][rows]
+
+        eta2, f, levels = decompose(counts, means, stdevs, indicator, starts)
+        total = numpy.nan_to_num(counts).sum(axis=0)
+
+        # rank the params for each field
+        p, k = numpy.nonzero(~numpy.isnan(eta2))
+        order = numpy.lexsort((-eta2[p, k], k))
+        p, k = p[order], k[order]
+        first = numpy.r_[True, k[1:] != k[:-1]]
+        ranks = numpy.arange(len(k)) - numpy.maximum.accumulate(numpy.where(first, numpy.arange(len(k)), 0)) + 1
+
+        for pi, ki, rank in zip(p.tolist(), k.tolist(), ranks.tolist()):
+            side, field = keys[block[ki]]
+            res.append(collections.OrderedDict([
+                ("side", side),
+                ("field", field),
+                ("param", swept[pi]),
+                ("rank", rank),
+                ("levels", int(levels[pi, ki])),
+                ("count", int(total[ki])),
+                ("eta2", float(eta2[pi, ki])),
+                ("f", None if numpy.isnan(f[pi, ki]) or numpy.isinf(f[pi, ki]) else float(f[pi, ki])),
+            ]))
+
+    return res
+
+
+def write_table(conn, rows):
+    """
+    write_table replaces the variance table with rows
+    """
+    cur = conn.cursor()
+
+    cur.execute('DROP TABLE IF EXISTS variance')
+    cur.execute(utils.create_table_stmt("variance", exemplar))
+    cur.executemany(utils.insert_stmt("variance", exemplar), [list(r.values()) for r in rows])
+
+    conn.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='attribute the variance of each field to the swept parameters')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    parser.add_argument('-p', '--param', dest='params', action='append', default=[], help='parameter to attribute variance to (default: all that were swept)')
+    parser.add_argument('-f', '--field', dest='fields', action='append', default=[], help='field to attribute the variance of (default: all)')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, help='also write the ranked results to a CSV file')
+    parser.add_argument('db', metavar='DB', type=str, help='database to read and write the variance table to')
+
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+
+    log_format='%(asctime)s: %(levelname)s %(message)s'
+    logging.basicConfig(level=level, format=log_format)
+
+    rows = attribute(args.db, args.params or None, args.fields)
+
+    top = collections.Counter(r["param"] for r in rows if r["rank"] == 1)
+    for param, count in top.most_common():
+        logging.info("{} explains the most variance for {} fields".format(param, count))
+
+    conn = sqlite3.connect(args.db)
+    write_table(conn, rows)
+    conn.close()
+
+    if args.output:
+        if args.output == '-':
+            out_fh = sys.stdout
+        else:
+            out_fh = open(args.output, 'w')
+
+        writer = csv.DictWriter(out_fh, fieldnames=list(exemplar.keys()))
+        writer.writeheader()
+        for r in rows:
+            writer.writerow(r)
+
+        if out_fh is not sys.stdout:
+            out_fh.close()